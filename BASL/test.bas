@@ -27,3 +27,27 @@ exit
 # 注:只有adb ocr click 这三个会解析子句，其他的都不会
 # 注:adb ocr 会产生返回值并默认存放到本地变量_RET中，但click不会产生返回值(_RET永远为None)
 
+# 注:ocr 可以在图片路径后用 by 指定相似度算法: exact(默认) | tolerance(单通道容差,默认16) | mae | ncc,
+#    如 ocr 800,640,120,20,0.9 ".test.png" by tolerance(24)
+#    ocr 的 _RET 可直接当作布尔值使用, 相似度为 _RET.score
+#    多个区域用 | 分隔, 在同一张截图上一次比较, 如 ocr 100,200,64,64 "a.png" | 300,200,64,64,0.8 "b.png",
+#    此时 _RET 为各区域结果的元组, 如 check all(_RET) 或 check _RET.count(True) >= 3
+#    表达式中只能使用 all any len sum min max abs 这几个内置函数
+#    ocr 末尾可以用 scale 指定比较前的缩小比例(1/n), 如 ocr 800,640,120,20,0.9 ".test.png" by tolerance scale 0.5,
+#    区域与模板按 n x n 的块取平均后比较, 缩小后的模板保存在模板旁边(.test.png.r2.npy);
+#    脚本开头的 # pragma: scale 0.5 为所有未指定 scale 的 ocr 指令设置缩小比例;
+#    缩小只对大区域有明显收益(800x400 以上的区域 tolerance / ncc 约快 2-3.5 倍, mae 约 1.1-1.3 倍),
+#    按钮大小的区域每次比较不到 1ms, 缩小节省的时间可以忽略, 1/2 往往还更慢
+# 注:locate 在区域内(省略区域时为全屏)搜索模板图, 如 locate 800,600,600,300,0.9 ".test.png" 或 locate ".test.png",
+#    _RET 可直接当作布尔值使用, 相似度为 _RET.score, 找到的位置为 _RET.box, 其中心点为 _RET.pos,
+#    随后用 click _RET 点击找到的位置(未找到时跳过点击)
+# 注:read 用字形图集(python -m ocr atlas 生成)识别区域中的单行文字, 多个区域用 | 分隔, 一次识别,
+#    如 read 1500,120,420,72 | 1500,210,420,72 "digits.npz", 单个区域时 _RET 为识别出的文字, 多个区域时为元组
+# 注:screen 用画面索引(python -m ocr index 生成)识别当前画面, 如 screen "screens.npz" 或 screen 16 "screens.npz"(最大汉明距离),
+#    _RET 为画面名称, 未知画面时为 None, 如 stay until _RET eq "lobby"
+# 注:stay watch 在画面变化之前只截图比较指纹(ocr/read/locate 只比较其区域), 不重新执行指令, 画面变化后才重新判断条件,
+#    轮询间隔从几毫秒开始逐次加倍, 最长为 stay 的等待时间, 如 stay watch 2 until _RET
+# 注:加载时会折叠常量表达式, 删除恒为真的 check/stay 与无用的 var, stay 恒为假时警告,
+#    python -m adb --explain 脚本路径 查看优化结果, 脚本开头的 # pragma: no-optimize 关闭这些优化
+# 注:条件中的 eq / neq / nin 即 == / != / not in, 只替换独立的运算符, 不影响含有这些字母的变量名与字符串;
+#    除 adb 语句外, 行尾可以用 # 添加注释; 脚本中的所有语法错误(行号, 列号)在加载时一起报告
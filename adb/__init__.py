@@ -1,19 +1,25 @@
-import io
+import threading
+import time
 import warnings
-from typing import Optional
-from weakref import WeakValueDictionary
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
 
-from ocr import compare_img
+from ocr import compare_regions, identify_screen, locate, read_regions, VisionPool
 from .Interruptions import *
 from .adb_utils import Adb
+from .device_tracker import UNKNOWN_GRACE
+from .frame_cache import FrameCache, ScreenWatch, MAX_AGE
+from .instruction import HANDLERS, Instruction
 from .script import script_dict, Script
 from log import LoggerDisplay
 
-from PyQt6.QtCore import QThread, pyqtSignal
+from PyQt6.QtCore import QObject, QThread, Qt, pyqtSignal, pyqtSlot
 
 from .script_parser import CompiledExpr
 
-empty = {"__builtins__": None}
+# the only builtins script expressions can use, e.g. `check all(_RET)` after a multi-region ocr
+SAFE_BUILTINS = {"all": all, "any": any, "len": len, "sum": sum, "min": min, "max": max, "abs": abs}
+empty = {"__builtins__": SAFE_BUILTINS}
 
 
 class LoggerCarrier:
@@ -58,15 +64,20 @@ class ScriptExecutor(QThread):
     aborted = pyqtSignal(int)
 
     def device_on(self) -> bool:
-        return self.adb.device_id == self.serial
+        # while the tracker reconnects to the adb server the device may still be there,
+        # the script stops once the server has been unreachable for UNKNOWN_GRACE seconds
+        return self.adb.tracker().is_online(self.serial, grace=UNKNOWN_GRACE)
 
     def __init__(self,
-                 scriptFile: str,
+                 scriptFile: str | Script,
                  adb: Adb,
                  serial: str,
                  *args,
                  id_: int = 0,
                  instruction_pointer: int = -1,
+                 frame_max_age: float = MAX_AGE,
+                 start_paused: bool = True,
+                 vision: VisionPool = None,
                  ):
         super().__init__()
 
@@ -74,12 +85,14 @@ class ScriptExecutor(QThread):
         self.ID = id_
         # record the exception that cause the thread to stop
         self.interruption = None
-        # script file path
+        # script file path, or an already parsed Script shared with other executors
         self.scriptFile = scriptFile
+        # wait for Resume() before executing the first instruction
+        self.startPaused = start_paused
         # a pointer that point to the next instruction, VISIBLE to the user
         self.IP = instruction_pointer
         # a Register that save the current instruction, INVISIBLE to the user
-        self.IR = None
+        self.IR: Optional[Instruction] = None
         # a Register that save the current state of ScriptParse,VISIBLE to the user
         self.PSW = ScriptExecutorPSW()
         # logger
@@ -88,18 +101,41 @@ class ScriptExecutor(QThread):
         self.serial = serial
         # adb
         self.adb = adb
+        # screenshot cache shared by consecutive ocr instructions
+        self.frames = FrameCache(self.adb.screencap, frame_max_age)
+        # worker processes for image instructions, None to run them on this thread
+        self.vision = vision
+        # the instruction waiting in a `stay watch`, None when not waiting
+        self._watch: Optional[ScreenWatch] = None
+        # number of executed instructions
+        self.executed = 0
+        # number of screen checks made by `stay watch` instead of re-executing the instruction
+        self.stayPolls = 0
+        # time when run() started
+        self.startedAt = None
 
         self._globals = empty.copy()
         self._locals = empty.copy()
+        # _RET of the last instruction, seeded into the locals of the next one so `click _RET` can follow a locate
+        self._lastRET = None
+        # dispatch table, indexed by Instruction.handler
+        self._handlers = tuple(getattr(self, f"_{name}Instruction") for name in HANDLERS)
 
     # =============== PRIVATE METHODS ===============
     def _initScript(self):
         self.exception = None
 
-        try:
-            self.script = Script(self.scriptFile)
-        except Exception as e:
-            raise ParsedScriptFailed(e.args[0])
+        if isinstance(self.scriptFile, Script):
+            self.script = self.scriptFile
+        else:
+            try:
+                self.script = Script(self.scriptFile)
+            except Exception as e:
+                raise ParsedScriptFailed(e.args[0])
+
+        # convert coordinates to the resolution of the device once, before executing
+        if self.script.resolution is not None:
+            self.script = self.script.scaled(*self.adb.screen_size)
 
         self.IP = max(self.script.BeginAddress, self.IP)
 
@@ -119,14 +155,27 @@ class ScriptExecutor(QThread):
         """
         execute the current instruction
         """
-
-        self.logger.info(f"正在执行:{self.IR}")
-
-        getattr(self, f"_{self.IR['type']}Instruction")()
-
+        IR = self.IR
+        if (watch := self._watch) is not None and watch.address == self.IP - 1:
+            # waiting in a `stay watch`: capture a fresh frame and re-execute only once the screen has changed
+            self.frames.invalidate()
+            self.stayPolls += 1
+            if not watch.changed(self.frames.get()):
+                self.jumpTo(watch.address)
+                self.Sleep(watch.next_interval())
+                return True
+
+        self.logger.info(f"正在执行:{IR}")
+
+        self._locals["_RET"] = self._lastRET
+        self._handlers[IR.handler]()
+        # instructions that do not produce a _RET (log, var, sleep ...) pass the previous one on
+        self._lastRET = self._locals["_RET"]
+
+        self.executed += 1
         self.instructionExecuted.emit(self.ID)
         # empty the local variables
-        self._locals = empty.copy()
+        self._locals.clear()
         return True
 
     def _interruptPeriod(self):
@@ -150,6 +199,7 @@ class ScriptExecutor(QThread):
                     self.msleep(100)
                     self._interruptPeriod()
                 self._onResumed()
+                self.frames.invalidate()
 
             # enable interrupt 开中断
             self.PSW.ENABLE_INTERRUPT = True
@@ -205,88 +255,158 @@ class ScriptExecutor(QThread):
         exec(stmt, self._globals, self._locals)
 
     def _instructionUniverseBlock(self):
-        # 处理block
-        if block := self.IR["block"]:
-            # 处理block中的arg子句
-            if "var" in block:
-                for arg_stmt in block["var"]:
-                    if arg_stmt["del"]:
-                        self._globals.pop(arg_stmt["ID"])
-                        print(f'- 变量{arg_stmt["ID"]}')
-                    else:
-                        self._globals[arg_stmt["ID"]] = self._evaInContext(arg_stmt["value"])
-                        print(f'+ 变量{arg_stmt["ID"]} = {self._globals[arg_stmt["ID"]]}')
-
-            if "check" in block:
-                # 处理block中的check子句
-                for check_stmt in block["check"]:
-                    # hard | soft
-                    check_mode = check_stmt["check_mode"]
-                    if not self._evaInContext(check_stmt["test_expr"]):
-                        if check_mode == "hard":
-                            self.logger.error(f"检查失败:{str(check_stmt['test_expr'])},脚本终止")
-                            warnings.warn(f"检查失败:{str(check_stmt['test_expr'])},脚本终止")
-                            raise StopInterruptions
-                        elif check_mode == "soft":
-                            self.logger.warning(f"检查失败:{str(check_stmt['test_expr'])}")
-                            warnings.warn(f"检查失败:{str(check_stmt['test_expr'])}")
-                        else:
-                            raise NotImplementedError
+        # 处理block, 子句在编译时已按类型拆分
+        IR = self.IR
+        # 处理block中的var子句
+        for ID, delete, value in IR.var:
+            if delete:
+                self._globals.pop(ID)
+                print(f'- 变量{ID}')
+            else:
+                self._globals[ID] = self._evaInContext(value)
+                print(f'+ 变量{ID} = {self._globals[ID]}')
+
+        # 处理block中的check子句, hard | soft
+        for hard, test_expr in IR.check:
+            if not self._evaInContext(test_expr):
+                if hard:
+                    self.logger.error(f"检查失败:{str(test_expr)},脚本终止")
+                    warnings.warn(f"检查失败:{str(test_expr)},脚本终止")
+                    raise StopInterruptions
+                self.logger.warning(f"检查失败:{str(test_expr)}")
+                warnings.warn(f"检查失败:{str(test_expr)}")
+            else:
+                self.logger.info(f"检查成功:{str(test_expr)}")
+                print(f"检查成功:{str(test_expr)}")
+
+        if IR.stay:
+            # 处理block中的stay子句
+            waiting = False
+            for test_expr, time_, watch in IR.stay:
+                if not self._evaInContext(test_expr):
+                    # 循环执行包含该条stay的指令
+                    self.jumpTo(self.IP - 1)
+                    if watch:
+                        waiting = True
+                        self._stayWatch(time_)
                     else:
-                        self.logger.info(f"检查成功:{str(check_stmt['test_expr'])}")
-                        print(f"检查成功:{str(check_stmt['test_expr'])}")
+                        self.Sleep(time_)
+                    # the instruction runs again, the other stay clauses are checked then
+                    break
+            if not waiting:
+                self._watch = None
 
-            if "stay" in block:
-                # 处理block中的stay子句
-                for stay_stmt in block["stay"]:
-                    if not self._evaInContext(stay_stmt["test_expr"]):
-                        # 循环执行包含该条stay的指令
-                        self.jumpTo(self.IP - 1)
-                        self.Sleep(stay_stmt["time"])
+    def _stayWatch(self, ceiling: float):
+        """
+        wait in a `stay watch`: remember the screen the condition was evaluated on,
+        the instruction is executed again once the screen changes, polling backs off up to ceiling
+        """
+        if self._watch is None or self._watch.address != self.IP:
+            self._watch = ScreenWatch(self.IP, self.IR.watched, ceiling)
+        self._watch.observe(self.frames.get())
+        self.Sleep(self._watch.next_interval())
+
+    def _see(self, func, *args, **kwargs):
+        """
+        run an image function on the current screenshot, in the vision worker pool if there is one
+        """
+        screenshot = self.frames.get()
+        if self.vision is not None:
+            return self.vision.run(func, screenshot, *args, **kwargs)
+        return func(screenshot, *args, **kwargs)
 
     def _EOFInstruction(self):
-        self._exitInstruction()
+        # only reaching the end of the script counts as a completed run
+        self.PSW.FINISHED = True
+        raise StopInterruptions
 
     def _varInstruction(self):
         # 处理var
-        if self.IR["del"]:
-            self._globals.pop(self.IR["ID"])
-            print(f'- 变量{self.IR["ID"]}')
+        if self.IR.delete:
+            self._globals.pop(self.IR.ID)
+            print(f'- 变量{self.IR.ID}')
         else:
-            self._globals[self.IR["ID"]] = self._evaInContext(self.IR["value"])
-            print(f'+ 变量{self.IR["ID"]} = {self._globals[self.IR["ID"]]}')
+            self._globals[self.IR.ID] = self._evaInContext(self.IR.value)
+            print(f'+ 变量{self.IR.ID} = {self._globals[self.IR.ID]}')
 
     def _adbInstruction(self):
-        cmd = self.IR["cmd"]
+        cmd = self.IR.cmd
         # 执行cmd形如:["shell","input","keyevent","4"],并获得一个返回值
         _RET = self.adb.get_command_output(cmd)
+        # adb命令可能改变画面(input, am start ...)
+        self.frames.invalidate()
         self._locals["_RET"] = _RET
 
         self._instructionUniverseBlock()
 
     def _ocrInstruction(self):
         # TODO 完善OCR指令
-        screenshot = io.BytesIO(self.adb.get_shell_output(self.serial, "screencap", "-p"))
-        x, y, w, h = self.IR["pos"]
-        confidence = self.IR["confidence"]
-        origin = self.IR["path"]
-        _RET = compare_img(x, y, w, h, origin, screenshot, confidence)
-        self._locals["_RET"] = _RET
+        IR = self.IR
+        # all regions are compared against the same capture
+        results = self._see(compare_regions, IR.entries, resize=IR.resize, metric=IR.metric, param=IR.param,
+                            reduce=IR.reduce)
+        # _RET is a MatchResult: truthy on a match, with the similarity in _RET.score,
+        # or a tuple of MatchResult in source order for several regions
+        self._locals["_RET"] = results[0] if IR.single else results
 
         self._instructionUniverseBlock()
 
+    def _batchInstruction(self):
+        # 合并后的输入指令, 通过一次shell调用执行; 用 && 连接, 某条命令失败时停止并以其退出码报告, 与逐条执行一致
+        self.adb.shell(" && ".join(self.IR.cmds))
+        self.frames.invalidate()
+        self._locals["_RET"] = None
+
     def _sleepInstruction(self):
-        self.Sleep(self.IR["time"])
+        self.Sleep(self.IR.time)
 
     def _logInstruction(self):
-        self.logger.info(f"脚本执行器-{self.ID}: {self._evaInContext(self.IR['msg'])}")
+        self.logger.info(f"脚本执行器-{self.ID}: {self._evaInContext(self.IR.msg)}")
 
     def _exitInstruction(self):
+        # an explicit exit (usually an error path) stops the script as aborted
         raise StopInterruptions
 
+    def _locateInstruction(self):
+        # _RET is a LocateResult: truthy when found, _RET.pos is the centre of the best match
+        _RET = self._see(locate, self.IR.path, self.IR.pos, self.IR.confidence, scale=self.IR.scale)
+        self._locals["_RET"] = _RET
+
+        self._instructionUniverseBlock()
+
+    def _readInstruction(self):
+        # all regions are recognized in one call; _RET is a str (with .score), or a tuple of them for several regions
+        results = self._see(read_regions, self.IR.regions, self.IR.path)
+        self._locals["_RET"] = results[0] if len(results) == 1 else tuple(results)
+
+        self._instructionUniverseBlock()
+
+    def _screenInstruction(self):
+        # _RET is the label of the nearest reference screen (a str with .distance), None for an unknown screen
+        self._locals["_RET"] = self._see(identify_screen, self.IR.path, self.IR.max_distance)
+
+        self._instructionUniverseBlock()
+
     def _clickInstruction(self):
-        x, y = self.IR["pos"]
-        self.adb.shell("-s", self.serial, "input", "tap", x, y)
+        if self.IR.target is not None:
+            try:
+                target = self._evaInContext(self.IR.target)
+                if target:
+                    x, y = getattr(target, "pos", target)
+                    target = (x, y)
+                else:
+                    # e.g. a locate that found nothing, tapping its best guess would hit a random spot
+                    self.logger.warning(f"脚本执行器-{self.ID}: 点击目标不存在, 跳过: {self.IR.target}")
+                    target = None
+            except Exception as e:
+                self.logger.error(f"脚本执行器-{self.ID}: 点击目标求值失败, 跳过: {self.IR.target}: {e!r}")
+                target = None
+        else:
+            target = self.IR.pos
+        if target is not None:
+            x, y = target
+            self.adb.shell("input", "tap", x, y)
+            self.frames.invalidate()
         self._locals["_RET"] = None
 
         self._instructionUniverseBlock()
@@ -296,8 +416,10 @@ class ScriptExecutor(QThread):
     # =============== PUBLIC METHODS ===============
 
     def run(self):
+        self.startedAt = time.monotonic()
 
-        self.Pause()
+        if self.startPaused:
+            self.Pause()
         self._interruptPeriod()
 
         try:
@@ -325,6 +447,8 @@ class ScriptExecutor(QThread):
                     # leave time to receive the external events and requests
                     self.msleep(int(self.PSW.REQUIRE_SLEEP * 1000))
                     self.PSW.REQUIRE_SLEEP = -1
+                    # sleep / stay wait for the screen to change, never reuse the frame captured before
+                    self.frames.invalidate()
                     # interrupt period
                     if not self._interruptPeriod():
                         break
@@ -333,8 +457,8 @@ class ScriptExecutor(QThread):
                     if not self._interruptPeriod():
                         break
 
-        if self.IP == self.script.BeginAddress + self.script.Length:
-            self.PSW.FINISHED = True
+        # EOF sets FINISHED, Length is not compared: it would parse a lazily loaded script to the end
+        if self.PSW.FINISHED:
             self.PSW.PAUSED = False
             # send done signal
             self.logger.debug("完成")
@@ -344,6 +468,20 @@ class ScriptExecutor(QThread):
             self.logger.debug(f"停止")
             self.aborted.emit(self.ID)
 
+    @property
+    def stats(self) -> dict:
+        """
+        statistics of the executor
+        """
+        elapsed = time.monotonic() - self.startedAt if self.startedAt else 0
+        return {
+            "instructions": self.executed,
+            "instruction_rate": self.executed / elapsed if elapsed else 0.0,
+            "frame_cache_hits": self.frames.hits,
+            "frame_cache_misses": self.frames.misses,
+            "stay_polls": self.stayPolls,
+        }
+
     def Sleep(self, s: float):
         self.PSW.REQUIRE_SLEEP = s
 
@@ -358,6 +496,7 @@ class ScriptExecutor(QThread):
 
     def safeJumpTo(self, instructionPointer):
         self.Pause()
+        self._watch = None
         if instructionPointer in self.script:
             self.jumpTo(instructionPointer)
         self.Resume()
@@ -366,29 +505,148 @@ class ScriptExecutor(QThread):
     # =============== PUBLIC METHODS ===============
 
 
+class _ExecutorReceiver(QObject):
+    """
+    receives the done / aborted signals of the executors through queued connections,
+    so the manager schedules the next executor in its own thread instead of the thread of the finished one
+    """
+
+    @pyqtSlot(int)
+    def onDone(self, ID: int):
+        ScriptParseManager._onDone(ID, True)
+
+    @pyqtSlot(int)
+    def onAborted(self, ID: int):
+        ScriptParseManager._onDone(ID, False)
+
+
 class ScriptParseManager:
     """
     a class that manage the ScriptParse
     singleton
+
+    the script is parsed once and shared by every executor,
+    one executor runs per device, devices beyond _MAX_INSTANCES wait in a queue,
+    finished executors are handled in the thread that first created an executor, which needs a running Qt event loop
     """
     _CURRENT_ID = 0
     _MAX_INSTANCES = -1
-    _instances: WeakValueDictionary[str, ScriptExecutor] = WeakValueDictionary()
+    _instances: Dict[str, ScriptExecutor] = {}
+    # executors that have finished but whose thread may not have returned yet
+    _retired: List[ScriptExecutor] = []
+    # (serial, instructionPointer) waiting for a free slot
+    _queue: Deque[Tuple[str, int]] = deque()
+    _script: Optional[Script] = None
+    # restart the script on a device after it finished
+    _repeat = False
+    _lock = threading.RLock()
+    # lives in the manager's thread, see _ExecutorReceiver
+    _receiver: Optional[_ExecutorReceiver] = None
+    # worker processes shared by every executor for image instructions, None to run them on the executor threads
+    _vision: Optional[VisionPool] = None
+
+    # statistics
+    _startedAt: Optional[float] = None
+    _completedRuns = 0
+    _abortedRuns = 0
+
+    @classmethod
+    def load(cls, scriptFile: str, interval=-1, lazy=False) -> Script:
+        """
+        parse the script once, all executors created afterwards share it
+
+        :param lazy: parse the script while the executors run it, see Script
+        """
+        cls._script = Script(scriptFile, interval, lazy=lazy)
+        return cls._script
+
+    @classmethod
+    def setVisionWorkers(cls, workers: int):
+        """
+        run image instructions in a pool of worker processes, 0 to run them on the executor threads
+
+        :param workers: number of worker processes, the pool is shared by every executor started afterwards
+        """
+        with cls._lock:
+            if cls._instances:
+                raise RuntimeError("can not change the vision workers while scripts are running")
+            if cls._vision is not None:
+                cls._vision.close()
+                cls._vision = None
+            if workers > 0:
+                cls._vision = VisionPool(workers)
 
     @classmethod
-    def newInstance(cls, script: Script, instructionPointer=-1) -> Optional[int]:
+    def newInstance(cls, script: Script, serial: str, instructionPointer=-1) -> Optional[int]:
         """
-        create a new instance of ScriptParse
+        create a new instance of ScriptParse, return None if the maximum number of instances is reached
         """
-        if cls._MAX_INSTANCES != -1 and len(cls._instances) >= cls._MAX_INSTANCES:
-            return None
-        ID = cls._CURRENT_ID
-        cls._CURRENT_ID += 1
-        _ = ScriptExecutor(script, ID, instructionPointer)
-        _.start()
-        cls._instances[str(ID)] = _
-        del _
-        return ID
+        with cls._lock:
+            cls._reap()
+            if cls._MAX_INSTANCES != -1 and len(cls._instances) >= cls._MAX_INSTANCES:
+                return None
+            ID = cls._CURRENT_ID
+            cls._CURRENT_ID += 1
+            executor = ScriptExecutor(script, Adb(serial), serial,
+                                      id_=ID, instruction_pointer=instructionPointer, start_paused=False,
+                                      vision=cls._vision)
+            if cls._receiver is None:
+                cls._receiver = _ExecutorReceiver()
+            executor.done.connect(cls._receiver.onDone, Qt.ConnectionType.QueuedConnection)
+            executor.aborted.connect(cls._receiver.onAborted, Qt.ConnectionType.QueuedConnection)
+            cls._instances[str(ID)] = executor
+            if cls._startedAt is None:
+                cls._startedAt = time.monotonic()
+            executor.start()
+            return ID
+
+    @classmethod
+    def submit(cls, serials: Iterable[str], repeat: bool = False, instructionPointer=-1) -> List[int]:
+        """
+        run the loaded script on every device, devices that can not start now are queued
+
+        :param serials: device serials
+        :param repeat: restart the script on a device after it finished
+        :return: IDs of the started executors
+        """
+        if cls._script is None:
+            raise RuntimeError("no script loaded")
+        cls._repeat = repeat
+        started = []
+        with cls._lock:
+            for serial in serials:
+                if (ID := cls.newInstance(cls._script, serial, instructionPointer)) is None:
+                    cls._queue.append((serial, instructionPointer))
+                else:
+                    started.append(ID)
+        return started
+
+    @classmethod
+    def _onDone(cls, ID, completed: bool):
+        with cls._lock:
+            executor = cls._instances.pop(str(ID), None)
+            if executor is None:
+                return
+            cls._retired.append(executor)
+            if completed:
+                cls._completedRuns += 1
+            else:
+                cls._abortedRuns += 1
+
+            if completed and cls._repeat:
+                cls._queue.append((executor.serial, -1))
+            while cls._queue:
+                serial, instructionPointer = cls._queue[0]
+                if cls.newInstance(cls._script, serial, instructionPointer) is None:
+                    break
+                cls._queue.popleft()
+
+    @classmethod
+    def _reap(cls):
+        """
+        drop finished executors whose thread has returned
+        """
+        cls._retired = [executor for executor in cls._retired if not executor.isFinished()]
 
     @classmethod
     def getInstance(cls, ID):
@@ -396,3 +654,23 @@ class ScriptParseManager:
         get the instance of ScriptParse by ID
         """
         return cls._instances.get(str(ID), None)
+
+    @classmethod
+    def throughput(cls) -> dict:
+        """
+        aggregate throughput of all devices
+
+        :return: {"runs_per_hour": float, "completed": int, "aborted": int, "running": int, "queued": int,
+                  "devices": {serial: instructions per second}}
+        """
+        with cls._lock:
+            elapsed = time.monotonic() - cls._startedAt if cls._startedAt else 0
+            return {
+                "runs_per_hour": cls._completedRuns / elapsed * 3600 if elapsed else 0.0,
+                "completed": cls._completedRuns,
+                "aborted": cls._abortedRuns,
+                "running": len(cls._instances),
+                "queued": len(cls._queue),
+                "devices": {executor.serial: executor.stats["instruction_rate"]
+                            for executor in cls._instances.values()},
+            }
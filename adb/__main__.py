@@ -0,0 +1,26 @@
+"""
+脚本工具
+
+显示脚本经过优化后的指令数与各项优化的统计, --explain 逐条列出:
+python -m adb BASL/test.bas
+python -m adb --explain BASL/test.bas
+"""
+import argparse
+
+from .script import Script
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m adb", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("script", help="脚本文件")
+    parser.add_argument("--explain", action="store_true", help="逐条列出每项优化")
+    args = parser.parse_args()
+
+    script = Script(args.script, cache=False)
+    print(f"{args.script}: {script.report.before} 条指令 -> {script.Length} 条")
+    print(script.report.format(args.explain))
+
+
+if __name__ == "__main__":
+    main()
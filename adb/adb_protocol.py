@@ -0,0 +1,284 @@
+"""
+adb server 主机协议(smart socket)客户端
+
+直接通过 TCP 与本机 adb server(默认 127.0.0.1:5037)通信, 避免每条命令都启动一次 adb 客户端进程.
+协议格式: 客户端发送 4 位十六进制长度 + 服务名, 服务端返回 OKAY 或 FAIL + 4 位十六进制长度 + 错误信息.
+"""
+import os
+import socket
+import threading
+from collections import deque
+from typing import Dict, Deque, Optional, Tuple
+
+from .shell_session import SocketShellStream
+
+ADB_SERVER_HOST = "127.0.0.1"
+ADB_SERVER_PORT = 5037
+
+# 每个设备预先建立好(已切换到该设备 transport)的空闲连接数
+POOL_SIZE = 2
+CONNECT_TIMEOUT = 3.0
+
+
+class AdbProtocolError(Exception):
+    pass
+
+
+def server_address() -> Tuple[str, int]:
+    """
+    获取 adb server 地址, 与 adb 客户端一致, 支持 ADB_SERVER_SOCKET=tcp:host:port 与 ANDROID_ADB_SERVER_PORT
+
+    :return: (host, port)
+    """
+    if (spec := os.getenv("ADB_SERVER_SOCKET")) and spec.startswith("tcp:"):
+        host, _, port = spec[4:].rpartition(":")
+        return host or ADB_SERVER_HOST, int(port)
+    return ADB_SERVER_HOST, int(os.getenv("ANDROID_ADB_SERVER_PORT", ADB_SERVER_PORT))
+
+
+def encode_request(service: str) -> bytes:
+    """
+    将服务名编码为 smart socket 请求
+
+    :param service: 服务名, 如 host:devices-l
+    :return:
+    """
+    data = service.encode("utf-8")
+    return b"%04x" % len(data) + data
+
+
+class AdbConnection:
+    """
+    与 adb server 之间的一条连接
+    """
+
+    def __init__(self, address: Tuple[str, int] = None, timeout: float = CONNECT_TIMEOUT):
+        self.address = address or server_address()
+        self.sock = socket.create_connection(self.address, timeout=timeout)
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send(self, service: str):
+        self.sock.sendall(encode_request(service))
+
+    def read_exact(self, n: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = self.sock.recv(n - len(buf))
+            if not chunk:
+                raise AdbProtocolError("adb server 连接已断开")
+            buf += chunk
+        return bytes(buf)
+
+    def read_block(self) -> bytes:
+        """
+        读取一个 4 位十六进制长度前缀的数据块
+        """
+        return self.read_exact(int(self.read_exact(4), 16))
+
+    def read_all(self) -> bytes:
+        """
+        读取直到服务端关闭连接
+        """
+        chunks = []
+        while chunk := self.sock.recv(65536):
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def check_status(self):
+        status = self.read_exact(4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            raise AdbProtocolError(self.read_block().decode("utf-8", "replace"))
+        raise AdbProtocolError(f"未知的响应: {status!r}")
+
+    def request(self, service: str):
+        """
+        发送请求并等待 OKAY
+        """
+        self.send(service)
+        self.check_status()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class AdbConnectionPool:
+    """
+    按设备序列号维护的连接池
+
+    adb server 的服务连接是一次性的(服务结束后服务端会关闭连接), 因此池中保存的是
+    已经完成 host:transport:<serial> 握手的空闲连接, 取出后直接发送服务请求即可,
+    取出后由后台线程补充, 使下一条命令不再需要等待建连与握手.
+    """
+
+    def __init__(self, address: Tuple[str, int] = None, size: int = POOL_SIZE, start_server=None):
+        self.address = address
+        self.size = size
+        # adb server 未启动时的启动回调
+        self.start_server = start_server
+        self._idle: Dict[str, Deque[AdbConnection]] = {}
+        self._lock = threading.Lock()
+        self._refill = threading.Condition(self._lock)
+        self._pending: Deque[str] = deque()
+        self._worker: Optional[threading.Thread] = None
+
+    def connect(self) -> AdbConnection:
+        try:
+            return AdbConnection(self.address)
+        except ConnectionRefusedError:
+            if self.start_server is None:
+                raise
+            self.start_server()
+            return AdbConnection(self.address)
+
+    def transport(self, serial: str) -> AdbConnection:
+        """
+        新建一条连接并切换到指定设备
+        """
+        conn = self.connect()
+        try:
+            conn.request(f"host:transport:{serial}")
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    def acquire(self, serial: str) -> Tuple[AdbConnection, bool]:
+        """
+        取出一条已切换到指定设备的连接
+
+        :return: (连接, 是否来自池中)
+        """
+        with self._lock:
+            idle = self._idle.get(serial)
+            conn = idle.popleft() if idle else None
+            self._schedule(serial)
+        if conn is not None:
+            return conn, True
+        return self.transport(serial), False
+
+    def _schedule(self, serial: str):
+        if self.size <= 0:
+            return
+        self._pending.append(serial)
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._fill, daemon=True, name="adb-pool")
+            self._worker.start()
+        self._refill.notify()
+
+    def _fill(self):
+        while True:
+            with self._lock:
+                while not self._pending:
+                    self._refill.wait()
+                serial = self._pending.popleft()
+                if len(self._idle.setdefault(serial, deque())) >= self.size:
+                    continue
+            try:
+                conn = self.transport(serial)
+            except (OSError, AdbProtocolError):
+                continue
+            with self._lock:
+                self._idle[serial].append(conn)
+
+    def discard(self, serial: str = None):
+        """
+        关闭空闲连接(设备断开或 server 重启后调用)
+        """
+        with self._lock:
+            serials = [serial] if serial else list(self._idle)
+            for s in serials:
+                for conn in self._idle.pop(s, ()):
+                    conn.close()
+
+
+class SocketBackend:
+    """
+    通过 adb server 主机协议执行命令的后端
+    """
+    name = "socket"
+
+    def __init__(self, address: Tuple[str, int] = None, pool_size: int = POOL_SIZE, start_server=None):
+        self.address = address
+        self.pool = AdbConnectionPool(address, pool_size, start_server)
+
+    def _host(self, service: str) -> bytes:
+        with self.pool.connect() as conn:
+            conn.request(service)
+            return conn.read_block()
+
+    def _service(self, serial: str, service: str) -> bytes:
+        conn, pooled = self.pool.acquire(serial)
+        try:
+            try:
+                conn.request(service)
+            except (OSError, AdbProtocolError):
+                if not pooled:
+                    raise
+                # 池中的连接可能已被服务端关闭, 重新建立一次
+                conn.close()
+                self.pool.discard(serial)
+                conn = self.pool.transport(serial)
+                conn.request(service)
+            return conn.read_all()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _join(args) -> str:
+        return " ".join(str(arg) for arg in args)
+
+    def devices(self, long: bool = False) -> bytes:
+        return self._host("host:devices-l" if long else "host:devices")
+
+    def get_state(self, serial: str) -> str:
+        return self._host(f"host-serial:{serial}:get-state").decode("utf-8").strip()
+
+    def get_serialno(self, serial: str = None) -> str:
+        prefix = f"host-serial:{serial}" if serial else "host"
+        return self._host(f"{prefix}:get-serialno").decode("utf-8").strip()
+
+    def shell(self, serial: str, *args) -> bytes:
+        return self._service(serial, f"shell:{self._join(args)}")
+
+    def exec_out(self, serial: str, *args) -> bytes:
+        return self._service(serial, f"exec:{self._join(args)}")
+
+    def open_shell(self, serial: str) -> SocketShellStream:
+        """
+        打开一个交互式 shell
+        """
+        conn = self.pool.transport(serial)
+        try:
+            conn.request("shell:")
+        except BaseException:
+            conn.close()
+            raise
+        return SocketShellStream(conn)
+
+    def connect(self, address: str) -> str:
+        return self._host(f"host:connect:{address}").decode("utf-8").strip()
+
+    def version(self) -> int:
+        return int(self._host("host:version"), 16)
+
+    def kill_server(self):
+        self.pool.discard()
+        try:
+            conn = AdbConnection(self.address)
+        except ConnectionRefusedError:
+            # server 未运行
+            return
+        with conn:
+            conn.send("host:kill")
@@ -1,7 +1,13 @@
-from subprocess import Popen, PIPE, DEVNULL, check_output
+from subprocess import Popen, PIPE, DEVNULL, STDOUT, check_output
 import platform as pf
 import os
 
+from ocr import Frame, FrameFormatException
+
+from .adb_protocol import SocketBackend
+from .device_tracker import DeviceTracker
+from .shell_session import ShellSession, ShellSessionTimeout, ProcessShellStream, is_read_only
+
 if pf.system() == 'Windows':
     adb_exec = "adb.exe"
 else:
@@ -31,17 +37,92 @@ def is_adb_effective() -> bool:
     :return:
     """
     cmd = [adb_path, 'version']
-    p = Popen(cmd, stdout=DEVNULL, stderr=DEVNULL)
+    try:
+        p = Popen(cmd, stdout=DEVNULL, stderr=DEVNULL)
+    except OSError:
+        return False
     p.communicate()
     if p.returncode != 0:
         return False
     return True
 
 
+class SubprocessBackend:
+    """
+    每条命令启动一个 adb 客户端进程的后端(兼容后端)
+    """
+    name = "subprocess"
+
+    @staticmethod
+    def run(*args) -> bytes:
+        cmd = [adb_path]
+        cmd.extend(str(arg) for arg in args)
+        p = Popen(cmd, stdout=PIPE, stderr=PIPE)
+        stdout, stderr = p.communicate()
+        if p.returncode != 0:
+            raise Exception(stderr)
+        return stdout
+
+    def devices(self, long: bool = False) -> bytes:
+        return self.run('devices', '-l') if long else self.run('devices')
+
+    def get_state(self, serial: str) -> str:
+        return self.run('-s', serial, 'get-state').decode("utf-8").strip()
+
+    def get_serialno(self, serial: str = None) -> str:
+        args = ['-s', serial] if serial else []
+        return self.run(*args, 'get-serialno').decode("utf-8").strip()
+
+    def shell(self, serial: str, *args) -> bytes:
+        return self.run('-s', serial, 'shell', *args)
+
+    def exec_out(self, serial: str, *args) -> bytes:
+        return self.run('-s', serial, 'exec-out', *args)
+
+    def open_shell(self, serial: str) -> ProcessShellStream:
+        return ProcessShellStream(Popen([adb_path, '-s', serial, 'shell'], stdin=PIPE, stdout=PIPE, stderr=STDOUT))
+
+    def connect(self, address: str) -> str:
+        return self.run('connect', address).decode("utf-8").strip()
+
+    def version(self) -> int:
+        return int(self.run('version').split()[4].split(b".")[-1])
+
+    def kill_server(self):
+        self.run('kill-server')
+
+
+def get_backend(name: str = None):
+    """
+    获取命令执行后端, 默认使用 socket 后端, 可通过环境变量 BAS_ADB_BACKEND=subprocess 切换回兼容后端
+
+    :param name: socket | subprocess
+    :return:
+    """
+    name = name or os.getenv("BAS_ADB_BACKEND", "socket")
+    if name == "socket":
+        return SocketBackend(start_server=lambda: SubprocessBackend.run('start-server'))
+    elif name == "subprocess":
+        return SubprocessBackend()
+    raise ValueError(f"未知的adb后端: {name}")
+
+
 class Adb:
-    def __init__(self, serial=None):
-        if serial:
-            self.serial = serial
+    # 所有实例共享的默认后端
+    backend = get_backend()
+    # 截图是否使用原始帧(exec-out screencap), 否则使用 PNG(screencap -p)
+    raw_screencap = True
+    # shell命令是否使用常驻shell会话
+    use_shell_session = True
+    # 序列号 -> 常驻shell会话
+    _sessions: dict = {}
+    # 序列号 -> 屏幕分辨率
+    _screen_sizes: dict = {}
+
+    def __init__(self, serial=None, backend=None):
+        self.serial = serial
+        if backend is not None:
+            self.backend = backend
 
     @classmethod
     def have_device(cls) -> bool:
@@ -59,9 +140,7 @@ class Adb:
         :return:
         """
         cmd = ["dumpsys", "activity", "top", "|", "grep", "ACTIVITY"]
-        popen = self.shell(cmd)
-        popen.wait()
-        out = [line.decode("utf-8").strip() for line in popen.stdout.readlines()]
+        out = [line.decode("utf-8").strip() for line in self.shell(cmd).splitlines()]
         app_lst = []
         for app in out:
             app_lst.append(app.split()[1].split("/")[0])
@@ -74,11 +153,7 @@ class Adb:
         获取设备列表
         :return: tuple(序列号, 状态, 连接)
         """
-        cmd = [adb_path, 'devices', '-l']
-        p = Popen(cmd, stdout=PIPE, stderr=PIPE)
-        stdout, stderr = p.communicate()
-        if p.returncode != 0:
-            raise Exception(stderr)
+        stdout = cls.backend.devices(long=True)
         devices = []
         for line in stdout.splitlines():
             line = line.decode('utf-8')
@@ -96,6 +171,14 @@ class Adb:
 
         return devices
 
+    @classmethod
+    def tracker(cls) -> DeviceTracker:
+        """
+        获取共享的设备状态跟踪器
+        """
+        return DeviceTracker.shared(getattr(cls.backend, "address", None),
+                                    start_server=lambda: SubprocessBackend.run('start-server'))
+
     @classmethod
     def if_device_online(cls, serial) -> bool:
         """
@@ -104,12 +187,7 @@ class Adb:
         :param serial:
         :return:
         """
-        cmd = [adb_path, '-s', serial, 'get-state']
-        p = Popen(cmd, stdout=PIPE, stderr=PIPE)
-        stdout, stderr = p.communicate()
-        if p.returncode != 0:
-            raise Exception(stderr)
-        return stdout.strip() == b'device'
+        return cls.backend.get_state(serial) == 'device'
 
     def verify_device(self) -> bool:
         """
@@ -121,6 +199,9 @@ class Adb:
         return False
 
     def command(self, *args):
+        """
+        以子进程方式执行任意adb命令, 返回Popen对象
+        """
         if self.verify_device():
             raise Exception("未检测到设备")
         cmd = [adb_path]
@@ -128,40 +209,62 @@ class Adb:
         return Popen(cmd, stdout=PIPE, stderr=PIPE)
 
     def get_command_output(self, *args):
+        """
+        执行形如 ["shell","input","keyevent","4"] 的adb命令并返回输出
+        """
+        args = args[0]
+        match args[0]:
+            case "shell":
+                return self.shell(*args[1:])
+            case "exec-out":
+                return self.backend.exec_out(self.serial, *args[1:])
         cmd = [adb_path]
-        # p = Popen(cmd, stdout=PIPE, stderr=PIPE)
-        # stdout, stderr = p.communicate()
-        # if p.returncode != 0:
-        #     raise Exception(stderr)
-        cmd.extend(['-s', self.device_id])
-        cmd.extend(args[0])
+        cmd.extend(['-s', self.serial])
+        cmd.extend(args)
         output = check_output(cmd)
-        #  return stdout.strip().decode("utf-8")
         return output
 
+    def session(self) -> ShellSession:
+        """
+        获取当前设备的常驻shell会话
+        """
+        key = (id(self.backend), self.serial)
+        if (session := self._sessions.get(key)) is None:
+            backend, serial = self.backend, self.serial
+            session = self._sessions[key] = ShellSession(lambda: backend.open_shell(serial))
+        return session
+
+    def shell(self, *args) -> bytes:
+        """
+        在当前设备上执行shell命令, 默认通过常驻shell会话执行
 
-    def shell(self, *args):
+        :param args: 命令参数, 也可以传入单个列表
+        :return: 命令输出, 通过会话执行且退出码不为 0 时抛出异常(与子进程后端一致)
+        """
         if self.verify_device():
             raise Exception("未检测到设备")
-        cmd = [adb_path]
-        cmd.extend(['shell'])
-        cmd.extend(args[0])
-        return Popen(cmd, stdout=PIPE, stderr=PIPE)
+        if len(args) == 1 and isinstance(args[0], (list, tuple)):
+            args = args[0]
+        if self.use_shell_session:
+            cmd = " ".join(str(arg) for arg in args)
+            try:
+                output, status = self.session().run(cmd)
+            except ShellSessionTimeout:
+                # 会话已关闭, 下一条命令时重新打开; 命令可能已经执行过, 只有只读命令改用一次性的 adb shell 重新执行
+                if not is_read_only(cmd):
+                    raise
+                return self.backend.shell(self.serial, *args)
+            if status != 0:
+                raise Exception(output)
+            return output
+        return self.backend.shell(self.serial, *args)
 
     @classmethod
     def get_shell_output(cls, device_id, *args) -> bytes:
-        cmd = [adb_path]
-        cmd.extend(['-s', device_id, 'shell'])
-        cmd.extend(args)
-        output = check_output(cmd)
-        return output
+        return cls.backend.shell(device_id, *args)
 
     def connect(self, ip):
-        p = self.command('connect', ip)
-        stdout, stderr = p.communicate()
-        if p.returncode != 0:
-            raise Exception(stderr)
-        return stdout.decode("utf-8").strip()
+        return self.backend.connect(ip)
 
     def auto_connect(self):
         if self.have_device():
@@ -171,34 +274,46 @@ class Adb:
             if self.have_device():
                 return
 
+    def screencap(self, raw: bool = None) -> Frame:
+        """
+        截图
+
+        :param raw: 是否使用原始帧, 默认使用 raw_screencap; 原始帧解析失败时自动退回 PNG
+        :return:
+        """
+        if raw is None:
+            raw = self.raw_screencap
+        if raw:
+            try:
+                return Frame.from_raw(self.backend.exec_out(self.serial, "screencap"))
+            except FrameFormatException:
+                # 设备不支持原始帧格式, 之后都使用 PNG
+                self.raw_screencap = False
+        return Frame.from_png(self.backend.exec_out(self.serial, "screencap", "-p"))
+
     def get_screen_size(self) -> tuple:
-        p = self.shell('wm', 'size')
-        stdout, stderr = p.communicate()
-        if p.returncode != 0:
-            raise Exception(stderr)
-        size = stdout.decode("utf-8").strip().split()[2].split('x')
+        """
+        获取屏幕分辨率, 设置了 Override size 时以其为准
+        """
+        stdout = self.shell('wm', 'size')
+        size = stdout.decode("utf-8").strip().splitlines()[-1].split()[2].split('x')
         return int(size[0]), int(size[1])
 
     @property
     def screen_size(self):
-        return self.get_screen_size()
+        """
+        屏幕分辨率, 每台设备只查询一次
+        """
+        if (size := self._screen_sizes.get(self.serial)) is None:
+            size = self._screen_sizes[self.serial] = self.get_screen_size()
+        return size
 
     def get_device_id(self):
-        p = self.command('get-serialno')
-        stdout, stderr = p.communicate()
-        if p.returncode != 0:
-            raise Exception(stderr)
-        return stdout.decode("utf-8").strip()
+        return self.backend.get_serialno(self.serial)
 
     @property
     def device_id(self):
         return self.get_device_id()
 
     def kill_server(self):
-        p = self.command('kill-server')
-        stdout, stderr = p.communicate()
-        if p.returncode != 0:
-            raise Exception(stderr)
-
-    def __del__(self):
-        self.kill_server()
+        self.backend.kill_server()
@@ -0,0 +1,183 @@
+"""
+异步 adb 接口
+
+基于 asyncio 流直接与 adb server 通信, 单个事件循环即可同时驱动多台设备,
+并发量按设备与全局分别限制
+"""
+import asyncio
+from collections import deque
+from typing import Deque, Dict, Set, Tuple
+
+from ocr import Frame, FrameFormatException
+
+from .adb_protocol import AdbProtocolError, encode_request, server_address, POOL_SIZE
+
+# 每台设备同时执行的命令数
+DEVICE_CONCURRENCY = 4
+# 所有设备同时执行的命令数
+GLOBAL_CONCURRENCY = 64
+
+
+class AsyncAdbConnection:
+    """
+    与 adb server 之间的一条异步连接
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, address: Tuple[str, int]) -> "AsyncAdbConnection":
+        return cls(*await asyncio.open_connection(*address))
+
+    async def request(self, service: str):
+        """
+        发送请求并等待 OKAY
+        """
+        self.writer.write(encode_request(service))
+        await self.writer.drain()
+        try:
+            status = await self.reader.readexactly(4)
+        except asyncio.IncompleteReadError:
+            raise AdbProtocolError("adb server 连接已断开")
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            raise AdbProtocolError((await self.read_block()).decode("utf-8", "replace"))
+        raise AdbProtocolError(f"未知的响应: {status!r}")
+
+    async def read_block(self) -> bytes:
+        return await self.reader.readexactly(int(await self.reader.readexactly(4), 16))
+
+    async def read_all(self) -> bytes:
+        return await self.reader.read()
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncAdb:
+    def __init__(self,
+                 address: Tuple[str, int] = None,
+                 device_concurrency: int = DEVICE_CONCURRENCY,
+                 global_concurrency: int = GLOBAL_CONCURRENCY,
+                 pool_size: int = POOL_SIZE):
+        """
+        :param address: adb server 地址
+        :param device_concurrency: 每台设备同时执行的命令数
+        :param global_concurrency: 所有设备同时执行的命令数
+        :param pool_size: 每台设备预先建立好的空闲连接数
+        """
+        self.address = address or server_address()
+        self.device_concurrency = device_concurrency
+        self.pool_size = pool_size
+        self._global = asyncio.Semaphore(global_concurrency)
+        self._devices: Dict[str, asyncio.Semaphore] = {}
+        self._idle: Dict[str, Deque[AsyncAdbConnection]] = {}
+        self._filling: Dict[str, int] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _limit(self, serial: str) -> asyncio.Semaphore:
+        if (sem := self._devices.get(serial)) is None:
+            sem = self._devices[serial] = asyncio.Semaphore(self.device_concurrency)
+        return sem
+
+    async def _host(self, service: str) -> bytes:
+        async with self._global:
+            conn = await AsyncAdbConnection.open(self.address)
+            try:
+                await conn.request(service)
+                return await conn.read_block()
+            finally:
+                conn.close()
+
+    async def _transport(self, serial: str) -> AsyncAdbConnection:
+        conn = await AsyncAdbConnection.open(self.address)
+        try:
+            await conn.request(f"host:transport:{serial}")
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    async def _refill(self, serial: str):
+        try:
+            conn = await self._transport(serial)
+        except (OSError, AdbProtocolError):
+            return
+        finally:
+            self._filling[serial] -= 1
+        self._idle.setdefault(serial, deque()).append(conn)
+
+    def _acquire(self, serial: str):
+        """
+        取出一条已切换到设备的空闲连接(可能为 None), 并在后台补充
+        """
+        idle = self._idle.get(serial)
+        conn = idle.popleft() if idle else None
+        missing = self.pool_size - len(idle or ()) - self._filling.get(serial, 0)
+        for _ in range(max(missing, 0)):
+            self._filling[serial] = self._filling.get(serial, 0) + 1
+            task = asyncio.ensure_future(self._refill(serial))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return conn
+
+    async def _service(self, serial: str, service: str) -> bytes:
+        # wait for the device first, so calls queued on a busy device do not hold global slots
+        async with self._limit(serial), self._global:
+            conn = self._acquire(serial)
+            try:
+                if conn is not None:
+                    try:
+                        await conn.request(service)
+                    except (OSError, AdbProtocolError):
+                        # 池中的连接可能已被服务端关闭, 重新建立一次
+                        conn.close()
+                        conn = None
+                if conn is None:
+                    conn = await self._transport(serial)
+                    await conn.request(service)
+                return await conn.read_all()
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    @staticmethod
+    def _join(args) -> str:
+        return " ".join(str(arg) for arg in args)
+
+    async def devices(self, long: bool = False) -> bytes:
+        return await self._host("host:devices-l" if long else "host:devices")
+
+    async def get_state(self, serial: str) -> str:
+        return (await self._host(f"host-serial:{serial}:get-state")).decode("utf-8").strip()
+
+    async def shell(self, serial: str, *args) -> bytes:
+        return await self._service(serial, f"shell:{self._join(args)}")
+
+    async def exec_out(self, serial: str, *args) -> bytes:
+        return await self._service(serial, f"exec:{self._join(args)}")
+
+    async def screencap(self, serial: str, raw: bool = True) -> Frame:
+        """
+        截图, 原始帧解析失败时退回 PNG
+        """
+        if raw:
+            try:
+                return Frame.from_raw(await self.exec_out(serial, "screencap"))
+            except FrameFormatException:
+                pass
+        return Frame.from_png(await self.exec_out(serial, "screencap", "-p"))
+
+    def close(self):
+        """
+        关闭所有空闲连接
+        """
+        for task in self._tasks:
+            task.cancel()
+        for idle in self._idle.values():
+            for conn in idle:
+                conn.close()
+        self._idle.clear()
@@ -0,0 +1,179 @@
+"""
+设备状态跟踪
+
+订阅 adb server 的 host:track-devices, 在内存中维护 序列号->状态 表,
+供脚本执行器与连接监听器查询, 代替每次都启动进程执行 get-serialno / get-state
+"""
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from .adb_protocol import AdbConnection, AdbProtocolError, server_address
+
+# 与 adb server 断开后的重连间隔(秒)
+RECONNECT_INTERVAL = 1.0
+# 等待首次连接结果的时间(秒), 只在跟踪器刚启动时等待
+READY_TIMEOUT = 3.0
+# 与 server 断开、尚未重新拿到设备列表时查询到的状态
+UNKNOWN = "unknown"
+# 与 server 断开后仍视设备在线的时间(秒), 约为几次重连尝试, 超过后视为离线
+UNKNOWN_GRACE = 5 * RECONNECT_INTERVAL
+
+
+def parse_devices(data: bytes) -> Dict[str, str]:
+    """
+    解析 track-devices 推送的设备列表
+
+    :param data: 形如 b"serial\\tdevice\\n..." 的数据
+    :return: {序列号: 状态}
+    """
+    table = {}
+    for line in data.decode("utf-8").splitlines():
+        if "\t" in line:
+            serial, state = line.split("\t", 1)
+            table[serial] = state.split()[0]
+    return table
+
+
+class DeviceTracker:
+    """
+    设备状态跟踪器
+    每个 adb server 地址只有一个实例, 通过 shared() 获取
+    """
+    _instances: Dict[Tuple[str, int], "DeviceTracker"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, address: Tuple[str, int] = None, start_server: Callable[[], None] = None):
+        """
+        :param address: adb server 地址
+        :param start_server: adb server 未启动时的启动回调, 只调用一次
+        """
+        self.address = address or server_address()
+        self.start_server = start_server
+        self._devices: Dict[str, str] = {}
+        self._changed = threading.Condition()
+        self._ready = threading.Event()
+        # 首次连接已有结果(拿到设备列表或连接失败)
+        self._attempted = threading.Event()
+        # 与 server 断开的时间, 连接正常时为 None
+        self._lostAt: Optional[float] = None
+        self._stopped = False
+        self._conn: Optional[AdbConnection] = None
+        self._thread = threading.Thread(target=self._run, daemon=True, name="adb-track-devices")
+
+    @classmethod
+    def shared(cls, address: Tuple[str, int] = None, start_server: Callable[[], None] = None) -> "DeviceTracker":
+        """
+        获取(并在需要时启动)指定 adb server 的共享跟踪器
+
+        :param address: adb server 地址
+        :param start_server: adb server 未启动时的启动回调, 只在创建跟踪器时使用
+        """
+        address = address or server_address()
+        with cls._instances_lock:
+            if (tracker := cls._instances.get(address)) is None:
+                tracker = cls._instances[address] = cls(address, start_server)
+                tracker.start()
+            return tracker
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        if self._conn is not None:
+            self._conn.close()
+        with self._changed:
+            self._changed.notify_all()
+        with self._instances_lock:
+            if self._instances.get(self.address) is self:
+                del self._instances[self.address]
+
+    def _update(self, table: Dict[str, str], ready: bool):
+        with self._changed:
+            self._devices = table
+            if ready:
+                self._ready.set()
+                self._lostAt = None
+            else:
+                self._ready.clear()
+                if self._lostAt is None:
+                    self._lostAt = time.monotonic()
+            self._changed.notify_all()
+        self._attempted.set()
+
+    def _run(self):
+        start_server = self.start_server
+        while not self._stopped:
+            refused = False
+            try:
+                self._conn = AdbConnection(self.address)
+                self._conn.request("host:track-devices")
+                while True:
+                    self._update(parse_devices(self._conn.read_block()), ready=True)
+            except ConnectionRefusedError:
+                refused = True
+            except (OSError, AdbProtocolError):
+                pass
+            finally:
+                if self._conn is not None:
+                    self._conn.close()
+            # 与 server 断开, 在重新拿到设备列表之前设备状态未知
+            self._update({}, ready=False)
+            if refused and start_server is not None:
+                # server 未启动, 在跟踪线程中启动一次后立即重连, 查询方不等待
+                starting, start_server = start_server, None
+                try:
+                    starting()
+                except Exception:
+                    pass
+                continue
+            with self._changed:
+                self._changed.wait_for(lambda: self._stopped, RECONNECT_INTERVAL)
+
+    @property
+    def devices(self) -> Dict[str, str]:
+        """
+        当前设备表的快照, 与 server 断开期间为空
+        """
+        self._attempted.wait(READY_TIMEOUT)
+        return dict(self._devices)
+
+    def state(self, serial: str) -> Optional[str]:
+        """
+        获取设备状态, 设备不存在时返回 None
+        与 server 断开期间立即返回 UNKNOWN, 由跟踪线程在后台重连
+
+        :param serial: 设备序列号
+        :return: device | offline | unauthorized | ... | UNKNOWN | None
+        """
+        self._attempted.wait(READY_TIMEOUT)
+        if not self._ready.is_set():
+            return UNKNOWN
+        return self._devices.get(serial)
+
+    def is_online(self, serial: str, grace: float = 0) -> bool:
+        """
+        设备是否在线
+
+        :param serial: 设备序列号
+        :param grace: 与 server 断开(状态为 UNKNOWN)后仍视设备在线的时间(秒), 0 表示断开即视为离线
+        """
+        if (state := self.state(serial)) == UNKNOWN:
+            lostAt = self._lostAt
+            return lostAt is not None and time.monotonic() - lostAt < grace
+        return state == "device"
+
+    def wait_for(self, serial: str, predicate: Callable[[Optional[str]], bool], timeout: float = None) -> bool:
+        """
+        阻塞直到设备状态满足条件
+
+        :param serial: 设备序列号
+        :param predicate: 以设备状态为参数的判断函数
+        :param timeout: 超时时间(秒), None 表示一直等待
+        :return: 是否满足条件(超时返回 False)
+        """
+        # 与 server 断开期间设备表不可信, 不做判断
+        with self._changed:
+            return self._changed.wait_for(
+                lambda: self._ready.is_set() and predicate(self._devices.get(serial)), timeout)
@@ -0,0 +1,96 @@
+"""
+截图帧缓存
+
+同一画面上连续的多条 ocr 指令共用一次截图, 产生输入的指令执行后、sleep / stay 等待与暂停之后缓存失效;
+stay watch 等待画面变化时只比较截图的指纹
+"""
+import time
+from typing import Callable, Optional, Sequence, Tuple
+
+from ocr import Frame
+
+# 缓存帧的最长有效时间(秒), 只防止画面自行变化(动画等), 输入与等待之后总是重新截图
+MAX_AGE = 0.3
+# stay watch 的初始轮询间隔(秒), 每次轮询后加倍, 最长为 stay 的等待时间
+WATCH_MIN_INTERVAL = 0.005
+WATCH_BACKOFF = 2
+# stay watch 只关注指令的比较区域时, 区域指纹的取样步长(像素), 区域较小, 取样更密
+WATCH_REGION_STEP = 2
+
+
+class FrameCache:
+    def __init__(self, capture: Callable[[], Frame], max_age: float = MAX_AGE):
+        """
+        :param capture: 截图函数
+        :param max_age: 缓存帧的最长有效时间(秒), 为 0 时不缓存
+        """
+        self.capture = capture
+        self.max_age = max_age
+        self.frame: Optional[Frame] = None
+        # 缓存帧的截取时间
+        self.captured_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self) -> Frame:
+        """
+        获取当前画面, 缓存有效时直接返回缓存帧
+        """
+        now = time.monotonic()
+        if self.frame is not None and now - self.captured_at <= self.max_age:
+            self.hits += 1
+            return self.frame
+        self.misses += 1
+        self.frame = self.capture()
+        self.captured_at = time.monotonic()
+        return self.frame
+
+    def invalidate(self):
+        self.frame = None
+
+
+class ScreenWatch:
+    """
+    stay watch 的等待状态: 记录判断条件时画面的指纹, 画面变化之前只截图比较指纹, 不重新执行指令
+    """
+
+    def __init__(self, address: int, regions: Sequence[Tuple[int, int, int, int]], ceiling: float):
+        """
+        :param address: 等待中的指令地址
+        :param regions: 指令比较的区域 (x, y, w, h), 为空时比较整个画面
+        :param ceiling: 最长轮询间隔(秒)
+        """
+        self.address = address
+        self.regions = tuple(regions)
+        self.ceiling = ceiling
+        self.interval = min(WATCH_MIN_INTERVAL, ceiling)
+        self.fingerprint = None
+
+    def _fingerprint(self, frame: Frame):
+        if not self.regions:
+            return frame.fingerprint()
+        return tuple(frame.fingerprint(*region, step=WATCH_REGION_STEP) for region in self.regions)
+
+    def observe(self, frame: Frame):
+        """
+        记录判断条件时的画面
+        """
+        self.fingerprint = self._fingerprint(frame)
+
+    def changed(self, frame: Frame) -> bool:
+        """
+        画面是否在上次记录之后发生了变化, 变化时记录新的画面
+        """
+        fingerprint = self._fingerprint(frame)
+        if fingerprint == self.fingerprint:
+            return False
+        self.fingerprint = fingerprint
+        return True
+
+    def next_interval(self) -> float:
+        """
+        下一次轮询前的等待时间, 从 WATCH_MIN_INTERVAL 开始逐次加倍, 直到 ceiling
+        """
+        interval = self.interval
+        self.interval = min(self.interval * WATCH_BACKOFF, self.ceiling)
+        return interval
@@ -0,0 +1,108 @@
+"""
+编译后的指令
+
+ScriptParser 输出的指令字典经过 script_optimizer 的各项变换之后, 编译为 Instruction 对象:
+字段存放在 __slots__ 中, handler 为指令类型在分派表 HANDLERS 中的下标,
+子句块预先拆分为 var / check / stay 三个元组, 执行时不再查找字典键
+"""
+from typing import Iterable, Tuple
+
+from ocr import DEFAULT_METRIC
+
+# 执行器分派表中各指令类型的顺序, 执行器按下标取出对应的 _<type>Instruction 方法
+HANDLERS = ("EOF", "exit", "sleep", "log", "var", "adb", "batch", "click", "ocr", "locate", "read", "screen")
+
+
+class Instruction:
+    """
+    一条编译后的指令, 执行器共享, 不应修改
+
+    子句均为元组:
+    var: (ID, delete, value), check: (hard, test_expr), stay: (test_expr, time, watch)
+    """
+    __slots__ = (
+        "type", "handler", "lineno", "linenos",
+        # adb / batch
+        "cmd", "cmds",
+        # click, ocr 与 locate 的区域
+        "pos", "target",
+        # ocr / locate / read / screen
+        "path", "confidence", "entries", "single", "metric", "param", "resize", "reduce", "scale", "regions",
+        "max_distance",
+        # sleep / log / var
+        "time", "msg", "ID", "delete", "value",
+        # 子句
+        "var", "check", "stay",
+        # stay watch 比较的区域, 为空时比较整个画面
+        "watched",
+        # 编译前的指令字典, 与由其生成的日志内容(第一次显示时生成)
+        "parsed", "text",
+    )
+
+    def __init__(self, parsed: dict):
+        """
+        :param parsed: ScriptParser 输出(经过优化)的指令字典
+        """
+        self.type = parsed["type"]
+        try:
+            self.handler = HANDLERS.index(self.type)
+        except ValueError:
+            raise Exception(f"未知的指令类型: {self.type}")
+        self.lineno = parsed.get("lineno")
+        self.linenos = parsed.get("linenos", ())
+
+        self.cmd = parsed.get("cmd")
+        self.cmds = parsed.get("cmds")
+        self.pos = parsed.get("pos")
+        self.target = parsed.get("target")
+        self.path = parsed.get("path")
+        self.confidence = parsed.get("confidence")
+        # ocr 指令统一为多区域形式, single 表示 _RET 为单个结果
+        self.single = "entries" not in parsed
+        self.entries = parsed.get("entries") or \
+            (((self.pos, self.path, self.confidence),) if self.type == "ocr" else ())
+        self.metric = parsed.get("metric", DEFAULT_METRIC)
+        self.param = parsed.get("param")
+        self.resize = parsed.get("resize", False)
+        self.reduce = parsed.get("reduce", 1)
+        self.scale = parsed.get("scale", (1, 1))
+        self.regions = parsed.get("regions", ())
+        self.max_distance = parsed.get("max_distance")
+        self.time = parsed.get("time")
+        self.msg = parsed.get("msg")
+        self.ID = parsed.get("ID")
+        self.delete = parsed.get("del", False)
+        self.value = parsed.get("value")
+
+        block = parsed.get("block") or {}
+        self.var = tuple((c["ID"], c["del"], c["value"]) for c in block.get("var", ()))
+        self.check = tuple((c["check_mode"] == "hard", c["test_expr"]) for c in block.get("check", ()))
+        self.stay = tuple((c["test_expr"], c["time"], c.get("watch", False)) for c in block.get("stay", ()))
+
+        match self.type:
+            case "ocr":
+                self.watched = tuple(box for box, _, _ in self.entries)
+            case "read":
+                self.watched = self.regions
+            case "locate" if self.pos is not None:
+                self.watched = self.pos,
+            case _:
+                self.watched = ()
+
+        self.parsed = parsed
+        self.text = None
+
+    def __str__(self):
+        if self.text is None:
+            self.text = str(self.parsed)
+        return self.text
+
+    def __repr__(self):
+        return f"<Instruction {self.type} line={self.lineno}>"
+
+
+def compile_script(parsed: Iterable[dict]) -> Tuple[Instruction, ...]:
+    """
+    将指令字典列表编译为 Instruction 元组
+    """
+    return tuple(Instruction(instruction) for instruction in parsed)
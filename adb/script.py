@@ -1,24 +1,221 @@
+import copy
+import threading
+import warnings
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from adb.script_optimizer import (
+    parse_resolution,
+    parse_scale,
+    reduce_comparisons,
+    scale_coordinates,
+    OptimizationReport,
+    PRAGMA_RESOLUTION,
+    PRAGMA_SCALE,
+)
+from adb.instruction import compile_script, Instruction
+from adb.Interruptions import ParsedScriptFailed
+from adb.script_cache import load_optimized
 from adb.script_parser import ScriptParser
+from ocr import load_atlas, load_index, template_cache
 
 
 class Script:
 
-    def __init__(self, file, interval=-1):
-        parser = ScriptParser(interval)
-        self.script = parser.parse(file)
+    def __init__(self, file, interval=-1, cache=True, lazy=False):
+        """
+        :param file: script file
+        :param interval: seconds to sleep after every instruction, see ScriptParser
+        :param cache: read and write the parse cache next to the script, see script_cache
+        :param lazy: parse and compile the instructions while the script is executed instead of before,
+                     see _initLazy
+        """
+        # what the optimizer passes changed, see `python -m adb --explain`
+        self.report = OptimizationReport()
+        # device resolution -> scaled script
+        self._scaled: Dict[Tuple[int, int], "Script"] = {}
+        self._beginAddress = 0
+        # where lazily parsed instructions come from, None once every instruction is compiled
+        self._source: Optional[Iterator[dict]] = None
+        # the syntax error that ended the lazily parsed instructions
+        self._error: Optional[ParsedScriptFailed] = None
+        if lazy:
+            self._initLazy(file, interval)
+            return
+
+        # the parse result and the output of the optimizer passes are cached in __baslcache__ next to the script,
+        # see script_cache and script_optimizer.optimize
+        parsed, self.pragmas, self.report = load_optimized(file, interval, cache)
+        # the instruction dicts after the optimizer passes, kept for converting coordinates
+        self.parsed = tuple(parsed)
+        # the compiled instructions are shared by executors and must not be modified
+        self.script = compile_script(self.parsed)
+
+        # the resolution the script was written for, None if the script does not declare it
+        self.resolution: Optional[Tuple[int, int]] = None
+        if PRAGMA_RESOLUTION in self.pragmas:
+            self.resolution = parse_resolution(self.pragmas[PRAGMA_RESOLUTION])
+
+        # decode the templates, glyph atlases and screen indexes now, so the first instruction using them does not read the disk
+        templates: Dict[int, set] = {}
+        for instruction in self.parsed:
+            if instruction["type"] in ("ocr", "locate"):
+                paths = templates.setdefault(instruction.get("reduce", 1), set())
+                if "path" in instruction:
+                    paths.add(instruction["path"])
+                paths.update(path for _, path, _ in instruction.get("entries", ()))
+        for reduce, paths in templates.items():
+            template_cache.preload(sorted(paths), reduce)
+        for instruction in self.parsed:
+            if (load := {"read": load_atlas, "screen": load_index}.get(instruction["type"])) is not None:
+                try:
+                    load(instruction["path"])
+                except (OSError, ValueError) as e:
+                    warnings.warn(f"文件加载失败: {instruction['path']}: {e}")
 
         # calculate the length of script,and the lowest instruction pointer
         self._length = len(self.script)
-        self._beginAddress = 0
+
+    def _initLazy(self, file, interval):
+        """
+        streaming mode: the file is read and parsed as the executor fetches instructions, execution starts
+        once the first statement is parsed. compiled instructions are kept, jumping back does not parse again.
+        the passes that need the whole program (folding, dead vars, coalescing, preloading) are skipped,
+        the parse cache is not used, and pragmas must come before the first statement.
+        a syntax error is raised as ParsedScriptFailed when the executor reaches the instruction
+        """
+        parser = ScriptParser(interval)
+        self._source = parser.iter_parse(file)
+        self._lock = threading.Lock()
+        self.parsed = []
+        self.script = []
+        self._length = None
+
+        # reading up to the first instruction also reads the pragmas in the header of the script
+        self._pull(0)
+        self.pragmas = dict(parser.pragmas)
+        self.resolution = None
+        if PRAGMA_RESOLUTION in self.pragmas:
+            self.resolution = parse_resolution(self.pragmas[PRAGMA_RESOLUTION])
+        if PRAGMA_SCALE in self.pragmas:
+            reduce = parse_scale(self.pragmas[PRAGMA_SCALE])
+            self.parsed[:] = reduce_comparisons(self.parsed, reduce)
+            self.script[:] = compile_script(self.parsed)
+            if self._source is not None:
+                self._source = (reduce_comparisons((instruction,), reduce)[0] for instruction in self._source)
+        if self._source is not None:
+            self._source = self._checkPragmas(self._source, parser.pragmas)
+
+    def _checkPragmas(self, source: Iterator[dict], pragmas: Dict[str, str]) -> Iterator[dict]:
+        """
+        warn about the pragmas the parser reads after the script started
+        """
+        yield from source
+        if late := pragmas.keys() - self.pragmas.keys():
+            warnings.warn(f"语法警告: 编译指示 {', '.join(sorted(late))} 位于第一条语句之后, 流式加载时被忽略")
+
+    def _pull(self, address: int):
+        """
+        parse and compile instructions until the one at address exists or the script ends (address < 0: all),
+        raise the syntax error if the script ended with one before address
+        """
+        if 0 <= address < len(self.script):
+            return
+        with self._lock:
+            while self._source is not None and (address < 0 or address >= len(self.script)):
+                try:
+                    instruction = next(self._source)
+                except StopIteration:
+                    self._source = None
+                    self._length = len(self.script)
+                    break
+                except ParsedScriptFailed as e:
+                    # from the script a scaled script follows
+                    self._source, self._error = None, e
+                    break
+                except Exception as e:
+                    self._source, self._error = None, ParsedScriptFailed(e.args[0])
+                    break
+                self.parsed.append(instruction)
+                self.script.append(Instruction(instruction))
+        if self._error is not None and not 0 <= address < len(self.script):
+            raise self._error
 
     def __getitem__(self, key):
+        if self._source is not None or self._error is not None:
+            self._pull(key)
         return self.script[key]
 
     def __contains__(self, key):
-        return key in self.script
+        """
+        whether key is the address of an instruction
+        """
+        if self._source is not None:
+            try:
+                self._pull(key - self._beginAddress)
+            except ParsedScriptFailed:
+                pass
+        return self._beginAddress <= key < self._beginAddress + len(self.script)
+
+    def addressOfLine(self, lineno: int):
+        """
+        get the instruction pointer of the instruction at the given source line
+        """
+        address = 0
+        while address + self._beginAddress in self:
+            instruction = self.script[address]
+            if lineno == instruction.lineno or lineno in instruction.linenos:
+                return address + self._beginAddress
+            address += 1
+        return None
+
+    def scaled(self, width: int, height: int) -> "Script":
+        """
+        get the script with all coordinates converted to the given device resolution,
+        the result is cached so devices with the same resolution share it
+        """
+        if self.resolution is None:
+            return self
+        # match the orientation the script was written in
+        if (width > height) != (self.resolution[0] > self.resolution[1]):
+            width, height = height, width
+        if (width, height) == self.resolution:
+            return self
+        if (script := self._scaled.get((width, height))) is None:
+            script = copy.copy(self)
+            script.resolution = (width, height)
+            script._scaled = {}
+            if self._source is None and self._error is None:
+                script.parsed = tuple(scale_coordinates(self.parsed, self.resolution, (width, height)))
+                script.script = compile_script(script.parsed)
+            else:
+                # follow the lazily parsed instructions of this script
+                script.parsed = []
+                script.script = []
+                script._lock = threading.Lock()
+                script._source = self._follow(lambda instruction: scale_coordinates(
+                    (instruction,), self.resolution, (width, height))[0])
+            self._scaled[(width, height)] = script
+        return script
+
+    def _follow(self, convert: Callable[[dict], dict]) -> Iterator[dict]:
+        """
+        the instruction dicts of this script converted by convert, parsed lazily
+        """
+        address = 0
+        while address + self._beginAddress in self:
+            yield convert(self.parsed[address])
+            address += 1
+        # the scaled script reports the same syntax error
+        if self._error is not None:
+            raise self._error
 
     @property
     def Length(self):
+        """
+        number of instructions, a lazily loaded script is parsed to the end
+        """
+        if self._length is None:
+            self._pull(-1)
         return self._length
 
     @property
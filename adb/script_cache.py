@@ -0,0 +1,185 @@
+"""
+脚本解析缓存
+
+ScriptParser 的解析结果(指令字典与编译指示)连同表达式的代码对象用 marshal 保存在脚本旁边的
+__baslcache__/<脚本文件名>.basc 中. 文件头记录脚本内容的 sha256, 解析器与 Python 字节码版本以及解析选项,
+任一项不一致时重新解析并覆盖缓存, 因此修改脚本后缓存自动失效.
+同一文件中还保存经过 script_optimizer 各优化遍之后的指令与优化记录, 以优化器版本区分,
+命中时加载脚本只需读取脚本与缓存并 unmarshal, 不再逐行解析, 编译表达式与执行优化遍
+"""
+import hashlib
+import importlib.util
+import marshal
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from adb.script_optimizer import optimize, OptimizationReport, OPTIMIZER_VERSION
+from adb.script_parser import CompiledExpr, ScriptParser, PARSER_VERSION
+
+# 缓存目录名, 位于脚本所在目录
+CACHE_DIR = "__baslcache__"
+# 缓存文件格式的标识
+MAGIC = b"BASC"
+# 缓存文件格式版本
+FORMAT_VERSION = 2
+
+
+def cache_path(scriptFile: str) -> str:
+    """
+    脚本对应的缓存文件路径
+    """
+    directory, name = os.path.split(os.path.abspath(scriptFile))
+    return os.path.join(directory, CACHE_DIR, f"{name}.basc")
+
+
+def _extract(obj: Any, path: tuple, exprs: list) -> Any:
+    """
+    复制解析结果(其中的字典与列表), CompiledExpr 替换为 None, 并记录 (位置, 表达式, 行号, 代码对象),
+    加载时按位置放回, 不必遍历整个解析结果
+    """
+    if isinstance(obj, CompiledExpr):
+        exprs.append((path, obj.expr, obj.lineno, obj.compiled_expr))
+        return None
+    if isinstance(obj, dict):
+        return {key: _extract(value, path + (key,), exprs) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_extract(value, path + (i,), exprs) for i, value in enumerate(obj)]
+    # 元组等不可变对象中不应出现表达式, 出现时 marshal 失败, 不写入缓存
+    return obj
+
+
+def _restore(parsed: List[dict], exprs: list) -> List[dict]:
+    for path, expr, lineno, code in exprs:
+        container = parsed
+        for key in path[:-1]:
+            container = container[key]
+        container[path[-1]] = CompiledExpr(expr, lineno, code)
+    return parsed
+
+
+def _dumps(parsed: List[dict]) -> bytes:
+    exprs = []
+    stored = _extract(parsed, (), exprs)
+    return marshal.dumps((stored, exprs))
+
+
+def _loads(data: bytes) -> List[dict]:
+    return _restore(*marshal.loads(data))
+
+
+def _header(scriptFile: str, interval) -> Tuple[tuple, bytes]:
+    """
+    :return: (缓存文件头, 脚本内容)
+    """
+    with open(scriptFile, "rb") as f:
+        source = f.read()
+    # 代码对象只能由同一版本的 Python 加载
+    return (MAGIC, FORMAT_VERSION, importlib.util.MAGIC_NUMBER, PARSER_VERSION, hashlib.sha256(source).hexdigest(),
+            interval), source
+
+
+def _read(path: str, header: tuple) -> Optional[tuple]:
+    """
+    读取缓存, 文件头与 header 一致时返回 (解析结果, 编译指示, 优化结果), 各结果为 marshal 数据
+    """
+    try:
+        with open(path, "rb") as f:
+            cached = marshal.loads(f.read())
+        if cached[0] == header:
+            return cached[1:]
+    except (OSError, EOFError, ValueError, TypeError, IndexError):
+        # 缓存不存在, 已损坏或格式不同
+        pass
+    return None
+
+
+def _write(path: str, data: tuple):
+    try:
+        data = marshal.dumps(data)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写入临时文件再替换, 同时加载同一脚本的执行器不会读到不完整的缓存
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except (OSError, ValueError):
+        # 脚本目录不可写时不缓存
+        pass
+
+
+def _parse(source: bytes, interval) -> Tuple[List[dict], Dict[str, str], Optional[bytes]]:
+    """
+    :return: (解析结果, 编译指示, 解析结果的 marshal 数据, 解析结果中有无法保存的对象时为 None)
+    """
+    parser = ScriptParser(interval)
+    parsed = parser.parse_source(source.decode("utf-8"))
+    try:
+        data = _dumps(parsed)
+    except ValueError:
+        # 元组等不可变对象中出现了表达式, 不缓存
+        data = None
+    return parsed, parser.pragmas, data
+
+
+def load_parsed(scriptFile: str, interval=-1, cache: bool = True) -> Tuple[List[dict], Dict[str, str]]:
+    """
+    解析脚本, 缓存有效时直接从缓存加载
+
+    :param scriptFile: 脚本路径
+    :param interval: 指令间隔, 见 ScriptParser
+    :param cache: 为 False 时不读写缓存
+    :return: (指令字典列表, 编译指示)
+    """
+    header, source = _header(scriptFile, interval)
+    path = cache_path(scriptFile)
+    if cache and (cached := _read(path, header)) is not None:
+        try:
+            return _loads(cached[0]), cached[1]
+        except (EOFError, ValueError, TypeError, IndexError, KeyError):
+            pass
+
+    parsed, pragmas, data = _parse(source, interval)
+    if cache and data is not None:
+        _write(path, (header, data, pragmas, None))
+    return parsed, pragmas
+
+
+def load_optimized(scriptFile: str, interval=-1, cache: bool = True
+                   ) -> Tuple[List[dict], Dict[str, str], OptimizationReport]:
+    """
+    解析脚本并执行优化遍(script_optimizer.optimize), 缓存中有同一优化器版本的结果时直接加载;
+    只有解析结果有效时复用解析结果, 重新执行优化遍
+
+    :param scriptFile: 脚本路径
+    :param interval: 指令间隔, 见 ScriptParser
+    :param cache: 为 False 时不读写缓存
+    :return: (优化后的指令字典列表, 编译指示, 优化记录)
+    """
+    header, source = _header(scriptFile, interval)
+    path = cache_path(scriptFile)
+    parsed = data = None
+    if cache and (cached := _read(path, header)) is not None:
+        data, pragmas, optimized = cached
+        try:
+            if optimized is not None and optimized[0] == OPTIMIZER_VERSION:
+                _, stored, before, notes, messages = optimized
+                report = OptimizationReport()
+                report.before, report.notes = before, list(notes)
+                for message in messages:
+                    report.warn(message)
+                return _loads(stored), pragmas, report
+            parsed = _loads(data)
+        except (EOFError, ValueError, TypeError, IndexError, KeyError):
+            parsed = None
+
+    if parsed is None:
+        parsed, pragmas, data = _parse(source, interval)
+    parsed, report = optimize(parsed, pragmas)
+    if cache and data is not None:
+        try:
+            optimized = (OPTIMIZER_VERSION, _dumps(parsed), report.before, report.notes, report.warnings)
+        except ValueError:
+            optimized = None
+        _write(path, (header, data, pragmas, optimized))
+    return parsed, pragmas, report
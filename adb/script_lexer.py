@@ -0,0 +1,110 @@
+"""
+BASL 词法分析
+
+按行切分词法单元, 每个字符只扫描一次. 比较运算符 eq / neq / nin 是独立的词法单元(对应 BASL/baslLexer.g4 中的
+EQ / NEQ / NIN), 表达式转换为 Python 源码时只替换这些单元, 不会改动含有同样字母的标识符(如 sequence, spinner)
+与字符串中的内容
+"""
+import functools
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+# 比较运算符 -> Python 运算符
+COMPARE_OPS = {"eq": "==", "neq": "!=", "nin": "not in"}
+
+# 跳过空白后匹配一个词法单元
+_TOKEN_RE = re.compile(r"""
+    [ \t\f]*
+    (?:
+        (?P<COMMENT>\#.*)
+      | (?P<STRING>[rRbBuUfF]{0,2}(?:"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'))
+      | (?P<NUMBER>0[xXoObB][0-9a-fA-F_]+|(?:\d[\d_]*(?:\.[\d_]*)?|\.\d[\d_]*)(?:[eE][+-]?\d+)?[jJ]?)
+      | (?P<NAME>[^\W\d]\w*)
+      | (?P<OP>\*\*=?|//=?|->|<<=?|>>=?|:=|[-+*/%@&|^<>!=]=|[-+*/%@&|^~<>()\[\]{},:.;=])
+      | (?P<ERROR>.)
+    )
+""", re.VERBOSE)
+
+
+class Token(NamedTuple):
+    # NAME | NUMBER | STRING | OP | COMPARE | COMMENT | ERROR
+    kind: str
+    text: str
+    # 在行中的起止位置, 从 0 开始
+    start: int
+    end: int
+
+
+# 不经过 NamedTuple 生成的 __new__, 每个词法单元都要创建
+_token = functools.partial(tuple.__new__, Token)
+
+
+def scan(line: str, pos: int) -> Optional[Token]:
+    """
+    pos 之后的下一个词法单元, 已到行尾时为 None;
+    无法识别的字符(包括缺少结束引号的字符串的引号)为 ERROR, 由语法分析在用到时报告
+
+    :param line: 一行源码(不含换行符)
+    :param pos: 开始位置
+    """
+    if (m := _TOKEN_RE.match(line, pos)) is None:
+        return None
+    kind = m.lastgroup
+    start = m.start(kind)
+    text = m.group(kind)
+    if kind == "NAME" and text in COMPARE_OPS:
+        kind = "COMPARE"
+    return _token((kind, text, start, m.end()))
+
+
+def tokenize(line: str, pos: int = 0) -> List[Token]:
+    """
+    切分一行中 pos 之后的内容, 注释为最后一个单元
+    """
+    tokens = []
+    while (token := scan(line, pos)) is not None:
+        # 属性名(如 _RET.eq)不是运算符
+        if token.kind == "COMPARE" and tokens and tokens[-1].text == ".":
+            token = token._replace(kind="NAME")
+        tokens.append(token)
+        pos = token.end
+    return tokens
+
+
+def python_expr(line: str, tokens: List[Token]) -> Tuple[str, List[Tuple[int, int]]]:
+    """
+    将表达式的词法单元还原为 Python 源码, 比较运算符替换为 Python 写法, 其余内容(包括空白)保持原样
+
+    :param line: 词法单元所在的行
+    :param tokens: 表达式的词法单元, 不能为空
+    :return: (Python 源码, [(源码中的位置, 行中对应的位置), ...]) 后者记录每处替换之后的位置对应关系, 用于报告错误位置
+    """
+    parts = []
+    shifts = []
+    pos = tokens[0].start
+    length = 0
+    for token in tokens:
+        if token.kind == "COMPARE":
+            parts.append(line[pos:token.start])
+            parts.append(COMPARE_OPS[token.text])
+            length += token.start - pos + len(COMPARE_OPS[token.text])
+            pos = token.end
+            shifts.append((length, pos))
+    parts.append(line[pos:tokens[-1].end])
+    return "".join(parts), shifts
+
+
+def source_column(start: int, shifts: List[Tuple[int, int]], offset: int) -> int:
+    """
+    Python 源码中的位置对应的行中位置
+
+    :param start: 表达式在行中的开始位置
+    :param shifts: python_expr 返回的位置对应关系
+    :param offset: Python 源码中的位置, 从 0 开始
+    """
+    base, column = 0, start
+    for expr_pos, line_pos in shifts:
+        if expr_pos > offset:
+            break
+        base, column = expr_pos, line_pos
+    return column + offset - base
@@ -0,0 +1,558 @@
+"""
+脚本优化
+
+在 ScriptParser.parse 之后对指令列表进行变换, 不改变脚本语义
+查看一个脚本的优化结果: python -m adb --explain path/to/script.bas
+"""
+import ast
+import functools
+import warnings
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+# 编译指示: 关闭输入合并
+PRAGMA_NO_COALESCE = "no-coalesce"
+# 编译指示: 关闭常量折叠与无用子句/变量的删除
+PRAGMA_NO_OPTIMIZE = "no-optimize"
+# 编译指示: 脚本编写时使用的分辨率, 形如 "# pragma: resolution 2340x1080"
+PRAGMA_RESOLUTION = "resolution"
+# 编译指示: ocr 指令比较前的默认缩小比例, 形如 "# pragma: scale 0.5";
+# 只对大区域有收益, 按钮大小的区域每次比较不到 1ms, 分块求平均的开销与比较的节省相当(见 benchmark/bench_reduce.py)
+PRAGMA_SCALE = "scale"
+# 缩小比例为 1/n, n 的上限
+MAX_REDUCE = 8
+# ocr 区域缩放回模板大小之后像素不可能完全一致, 使用 exact 算法的指令在换算分辨率时改用该算法
+RESIZED_METRIC = "tolerance"
+# 优化结果的版本, 任一优化遍的输出改变时加一, 使解析缓存中保存的优化结果失效(见 script_cache)
+OPTIMIZER_VERSION = 3
+
+# 常量表达式中允许出现的语法节点, 不含运算与调用, 求值不会耗时或产生副作用; 变量名只允许已知值的(如 click 的 _RET)
+_CONSTANT_NODES = (ast.Expression, ast.Constant, ast.Compare, ast.BoolOp, ast.UnaryOp, ast.Tuple, ast.List, ast.Set,
+                   ast.Dict, ast.Name, ast.expr_context, ast.cmpop, ast.boolop, ast.unaryop)
+
+
+class OptimizationReport:
+    """
+    优化过程的记录, 供 python -m adb --explain 显示
+    """
+    # 类别 -> 说明
+    KINDS = {
+        "fold": "折叠的常量表达式",
+        "check": "删除的恒为真的 check",
+        "check-false": "恒为假的 check",
+        "stay": "删除的恒为真的 stay",
+        "stay-false": "恒为假的 stay",
+        "var": "删除的无用变量赋值",
+        "del": "删除的无用 var del",
+        "coalesce": "合并的输入指令",
+    }
+
+    def __init__(self):
+        # 优化前的指令数
+        self.before = 0
+        # (类别, 行号, 说明)
+        self.notes: List[Tuple[str, Optional[int], str]] = []
+        # 优化过程中发出的警告, 从缓存加载优化结果时重新发出
+        self.warnings: List[str] = []
+
+    def add(self, kind: str, lineno: Optional[int], detail: str):
+        self.notes.append((kind, lineno, detail))
+
+    def warn(self, message: str):
+        self.warnings.append(message)
+        warnings.warn(message)
+
+    def count(self, kind: str) -> int:
+        return sum(1 for k, _, _ in self.notes if k == kind)
+
+    def format(self, verbose: bool = False) -> str:
+        lines = [f"  {text}: {self.count(kind)}" for kind, text in self.KINDS.items()]
+        if verbose:
+            lines.extend(f"  line {'?' if lineno is None else lineno}: {detail}"
+                         for _, lineno, detail in sorted(self.notes, key=lambda note: note[1] or 0))
+        return "\n".join(lines)
+
+
+def _input_cmd(instruction: dict) -> Optional[str]:
+    """
+    如果指令是不带子句的输入指令, 返回对应的 shell 命令
+    """
+    if instruction.get("block"):
+        return None
+    match instruction["type"]:
+        case "click" if "pos" in instruction:
+            x, y = instruction["pos"]
+            return f"input tap {x} {y}"
+        case "adb":
+            cmd = instruction["cmd"]
+            if len(cmd) > 2 and cmd[0] == "shell" and cmd[1] == "input":
+                return " ".join(cmd[1:])
+    return None
+
+
+def coalesce_inputs(parsed: List[dict], report: OptimizationReport = None) -> List[dict]:
+    """
+    将连续的不带子句的 click / adb shell input 指令合并为一条 batch 指令, 通过一次 shell 调用执行,
+    夹在其中的 sleep 指令(包括 instructionInterval 插入的)在设备端以 sleep 命令执行
+
+    {"type": "batch", "cmds": ("input tap 1 2", "sleep 0.5", "input keyevent 4"), "lineno": 1, "linenos": (1, 2)}
+    """
+    optimized = []
+    i = 0
+    while i < len(parsed):
+        if (cmd := _input_cmd(parsed[i])) is None:
+            optimized.append(parsed[i])
+            i += 1
+            continue
+
+        cmds = [cmd]
+        linenos = [parsed[i]["lineno"]]
+        end = i + 1
+        j = i + 1
+        while j < len(parsed):
+            sleeps = []
+            while j < len(parsed) and parsed[j]["type"] == "sleep":
+                sleeps.append(f"sleep {parsed[j]['time']:g}")
+                j += 1
+            if j == len(parsed) or (cmd := _input_cmd(parsed[j])) is None:
+                break
+            cmds.extend(sleeps)
+            cmds.append(cmd)
+            linenos.append(parsed[j]["lineno"])
+            j += 1
+            end = j
+
+        if len(linenos) == 1:
+            optimized.append(parsed[i])
+        else:
+            if report is not None:
+                report.add("coalesce", linenos[0], f"{len(linenos)} 条输入指令合并为一次 shell 调用: {' && '.join(cmds)}")
+            optimized.append({
+                "type": "batch",
+                "cmds": tuple(cmds),
+                "lineno": linenos[0],
+                "linenos": tuple(linenos),
+            })
+        i = end
+    return optimized
+
+
+def parse_resolution(value: str) -> Tuple[int, int]:
+    """
+    "2340x1080" -> (2340, 1080)
+    """
+    try:
+        width, height = value.lower().split("x")
+        return int(width), int(height)
+    except ValueError:
+        raise Exception(f"语法错误: 分辨率格式应为 <宽>x<高>, got {value}")
+
+
+def parse_scale(value: str) -> int:
+    """
+    "0.5" | "1/2" -> 2, 即比较前的降采样倍数
+    """
+    try:
+        if "/" in value:
+            numerator, denominator = value.split("/")
+            scale = float(numerator) / float(denominator)
+        else:
+            scale = float(value)
+        reduce = round(1 / scale)
+    except (ValueError, ZeroDivisionError):
+        raise Exception(f"语法错误: 缩小比例格式应为 1/n 或小数, got {value}")
+    if not 1 <= reduce <= MAX_REDUCE or abs(1 / scale - reduce) > 0.01:
+        raise Exception(f"语法错误: 缩小比例应为 1/n (n 为 1-{MAX_REDUCE} 的整数), got {value}")
+    return reduce
+
+
+def reduce_comparisons(parsed: List[dict], reduce: int) -> List[dict]:
+    """
+    为没有单独指定缩小比例的 ocr 指令设置降采样倍数, 返回新的指令列表(不修改原指令)
+    """
+    return [{**instruction, "reduce": reduce} if instruction["type"] == "ocr" and "reduce" not in instruction
+            else instruction for instruction in parsed]
+
+
+def _scale_input_cmd(cmd: str, sx: float, sy: float) -> str:
+    """
+    缩放 input tap / input swipe 命令中的坐标
+    """
+    tokens = cmd.split(" ")
+    if len(tokens) >= 4 and tokens[0] == "input" and tokens[1] in ("tap", "swipe"):
+        # input swipe x1 y1 x2 y2 [duration]
+        n = 2 if tokens[1] == "tap" else 4
+        for i in range(2, 2 + n):
+            if i < len(tokens) and tokens[i].isdigit():
+                tokens[i] = str(round(int(tokens[i]) * (sx if i % 2 == 0 else sy)))
+    return " ".join(tokens)
+
+
+def scale_coordinates(parsed: List[dict], source: Tuple[int, int], target: Tuple[int, int]) -> List[dict]:
+    """
+    将指令中的坐标从编写分辨率换算到设备分辨率, 返回新的指令列表(不修改原指令)
+    ocr 指令的区域缩放后大小与模板不一致, 标记 resize 以便对比时将区域缩放回模板大小,
+    缩放后的区域与模板不会逐像素相同, exact 算法改为 RESIZED_METRIC 并警告;
+    locate 指令记录缩放比例, 搜索时将模板缩放到设备分辨率
+
+    :param parsed: 指令列表
+    :param source: 编写分辨率 (宽, 高)
+    :param target: 设备分辨率 (宽, 高)
+    """
+    sx = target[0] / source[0]
+    sy = target[1] / source[1]
+    if sx == 1 and sy == 1:
+        return list(parsed)
+
+    scaled = []
+    # 改用 RESIZED_METRIC 的 ocr 指令行号
+    exact = []
+    for instruction in parsed:
+        if instruction["type"] == "ocr" and instruction.get("metric", "exact") == "exact":
+            exact.append(instruction.get("lineno"))
+            instruction = {**instruction, "metric": RESIZED_METRIC, "param": None}
+        match instruction["type"]:
+            case "click" if "pos" in instruction:
+                x, y = instruction["pos"]
+                instruction = {**instruction, "pos": (round(x * sx), round(y * sy))}
+            case "ocr" if "entries" in instruction:
+                instruction = {**instruction,
+                               "entries": tuple(((round(x * sx), round(y * sy), round(w * sx), round(h * sy)), path, confidence)
+                                                for (x, y, w, h), path, confidence in instruction["entries"]),
+                               "resize": True}
+            case "ocr":
+                x, y, w, h = instruction["pos"]
+                instruction = {**instruction,
+                               "pos": (round(x * sx), round(y * sy), round(w * sx), round(h * sy)),
+                               "resize": True}
+            case "locate":
+                # 搜索区域按设备分辨率换算, 模板在搜索前按同样的比例缩放
+                instruction = {**instruction, "scale": (sx, sy)}
+                if (pos := instruction["pos"]) is not None:
+                    x, y, w, h = pos
+                    instruction["pos"] = (round(x * sx), round(y * sy), round(w * sx), round(h * sy))
+            case "read":
+                instruction = {**instruction,
+                               "regions": tuple((round(x * sx), round(y * sy), round(w * sx), round(h * sy))
+                                                for x, y, w, h in instruction["regions"])}
+            case "batch":
+                instruction = {**instruction, "cmds": tuple(_scale_input_cmd(cmd, sx, sy) for cmd in instruction["cmds"])}
+            case "adb" if instruction["cmd"][:2] == ("shell", "input"):
+                cmd = _scale_input_cmd(" ".join(instruction["cmd"][1:]), sx, sy)
+                instruction = {**instruction, "cmd": ("shell", *cmd.split(" "))}
+        scaled.append(instruction)
+    if exact:
+        warnings.warn(f"语法警告:line={','.join(str(lineno) for lineno in exact)}: 设备分辨率与编写分辨率不同, "
+                      f"缩放后的区域不会与模板逐像素相同, 这些 ocr 指令的 exact 算法已改为 {RESIZED_METRIC}")
+    return scaled
+
+
+def _names(code) -> FrozenSet[str]:
+    """
+    代码对象(包括其中的推导式等)读取的名称
+    """
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, "co_names"):
+            names |= _names(const)
+    return frozenset(names)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse(expr: str) -> Optional[ast.Expression]:
+    try:
+        return ast.parse(expr.strip(), mode="eval")
+    except SyntaxError:
+        return None
+
+
+def _constant(expr, env: Dict[str, Any], names: FrozenSet[str] = None) -> Tuple[bool, Any]:
+    """
+    判断表达式在 env 下是否为常量
+
+    :param expr: CompiledExpr
+    :param env: 已知值的局部变量
+    :param names: 表达式读取的名称, 省略时由 _names 获取
+    :return: (是否为常量, 值)
+    """
+    if names is None:
+        names = _names(expr.compiled_expr)
+    if not names <= env.keys() or (tree := _parse(expr.expr)) is None:
+        return False, None
+    if isinstance(tree.body, ast.Constant):
+        return True, tree.body.value
+    for node in ast.walk(tree):
+        if not isinstance(node, _CONSTANT_NODES) or isinstance(node, ast.Name) and node.id not in env:
+            return False, None
+    try:
+        value = eval(expr.compiled_expr, {"__builtins__": None}, dict(env))
+        bool(value)
+    except Exception:
+        return False, None
+    return True, value
+
+
+def _env(instruction: dict) -> Dict[str, Any]:
+    """
+    指令子句中已知值的局部变量: click 的 _RET 恒为 None
+    """
+    return {"_RET": None} if instruction["type"] == "click" else {}
+
+
+def _fold(expr, env: Dict[str, Any], report: Optional[OptimizationReport]):
+    """
+    常量表达式替换为其值的字面量, 无法折叠时返回原表达式
+    """
+    constant, value = _constant(expr, env)
+    if not constant:
+        return expr
+    try:
+        # 已经是字面量(如 [1,2] 与其折叠结果 [1, 2] 只有格式不同), 值没有变化, 不算折叠
+        literal = ast.literal_eval(expr.expr.strip())
+        if type(literal) is type(value) and literal == value:
+            return expr
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        pass
+    text = repr(value)
+    try:
+        if type(ast.literal_eval(text)) is not type(value) or ast.literal_eval(text) != value:
+            return expr
+    except (ValueError, SyntaxError):
+        return expr
+    if report is not None:
+        report.add("fold", expr.lineno, f"{expr.expr} -> {text}")
+    # 与 expr 同类型(CompiledExpr), 不在此导入 script_parser, 避免循环导入
+    return type(expr)(text, expr.lineno)
+
+
+def fold_constants(parsed: List[dict], report: OptimizationReport = None) -> List[dict]:
+    """
+    折叠常量表达式, 删除恒为真的 check 与 stay 子句, stay 恒为假时(指令将一直重复)警告,
+    click 的 _RET 恒为 None, 其子句中的 _RET 按常量处理; 返回新的指令列表(不修改原指令)
+    """
+    optimized = []
+    for instruction in parsed:
+        changes = {}
+        for key in ("value", "msg", "target"):
+            if (expr := instruction.get(key)) is not None and (folded := _fold(expr, {}, report)) is not expr:
+                changes[key] = folded
+
+        if block := instruction.get("block"):
+            env = _env(instruction)
+            clauses = {"var": [], "check": [], "stay": []}
+            for clause in block.get("var", ()):
+                clauses["var"].append({**clause, "value": _fold(clause["value"], env, report)})
+            for kind in ("check", "stay"):
+                for clause in block.get(kind, ()):
+                    expr = clause["test_expr"]
+                    constant, value = _constant(expr, env)
+                    if constant and value:
+                        if report is not None:
+                            report.add(kind, expr.lineno, f"{kind} {expr.expr} 恒为真, 已删除")
+                        continue
+                    if constant:
+                        if report is not None:
+                            report.add(f"{kind}-false", expr.lineno, f"{kind} {expr.expr} 恒为假")
+                        if kind == "stay":
+                            message = f"语法警告:line={expr.lineno}: stay 的条件 {expr.expr} 恒为假, 指令将一直重复执行"
+                            if report is not None:
+                                report.warn(message)
+                            else:
+                                warnings.warn(message)
+                    clauses[kind].append(clause)
+            # 子句全部删除后 block 为空, 指令可以参与输入合并
+            changes["block"] = {kind: clauses[kind] for kind in block if clauses.get(kind)}
+
+        optimized.append({**instruction, **changes} if changes else instruction)
+    return optimized
+
+
+# 数据流分析中的操作: (类别 "use" | "set" | "del", 变量名, 子句下标(指令本身为 None), 读取的名称, 是否为常量赋值)
+_Op = Tuple[str, Optional[str], Optional[int], FrozenSet[str], bool]
+
+
+def _ops(instruction: dict) -> List[_Op]:
+    """
+    指令按执行顺序对变量的操作: 指令本身的表达式, var 子句, check 子句, stay 子句
+    """
+    ops: List[_Op] = []
+    for key in ("msg", "target"):
+        if (expr := instruction.get(key)) is not None:
+            ops.append(("use", None, None, _names(expr.compiled_expr), False))
+    if instruction["type"] == "var":
+        ops.append(_var_op(instruction, {}, None))
+    block = instruction.get("block") or {}
+    env = _env(instruction)
+    for k, clause in enumerate(block.get("var", ())):
+        ops.append(_var_op(clause, env, k))
+    for clause in (*block.get("check", ()), *block.get("stay", ())):
+        ops.append(("use", None, None, _names(clause["test_expr"].compiled_expr), False))
+    return ops
+
+
+def _var_op(stmt: dict, env: Dict[str, Any], clause: Optional[int]) -> _Op:
+    if stmt["del"]:
+        return "del", stmt["ID"], clause, frozenset(), False
+    names = _names(stmt["value"].compiled_expr)
+    return "set", stmt["ID"], clause, names, _constant(stmt["value"], env, names)[0]
+
+
+def _loops(instruction: dict) -> bool:
+    """
+    指令是否可能因 stay 重复执行
+    """
+    return bool((instruction.get("block") or {}).get("stay"))
+
+
+def _safe_dels(parsed: List[dict], ops: List[List[_Op]], loops: List[bool]) -> Set[Tuple[int, Optional[int]]]:
+    """
+    前向分析每条 var del 执行时变量是否一定已定义(不会因变量不存在而出错), 返回这些 var del 的位置
+
+    指令或表达式出错时跳过其余子句继续执行下一条指令, 因此指令结束时一定已定义的变量
+    为所有可能出错之处与正常结束时已定义变量的交集
+    """
+    safe = set()
+    defined: FrozenSet[str] = frozenset()
+    for i, instruction in enumerate(parsed):
+        if not ops[i]:
+            continue
+        # 除 var 与 sleep 外, 指令本身(adb 命令, 截图...)也可能出错
+        raises = instruction["type"] not in ("var", "sleep")
+        entry = defined
+        while True:
+            current = set(entry)
+            common = set(entry) if raises else None
+            dels = []
+            for kind, name, clause, _, constant in ops[i]:
+                # 读取变量或非常量赋值的求值可能出错, var del 在变量不存在时出错
+                if kind == "use" or kind == "set" and not constant or kind == "del" and name not in current:
+                    common = set(current) if common is None else common & current
+                if kind == "set":
+                    current.add(name)
+                elif kind == "del":
+                    dels.append((clause, name in current))
+                    current.discard(name)
+            exit_ = frozenset(current if common is None else common & current)
+            # stay 重复执行时从本次结束时的状态开始
+            if not loops[i] or entry <= exit_:
+                break
+            entry = entry & exit_
+        safe.update((i, clause) for clause, ok in dels if ok)
+        defined = exit_
+    return safe
+
+
+def _dead_sets(ops: List[List[_Op]], loops: List[bool]) -> Set[Tuple[int, Optional[int]]]:
+    """
+    后向活跃变量分析, 返回赋值后直到下一次赋值之前不会被读取(或 var del)的常量赋值的位置
+
+    指令中途出错时直接执行下一条指令, 每个操作之后都可能转到下一条指令, 因此下一条指令入口活跃的变量在整条指令中都活跃
+    """
+    n = len(ops)
+    live_in: List[FrozenSet[str]] = [frozenset()] * (n + 1)
+    dead: Set[Tuple[int, Optional[int]]] = set()
+    changed = True
+    while changed:
+        changed = False
+        dead = set()
+        for i in reversed(range(n)):
+            after = live_in[i + 1]
+            if not ops[i] and not loops[i]:
+                live_in[i] = after
+                continue
+            live = set(after | live_in[i]) if loops[i] else set(after)
+            for kind, name, clause, names, constant in reversed(ops[i]):
+                live |= after
+                if kind == "set":
+                    if constant and name not in live:
+                        dead.add((i, clause))
+                    live.discard(name)
+                elif kind == "del":
+                    live.add(name)
+                live |= names
+            if (live := frozenset(live)) != live_in[i]:
+                live_in[i] = live
+                changed = True
+    return dead
+
+
+def _remove_vars(parsed: List[dict], removed: Set[Tuple[int, Optional[int]]],
+                 report: Optional[OptimizationReport]) -> List[dict]:
+    """
+    删除指定位置的 var 指令或 var 子句
+    """
+    changed = {i for i, _ in removed}
+    optimized = []
+    for i, instruction in enumerate(parsed):
+        if i not in changed:
+            optimized.append(instruction)
+            continue
+        if (i, None) in removed:
+            if report is not None:
+                report.add("del" if instruction["del"] else "var", instruction.get("lineno"), _describe_var(instruction))
+            continue
+        block = instruction.get("block") or {}
+        clauses = [clause for k, clause in enumerate(block.get("var", ())) if (i, k) not in removed]
+        if len(clauses) != len(block.get("var", ())):
+            if report is not None:
+                for k, clause in enumerate(block["var"]):
+                    if (i, k) in removed:
+                        report.add("del" if clause["del"] else "var", clause["value"].lineno, _describe_var(clause))
+            block = {**block, "var": clauses}
+            instruction = {**instruction, "block": {kind: block[kind] for kind in block if block[kind]}}
+        optimized.append(instruction)
+    return optimized
+
+
+def _describe_var(stmt: dict) -> str:
+    stmt = f"var del {stmt['ID']}" if stmt["del"] else f"var {stmt['ID']} = {stmt['value'].expr}"
+    return f"{stmt} 无用, 已删除"
+
+
+def eliminate_dead_vars(parsed: List[dict], report: OptimizationReport = None) -> List[dict]:
+    """
+    删除无用的 var 赋值与 var del, 返回新的指令列表(不修改原指令), 只删除常量赋值, 不改变出错的行为:
+    1. 从未被读取的变量, 其赋值均为常量且每条 var del 执行时变量一定已定义, 删除它的全部赋值与 var del
+    2. 活跃变量分析: 赋值后直到下一次赋值之前不会被读取的常量赋值
+    """
+    ops = [_ops(instruction) for instruction in parsed]
+    loops = [_loops(instruction) for instruction in parsed]
+    safe = _safe_dels(parsed, ops, loops)
+    read = set().union(*(names for instruction_ops in ops for _, _, _, names, _ in instruction_ops))
+    # 变量名 -> 对它的全部赋值与 var del 的位置, 不满足条件的变量为 None
+    candidates: Dict[str, Optional[List[Tuple[int, Optional[int]]]]] = {}
+    for i, instruction_ops in enumerate(ops):
+        for kind, name, clause, _, constant in instruction_ops:
+            if kind == "use" or name in read:
+                continue
+            if kind == "set" and not constant or kind == "del" and (i, clause) not in safe:
+                candidates[name] = None
+            elif (places := candidates.setdefault(name, [])) is not None:
+                places.append((i, clause))
+    removed = {place for places in candidates.values() if places for place in places}
+
+    # 在删除上述变量之后的程序上做活跃变量分析
+    if removed:
+        ops = [[op for op in instruction_ops if op[0] == "use" or (i, op[2]) not in removed]
+               for i, instruction_ops in enumerate(ops)]
+    return _remove_vars(parsed, removed | _dead_sets(ops, loops), report)
+
+
+def optimize(parsed: List[dict], pragmas: Dict[str, str]) -> Tuple[List[dict], OptimizationReport]:
+    """
+    按编译指示依次执行各优化遍, 返回新的指令列表(不修改原指令)与优化记录;
+    结果只由指令列表与编译指示决定, 由 script_cache 连同解析结果一起缓存
+
+    :param parsed: ScriptParser 的解析结果
+    :param pragmas: 脚本的编译指示
+    """
+    report = OptimizationReport()
+    report.before = len(parsed)
+    if PRAGMA_NO_OPTIMIZE not in pragmas:
+        # 在输入合并之前: 子句全部删除的 click 可以参与合并
+        parsed = fold_constants(parsed, report)
+        parsed = eliminate_dead_vars(parsed, report)
+    if PRAGMA_NO_COALESCE not in pragmas:
+        parsed = coalesce_inputs(parsed, report)
+    if PRAGMA_SCALE in pragmas:
+        parsed = reduce_comparisons(parsed, parse_scale(pragmas[PRAGMA_SCALE]))
+    return parsed, report
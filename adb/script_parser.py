@@ -1,21 +1,43 @@
+import ast
+import io
 import json
+import keyword
 import re
 import warnings
-from typing import List, Dict
-
-EOF = "$"
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from adb.script_lexer import Token, python_expr, scan, source_column, tokenize
+from adb.script_optimizer import parse_scale
+from ocr import DEFAULT_METRIC, METRICS
+
+# 解析结果格式的版本, 语法或输出的指令字典改变时递增, 使磁盘上的解析缓存失效
+PARSER_VERSION = 2
+_PRAGMA_RE = re.compile(r"^#\s*pragma:\s*([\w-]+)(.*)$")
+# 行首的语句或子句关键字
+_KEYWORD_RE = re.compile(r"[^\W\d]\w*")
+# 带子句块的语句; exit 不允许出现子句, 其余语句的子句被忽略
+BLOCK_STATEMENTS = ('adb', 'ocr', 'locate', 'read', 'screen', 'click')
+# 一次最多报告的语法错误数
+MAX_ERRORS = 20
+# 常见的固定形式, 整体匹配, 不逐个扫描词法单元; 不匹配时逐个解析并报告出错位置
+# 区域 x,y,w,h
+_REGION_RE = re.compile(r"[ \t]*(\d+)[ \t]*,[ \t]*(\d+)[ \t]*,[ \t]*(\d+)[ \t]*,[ \t]*(\d+)(?![\w.])")
+# 点击位置 x,y 直到行尾
+_POS_RE = re.compile(r"[ \t]*(\d+)[ \t]*,[ \t]*(\d+)[ \t]*:?[ \t]*(?:#.*)?$")
 
 
 class CompiledExpr:
-    def __init__(self, expr: str, lineno: int):
+    def __init__(self, expr: str, lineno: int, code=None):
+        """
+        :param code: 已编译的代码对象(从解析缓存加载时), 省略时编译 expr
+        """
         self.expr = expr
         self.lineno = lineno
 
-        self.compiled_expr = self._compile_python_expr(expr, lineno)
+        self.compiled_expr = code if code is not None else self._compile_python_expr(expr, lineno)
 
     @staticmethod
     def _compile_python_expr(expr: str, lineno: int):
-        print(f"compiling expr: {expr} at line {lineno}")
         try:
             return compile(expr, "<string>", "eval")
         except Exception as e:
@@ -41,282 +63,572 @@ class ScriptTreeJsonEncoder(json.JSONEncoder):
         return super().default(o)
 
 
+class _SyntaxError(Exception):
+    """
+    一条语句或子句中的语法错误, ScriptParser 记录后跳过该语句继续解析
+    """
+
+    def __init__(self, column: int, message: str):
+        """
+        :param column: 出错位置在行中的下标
+        """
+        super().__init__(message)
+        self.column = column
+
+
+def _unexpected(token: Token) -> str:
+    if token.kind == "ERROR":
+        return "字符串缺少结束引号" if token.text in "\"'" else f"无法识别的字符 {token.text!r}"
+    return f"多余的 {token.text}"
+
+
+class _Tokens:
+    """
+    一行中关键字之后的词法单元, 语句解析时从左到右依次取出, 用到时才扫描
+    """
+    __slots__ = ("line", "pos", "buffer")
+
+    def __init__(self, line: str, pos: int):
+        self.line = line
+        # 已取出的词法单元的结束位置
+        self.pos = pos
+        # 已扫描, 尚未取出的词法单元
+        self.buffer: List[Token] = []
+
+    def peek(self, ahead: int = 0) -> Optional[Token]:
+        buffer = self.buffer
+        while len(buffer) <= ahead:
+            token = scan(self.line, buffer[-1].end if buffer else self.pos)
+            # 行尾注释
+            if token is None or token.kind == "COMMENT":
+                return None
+            buffer.append(token)
+        return buffer[ahead]
+
+    def match(self, pattern: re.Pattern) -> Optional[re.Match]:
+        """
+        尚未扫描的内容以 pattern 开头时整体取出
+        """
+        if self.buffer or (m := pattern.match(self.line, self.pos)) is None:
+            return None
+        self.pos = m.end()
+        return m
+
+    def column(self) -> int:
+        """
+        下一个词法单元的位置, 已到行尾时为行尾
+        """
+        if (token := self.peek()) is not None:
+            return token.start
+        return len(self.line.rstrip())
+
+    def accept(self, kind: str, text: str = None) -> Optional[Token]:
+        """
+        下一个词法单元符合时取出, 否则返回 None
+        """
+        token = self.peek()
+        if token is None or token.kind != kind or (text is not None and token.text != text):
+            return None
+        del self.buffer[0]
+        self.pos = token.end
+        return token
+
+    def expect(self, kind: str, what: str, text: str = None) -> Token:
+        """
+        取出下一个词法单元, 不符合时报告语法错误
+
+        :param what: 错误信息中期望内容的说明
+        """
+        if (token := self.accept(kind, text)) is not None:
+            return token
+        if (token := self.peek()) is None:
+            raise _SyntaxError(self.column(), f"缺少{what}")
+        if token.kind == "ERROR":
+            raise _SyntaxError(token.start, _unexpected(token))
+        raise _SyntaxError(token.start, f"应为{what}, 而不是 {token.text}")
+
+    def end(self, colon: bool = False):
+        """
+        检查已到行尾
+
+        :param colon: 允许语句末尾的冒号
+        """
+        if colon:
+            self.accept("OP", ":")
+        if (token := self.peek()) is not None:
+            raise _SyntaxError(token.start, _unexpected(token))
+
+
 class ScriptParser:
+    """
+    BASL 解析器, 对应 BASL/baslParser.g4 的手写实现
+
+    逐行扫描一遍源码: 不缩进的行为语句, 缩进(制表符或空格)的行为上一条语句的子句, 每行切分为词法单元后按语句的文法解析,
+    耗时与脚本长度成正比. 出错的语句连同其子句被跳过, 解析完成后一起报告所有语法错误(含行号与列号)
+    """
 
     def __init__(self, instructionInterval=-1):
         self.lineno = 1
-        self.lines: List[str] = []
-        self.nested = []
         self.parsed = []
         self.instructionInterval = instructionInterval
+        # 编译指示, 形如 "# pragma: no-coalesce", {名称: 参数}
+        self.pragmas: Dict[str, str] = {}
+        # 语法错误信息
+        self.errors: List[str] = []
 
     def parse(self, scriptFile: str):
         with open(scriptFile, "r", encoding="utf-8") as f:
-            self.lines = f.readlines()
-
-        self.lines.append(EOF)
-        self.lines.insert(0, "^")
-        # nested
-        self._nested()
-
-        for p in self.nested:
-            self._parser(p)
-            if self.instructionInterval > 0:
-                self.parsed.append({
-                    "type": "sleep",
-                    "time": self.instructionInterval
-                })
-
-        self.parsed.append({
-            "type": "EOF",
-        })
+            return self.parse_source(f.read())
 
-        # print(json.dumps({"parsed": self.parsed}, indent=4, sort_keys=True, ensure_ascii=False,
-        #                  cls=ScriptTreeJsonEncoder))
+    def parse_source(self, source: str):
+        """
+        解析已读入的脚本内容, 换行符按读取文件时的规则转换
+        """
+        self.parsed = list(self._instructions(io.StringIO(source, newline=None), stream=False))
         return self.parsed
 
-    def _nested(self):
-        self.lineno = 1
-        while self.lineno < len(self.lines):
-            if (line := self.lines[self.lineno]).endswith("\n"):
+    def iter_parse(self, scriptFile: str) -> Iterator[dict]:
+        """
+        边读取边解析, 逐条产生指令字典(最后一条为 EOF), 一条语句在读到下一条语句时产生;
+        遇到语法错误时, 先产生出错语句之前的指令, 再抛出该错误. pragmas 在读到编译指示后更新
+        """
+        with open(scriptFile, "r", encoding="utf-8") as f:
+            yield from self._instructions(f, stream=True)
+
+    def _instructions(self, lines: Iterable[str], stream: bool) -> Iterator[dict]:
+        """
+        :param lines: 脚本的各行
+        :param stream: 为 True 时遇到第一个语法错误即抛出, 否则解析完所有行后一起报告
+        """
+        self.pragmas = {}
+        self.errors = []
+        # 正在解析的语句: [指令字典(出错时为 None), 关键字, 行号, 行, [(子句关键字, 子句字典), ...]]
+        statement = None
+        for self.lineno, line in enumerate(lines, 1):
+            if line.endswith("\n"):
                 line = line[:-1]
 
             if (line_s := line.strip()) == "" or line_s.startswith("#"):
                 # ignore empty line and comment line
-                self.lineno += 1
+                if m := _PRAGMA_RE.match(line_s):
+                    self.pragmas[m.group(1)] = m.group(2).strip()
                 continue
 
-            if not line.startswith('\t') and not line.startswith("    "):
-                stmt_type = line.split(' ')[0]
-
-                if stmt_type in ('adb', 'ocr', 'exit', 'click', 'sleep', 'log', 'var'):
-                    stmt_type = line.split(' ')[0]
-                    raw = line.strip()
-                    if raw.endswith(":"):
-                        raw = raw[:-1]
-                    self.nested.append({
-                        "raw": raw,
-                        "type": stmt_type,
-                        "lineno": self.lineno - 1,
-                        "block": []
-                    })
-
-                    self.lineno += 1
-                elif line == "$":
-                    break
-                else:
-                    raise Exception(f"语法错误:line={self.lineno}: {stmt_type}:\n未知的语句")
+            if line[0] in " \t":
+                clause = self._clause(line, len(line) - len(line.lstrip()), statement is not None)
+                if clause is not None:
+                    statement[4].append(clause)
+            else:
+                yield from self._finish(statement)
+                statement = self._statement(line)
+            if stream and self.errors:
+                break
+        else:
+            yield from self._finish(statement)
 
+        if self.errors:
+            messages = self.errors[:MAX_ERRORS]
+            if len(self.errors) > MAX_ERRORS:
+                messages.append(f"...共 {len(self.errors)} 个语法错误")
+            raise Exception("\n\n".join(messages))
+
+        yield {
+            "type": "EOF",
+        }
+
+    def _error(self, error: _SyntaxError, line: str, stmt_type: str, lineno: int = None):
+        """
+        记录语法错误, 下一行用 ^ 标出位置
+        """
+        caret = " " * len(line[:error.column].expandtabs())
+        self.errors.append(f"语法错误:line={lineno or self.lineno},col={error.column + 1}: {stmt_type}:\n"
+                           f"{error}\n{line.expandtabs()}\n{caret}^")
+
+    def _statement(self, line: str) -> list:
+        m = _KEYWORD_RE.match(line)
+        stmt_type = m.group() if m else line.split()[0]
+        parsed = None
+        try:
+            match stmt_type if m else None:
+                case 'adb':
+                    parsed = self._adb_parser(line, m.end())
+                case 'ocr':
+                    parsed = self._ocr_parser(_Tokens(line, m.end()))
+                case 'locate':
+                    parsed = self._locate_parser(_Tokens(line, m.end()))
+                case 'read':
+                    parsed = self._read_parser(_Tokens(line, m.end()))
+                case 'screen':
+                    parsed = self._screen_parser(_Tokens(line, m.end()))
+                case 'exit':
+                    parsed = self._exit_parser(_Tokens(line, m.end()))
+                case 'click':
+                    parsed = self._click_parser(_Tokens(line, m.end()))
+                case 'sleep':
+                    parsed = self._sleep_parser(_Tokens(line, m.end()))
+                case 'log':
+                    parsed = self._log_parser(_Tokens(line, m.end()))
+                case 'var':
+                    parsed = self._var_parser(_Tokens(line, m.end()), colon=True)
+                    parsed.update({"type": "var"})
+                case _:
+                    raise _SyntaxError(0, "未知的语句")
+        except _SyntaxError as e:
+            self._error(e, line, stmt_type)
+        return [parsed, stmt_type, self.lineno, line, []]
+
+    def _clause(self, line: str, indent: int, nested: bool) -> Optional[Tuple[str, dict]]:
+        m = _KEYWORD_RE.match(line, indent)
+        stmt_type = m.group() if m else line.split()[0]
+        try:
+            if not nested:
+                raise _SyntaxError(indent, "文件开头不应出现子句")
+            match stmt_type if m else None:
+                case 'check':
+                    return stmt_type, self._check_parser(_Tokens(line, m.end()))
+                case 'stay':
+                    return stmt_type, self._stay_parser(_Tokens(line, m.end()))
+                case 'var':
+                    return stmt_type, self._var_parser(_Tokens(line, m.end()))
+                case _:
+                    raise _SyntaxError(indent, "未知的子句")
+        except _SyntaxError as e:
+            self._error(e, line, stmt_type)
+        return None
+
+    def _finish(self, statement: Optional[list]) -> Iterator[dict]:
+        """
+        语句及其子句解析完成, 产生指令字典
+        """
+        if statement is None or (parsed := statement[0]) is None:
+            return
+        _, stmt_type, lineno, line, clauses = statement
+        if stmt_type == "exit" and clauses:
+            self._error(_SyntaxError(0, "不应出现语句子块"), line, stmt_type, lineno)
+            return
+        if stmt_type in BLOCK_STATEMENTS:
+            parsed["block"] = self._block_parser(lineno, clauses)
+        # 源文件行号, 用于日志与跳转
+        parsed["lineno"] = lineno
+        yield parsed
+        if self.instructionInterval > 0:
+            yield {
+                "type": "sleep",
+                "time": self.instructionInterval
+            }
+
+    def _expr(self, tokens: _Tokens, what: str, colon: bool = False) -> CompiledExpr:
+        """
+        行中剩余的内容为一个 Python 表达式, eq / neq / nin 替换为 ==, !=, not in
+
+        :param what: 缺少表达式时错误信息中的说明
+        :param colon: 忽略语句末尾的冒号
+        """
+        line = tokens.line
+        raw = line[tokens.pos:]
+        shifts = []
+        if "eq" in raw or "nin" in raw or "#" in raw:
+            # 需要区分运算符, 标识符, 字符串与注释
+            rest = tokenize(line, tokens.pos)
+            if rest and rest[-1].kind == "COMMENT":
+                rest.pop()
+            if colon and rest and rest[-1].kind == "OP" and rest[-1].text == ":":
+                rest.pop()
+            for token in rest:
+                if token.kind == "ERROR":
+                    raise _SyntaxError(token.start, _unexpected(token))
+            if rest:
+                start = rest[0].start
+                expr, shifts = python_expr(line, rest)
             else:
-                line = line.strip()
-                stmt_type = line.split(' ')[0]
-                if stmt_type in ('check', 'stay', 'var'):
-                    try:
-                        self.nested[-1]["block"].append({
-                            "type": stmt_type,
-                            "raw": line.strip(),
-                            "lineno": self.lineno
-                        })
-                    except IndexError:
-                        raise Exception(f"语法错误:line={self.lineno}: {stmt_type}:\n文件开头不应出现子句")
-                    self.lineno += 1
-                else:
-                    raise Exception(f"语法错误:line={self.lineno}: {stmt_type}:\n未知的子句")
-
-    def _parser(self, stmt_info: dict):
-        match stmt_info['type']:
-            case 'adb':
-                self.parsed.append(self._adb_parser(stmt_info))
-            case 'ocr':
-                self.parsed.append(self._ocr_parser(stmt_info))
-            case 'exit':
-                self.parsed.append(self._exit_parser(stmt_info))
-            case 'click':
-                self.parsed.append(self._click_parser(stmt_info))
-            case 'sleep':
-                self.parsed.append(self._sleep_parser(stmt_info))
-            case 'log':
-                self.parsed.append(self._log_parser(stmt_info))
-            case 'var':
-                var_parsed = self._var_parser(stmt_info)
-                var_parsed.update({"type": "var"})
-                self.parsed.append(var_parsed)
-
-    def _exit_parser(self, stmt_info: Dict[str, str]):
-        if stmt_info["block"]:
-            raise Exception(f"语法错误:line={stmt_info['lineno']}: {stmt_info['type']}:\n不应出现语句子块")
+                expr = ""
+        else:
+            # 其余的表达式原样交给 Python 编译
+            expr = raw.strip()
+            if colon and expr.endswith(":"):
+                expr = expr[:-1].rstrip()
+            start = tokens.pos + len(raw) - len(raw.lstrip())
+        if not expr:
+            raise _SyntaxError(len(line.rstrip()), f"缺少{what}")
+
+        try:
+            code = compile(expr, "<string>", "eval")
+        except SyntaxError as e:
+            offset = (e.offset or 1) - 1 if e.lineno in (None, 1) else 0
+            raise _SyntaxError(source_column(start, shifts, min(offset, len(expr))), f"表达式编译错误: {e.msg}")
+        except ValueError as e:
+            raise _SyntaxError(start, f"表达式编译错误: {e}")
+        return CompiledExpr(expr, self.lineno, code)
+
+    @staticmethod
+    def _int(tokens: _Tokens, what: str) -> int:
+        token = tokens.expect("NUMBER", what)
+        if not token.text.isdigit():
+            raise _SyntaxError(token.start, f"{what}应为非负整数, 而不是 {token.text}")
+        return int(token.text)
+
+    def _region(self, tokens: _Tokens) -> Tuple[int, int, int, int]:
+        """
+        x:<int>,y:<int>,w:<int>,h:<int>
+        """
+        if (m := tokens.match(_REGION_RE)) is not None:
+            return int(m[1]), int(m[2]), int(m[3]), int(m[4])
+        region = [self._int(tokens, "x")]
+        for what in ("y", "w", "h"):
+            tokens.expect("OP", "逗号", ",")
+            region.append(self._int(tokens, what))
+        return tuple(region)
+
+    @staticmethod
+    def _path(tokens: _Tokens) -> str:
+        """
+        引号中的文件路径, 不处理转义
+        """
+        token = tokens.expect("STRING", "带引号的文件路径")
+        if token.text[0] not in "\"'" or len(token.text) < 3:
+            raise _SyntaxError(token.start, f"文件路径应为非空的字符串, 而不是 {token.text}")
+        return token.text[1:-1]
+
+    def _exit_parser(self, tokens: _Tokens):
+        tokens.end(colon=True)
         return {"type": "exit"}
 
-    def _click_parser(self, stmt_info: Dict[str, str | List]):
+    def _click_parser(self, tokens: _Tokens):
         """
-        click SPACE? x:int SPACE? , SPACE? y:int SPACE?
-        提取x,y
-        {"type": "click", "pos": (x, y)}
+        click SPACE? x:int SPACE? , SPACE? y:int SPACE? | click <python expr>
+        提取x,y, 或者运行时求值得到点击位置的表达式(结果为 (x, y) 或带 pos 属性的对象, 如 locate 的 _RET)
+        {"type": "click", "pos": (x, y)} | {"type": "click", "target": <python expr>}
         """
         parsed = {"type": "click"}
-        stmt = stmt_info["raw"]
-        x, y = re.findall(r"^click\s+(\d+)\s*,\s*(\d+)$", stmt)[0]
-        parsed["pos"] = (int(x), int(y))
-        parsed_block = self._block_parser(stmt_info, stmt_info["block"])
-        parsed["block"] = parsed_block
+        if (m := tokens.match(_POS_RE)) is not None:
+            parsed["pos"] = (int(m[1]), int(m[2]))
+            return parsed
+        rest = tokens.line[tokens.pos:]
+        start = tokens.pos + len(rest) - len(rest.lstrip())
+        target = self._expr(tokens, "点击位置", colon=True)
+        # 写出的坐标(如 click 10, 或 click 10,20,30)在运行时才会解包失败, 解析时就报告
+        body = ast.parse(target.expr, mode="eval").body
+        if isinstance(body, ast.Constant) or \
+                isinstance(body, ast.Tuple) and (len(body.elts) != 2 or target.expr.endswith(",")):
+            raise _SyntaxError(start, f"点击位置应为 x,y 两个坐标, 而不是 {target.expr}")
+        parsed["target"] = target
         return parsed
 
-    def _sleep_parser(self, stmt_info: Dict[str, str]):
+    def _sleep_parser(self, tokens: _Tokens):
         """
         sleep <float> | <int>
         {"type": "sleep", "time": float}
         """
-        return {"type": "sleep", "time": float(stmt_info["raw"].split(" ")[1])}
+        token = tokens.expect("NUMBER", "等待时间")
+        try:
+            parsed = {"type": "sleep", "time": float(token.text)}
+        except ValueError:
+            raise _SyntaxError(token.start, f"等待时间应为秒数, 而不是 {token.text}")
+        tokens.end(colon=True)
+        return parsed
 
-    def _log_parser(self, stmt_info: Dict[str, str]):
+    def _log_parser(self, tokens: _Tokens):
         """
-        log <str>
-        {"type": "log", "msg": str}
+        log <python expr>
+        {"type": "log", "msg": <python expr>}
         """
-        python_expr = " ".join(stmt_info["raw"].split(" ")[1:])
-        return {"type": "log", "msg": CompiledExpr(python_expr, int(stmt_info["lineno"]))}
+        return {"type": "log", "msg": self._expr(tokens, "日志内容", colon=True)}
 
-    def _adb_parser(self, stmt_info: Dict[str, str | List]):
-        parsed = {"type": "adb"}
-        stmt = stmt_info["raw"]
-        parsed["cmd"] = tuple(stmt.split(" ")[1:])
-        parsed_block = self._block_parser(stmt_info, stmt_info["block"])
-        parsed["block"] = parsed_block
-        return parsed
-
-    def _ocr_parser(self, stmt_dict: Dict[str, str | List]):
+    def _adb_parser(self, line: str, pos: int):
+        """
+        adb <arg>+
+        参数按空白分隔, 原样传给 adb(不解析引号与注释)
+        {"type": "adb", "cmd": (arg, ...)}
+        """
+        raw = line[pos:].strip()
+        if raw.endswith(":"):
+            raw = raw[:-1]
+        if not (cmd := tuple(raw.split())):
+            raise _SyntaxError(pos, "缺少 adb 命令")
+        return {"type": "adb", "cmd": cmd}
+
+    def _ocr_parser(self, tokens: _Tokens):
         """
         ocr x:<int>,y:<int>,w:<int>,h:<int>(,confidence:<float>)? 'path/to/image':<str>
-        提取出x,y,w,h,path
+            (| x:<int>,y:<int>,w:<int>,h:<int>(,confidence:<float>)? 'path/to/image':<str>)* (by metric(\\(param:<float>\\))?)?
+            (scale <1/n>)?
+        提取出x,y,w,h,path,metric; 多个区域用 | 分隔, 在同一张截图上一次比较;
+        scale 为比较前区域与模板的缩小比例, 省略时使用 scale 编译指示或不缩小
+        {"type": "ocr", "pos": (x, y, w, h), "confidence": float, "path": str, ...}
+        | {"type": "ocr", "entries": (((x, y, w, h), path, confidence), ...), ...}
         """
         parsed = {"type": "ocr"}
-        stmt = stmt_dict["raw"]
-        try:
-            x, y, w, h, confidence, path = \
-                re.findall(r"^ocr\s+(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*,?\s*([0-9.]+)?\s*[\"'](.+)[\"']$",
-                           stmt)[0]
-        except IndexError:
-            raise Exception(f"语法错误:line={stmt_dict['lineno']}: {stmt_dict['type']}:\n语法错误")
-
-        if confidence == "":
-            parsed["confidence"] = 0.9
-        elif 0 <= (c := float(confidence)) <= 1:
-            parsed["confidence"] = c
+        entries = []
+        while True:
+            region = self._region(tokens)
+            tokens.accept("OP", ",")
+            confidence = self._confidence(tokens.accept("NUMBER"))
+            entries.append((region, self._path(tokens), confidence))
+            if tokens.accept("OP", "|") is None:
+                break
+
+        metric, param = DEFAULT_METRIC, None
+        if tokens.accept("NAME", "by") is not None:
+            token = tokens.expect("NAME", "相似度算法")
+            if (metric := token.text) not in METRICS:
+                raise _SyntaxError(token.start, f"未知的相似度算法 {metric}, 可选 {' | '.join(METRICS)}")
+            if tokens.accept("OP", "(") is not None:
+                token = tokens.expect("NUMBER", "算法参数")
+                try:
+                    param = float(token.text)
+                except ValueError:
+                    raise _SyntaxError(token.start, f"算法参数应为数字, 而不是 {token.text}")
+                tokens.expect("OP", "右括号", ")")
+
+        if tokens.accept("NAME", "scale") is not None:
+            start = tokens.expect("NUMBER", "缩小比例")
+            end = start
+            if tokens.accept("OP", "/") is not None:
+                end = tokens.expect("NUMBER", "缩小比例的分母")
+            try:
+                parsed["reduce"] = parse_scale(tokens.line[start.start:end.end])
+            except Exception as e:
+                raise _SyntaxError(start.start, e.args[0])
+        tokens.end(colon=True)
+
+        parsed["metric"] = metric
+        parsed["param"] = param
+        if len(entries) == 1:
+            parsed["pos"], parsed["path"], parsed["confidence"] = entries[0]
         else:
-            parsed["confidence"] = 0.9
-            warnings.warn(
-                f"语法警告:line={stmt_dict['lineno']}: {stmt_dict['type']}:\n置信度应在0-1之间,已自动修正为默认值{parsed['confidence']}")
-
-        parsed["pos"] = (int(x), int(y), int(w), int(h))
-        parsed["path"] = path
-        parsed_block = self._block_parser(stmt_dict, stmt_dict["block"])
-        parsed["block"] = parsed_block
+            parsed["entries"] = tuple(entries)
         return parsed
 
-    def _block_parser(self, super_stmt_info, block: List[Dict[str, str]]):
+    def _confidence(self, token: Optional[Token]) -> float:
+        """
+        解析置信度, 省略时为默认值 0.9, 超出 0-1 时警告并修正为默认值
+        """
+        if token is None:
+            return 0.9
+        try:
+            c = float(token.text)
+        except ValueError:
+            raise _SyntaxError(token.start, f"置信度应为 0-1 之间的小数, 而不是 {token.text}")
+        if 0 <= c <= 1:
+            return c
+        warnings.warn(
+            f"语法警告:line={self.lineno},col={token.start + 1}: 置信度应在0-1之间,已自动修正为默认值0.9")
+        return 0.9
+
+    def _locate_parser(self, tokens: _Tokens):
+        """
+        locate (x:<int>,y:<int>,w:<int>,h:<int>,?)? (confidence:<float>)? 'path/to/image':<str>
+        在 x,y,w,h 区域(省略时为全屏)内搜索模板图
+        {"type": "locate", "pos": (x, y, w, h) | None, "confidence": float, "path": str}
+        """
+        pos = None
+        if (token := tokens.peek(1)) is not None and token.text == ",":
+            pos = self._region(tokens)
+            tokens.accept("OP", ",")
+        confidence = self._confidence(tokens.accept("NUMBER"))
+        path = self._path(tokens)
+        tokens.end(colon=True)
+        return {"type": "locate", "confidence": confidence, "pos": pos, "path": path}
+
+    def _read_parser(self, tokens: _Tokens):
+        """
+        read x:<int>,y:<int>,w:<int>,h:<int> (| x:<int>,y:<int>,w:<int>,h:<int>)* 'path/to/atlas.npz':<str>
+        用字形图集识别一个或多个区域中的文字
+        {"type": "read", "regions": ((x, y, w, h), ...), "path": str}
+        """
+        regions = [self._region(tokens)]
+        while tokens.accept("OP", "|") is not None:
+            regions.append(self._region(tokens))
+        path = self._path(tokens)
+        tokens.end(colon=True)
+        return {"type": "read", "regions": tuple(regions), "path": path}
+
+    def _screen_parser(self, tokens: _Tokens):
+        """
+        screen (max_distance:<int>)? 'path/to/index.npz':<str>
+        用画面索引识别当前画面
+        {"type": "screen", "max_distance": int | None, "path": str}
+        """
+        max_distance = self._int(tokens, "最大汉明距离") if tokens.peek() is not None and \
+            tokens.peek().kind == "NUMBER" else None
+        path = self._path(tokens)
+        tokens.end(colon=True)
+        return {"type": "screen", "max_distance": max_distance, "path": path}
+
+    def _block_parser(self, lineno: int, clauses: List[Tuple[str, dict]]):
         """
-        check,stay,var,var del
-        [{
-            "type": "check",
-            "raw": "check (hard | soft) (_RET (n)eq <str> | _RET (n)in <List>)"
-        }]
+        check,stay,var,var del 按类型分组, 保持出现的顺序
+        {"check": [{"check_mode": "hard", "test_expr": <python expr>}, ...], "stay": [...], "var": [...]}
         """
         parsed_block = {}
-        stmt_types = set()
-        for stmt_info in block:
-            stmt_type = stmt_info["type"]
-            if stmt_type not in stmt_types:
-                parsed_block[stmt_type] = []
-            stmt_types.add(stmt_type)
-            parsed = getattr(self, f"_{stmt_type}_parser")(stmt_info)
-            parsed_block[stmt_type].append(parsed)
-
-        if "check" in stmt_types and "stay" in stmt_types:
+        for stmt_type, parsed in clauses:
+            parsed_block.setdefault(stmt_type, []).append(parsed)
+
+        if "check" in parsed_block and "stay" in parsed_block:
             warnings.warn(
-                message=f"语法警告:line={super_stmt_info['lineno']}: 子句块中check和stay同时出现，stay可能被忽略")
+                message=f"语法警告:line={lineno}: 子句块中check和stay同时出现，stay可能被忽略")
         return parsed_block
 
-    def _check_parser(self, stmt_info: Dict[str, str]):
+    def _check_parser(self, tokens: _Tokens):
         """
-        check (hard | soft)? (_RET (n)eq <str> | _RET (n)in <List>) -> {
+        check (hard | soft)? <python expr> -> {
             "check_mode": "hard",
             "test_expr: <python expr>,
         }
+        省略 hard | soft 时为 hard
         """
-        parsed = {}
-        tokens = stmt_info["raw"].split(" ")[1:]
-        if (token := tokens.pop(0)) in ("hard", "soft"):
-            parsed["check_mode"] = token
-        elif self._is_ID(token):
-            parsed["check_mode"] = "hard"
-            tokens.insert(0, token)
-        else:
-            raise Exception(
-                f"语法错误:line={stmt_info['lineno']}: {stmt_info['type']}:\nstatement check excepts hard | soft,got {token}")
-
-        python_expr = " ".join(tokens)
-        python_expr = python_expr.replace("neq", "!=").replace("eq", "==").replace("nin", "not in")
-        parsed["test_expr"] = CompiledExpr(python_expr, int(stmt_info["lineno"]))
-        return parsed
+        mode = "hard"
+        if (token := tokens.peek()) is not None and token.kind == "NAME" and token.text in ("hard", "soft"):
+            mode = tokens.accept("NAME").text
+        return {
+            "check_mode": mode,
+            "test_expr": self._expr(tokens, "检查条件"),
+        }
 
-    def _stay_parser(self, stmt_info: Dict[str, str]):
+    def _stay_parser(self, tokens: _Tokens):
         """
-        stay (int|float)? until (_RET (n)eq <str> | _RET (n)in <List>)
+        stay (watch)? (int|float)? until <python expr>?
         until 后面的表达式可以省略，省略后默认为 _RET == True
+        watch 模式下画面变化后才重新执行指令, 时间为最长轮询间隔
         -> {
+            "time": float,
+            "watch": bool,
             "test_expr: <python expr>,
         }
         """
-        parsed = {}
-        tokens = stmt_info["raw"].split(" ")[1:]
-
-        token = tokens.pop(0)
-
-        # 如果token是一个整数或者浮点数，那么就是stay的时间提取时间
-        if re.match(r"^\d+(\.\d+)?$", token):
-            parsed["time"] = float(token)
+        parsed = {"watch": tokens.accept("NAME", "watch") is not None, "time": 1.0}
+        if (token := tokens.accept("NUMBER")) is not None:
+            try:
+                parsed["time"] = float(token.text)
+            except ValueError:
+                raise _SyntaxError(token.start, f"等待时间应为秒数, 而不是 {token.text}")
+        tokens.expect("NAME", " until", "until")
+        if tokens.peek() is None:
+            parsed["test_expr"] = CompiledExpr("_RET", self.lineno)
         else:
-            tokens.insert(0, token)
-            parsed["time"] = 1.0
-
-        if not (token := tokens.pop(0)) == "until":
-            raise Exception(f"语法错误:line={stmt_info['lineno']}: {stmt_info['type']}:\nexcept 'until', got {token}")
-        python_expr = " ".join(tokens)
-        if not python_expr:
-            python_expr = "_RET"
-        python_expr = python_expr.replace("eq", "==").replace("neq", "!=").replace("nin", "not in")
-        parsed["test_expr"] = CompiledExpr(python_expr, int(stmt_info["lineno"]))
+            parsed["test_expr"] = self._expr(tokens, "条件")
         return parsed
 
-    def _var_parser(self, stmt_info: Dict[str, str]):
+    def _var_parser(self, tokens: _Tokens, colon: bool = False):
         """
-        var <ID> = _RET | <str> | <int> | <float>
+        var <ID> = <python expr>
         var del <ID>
         """
-        parsed = {}
-        tokens = stmt_info["raw"].split(" ")[1:]
-        if (token := tokens.pop(0)) == "del":
-            parsed["del"] = True
-            parsed["ID"] = tokens.pop(0)
-            parsed["value"] = CompiledExpr("None", int(stmt_info["lineno"]))
-        else:
-            parsed["del"] = False
-            parsed["ID"] = token
-            if (token := tokens.pop(0)) != "=":
-                raise Exception(f"语法错误:line={stmt_info['lineno']}: {stmt_info['type']}:\nexcept '=', got {token}")
-            parsed["value"] = CompiledExpr(" ".join(tokens), int(stmt_info["lineno"]))
-        return parsed
+        if tokens.accept("NAME", "del") is not None:
+            parsed = {"del": True, "ID": self._ID(tokens), "value": CompiledExpr("None", self.lineno)}
+            tokens.end(colon)
+            return parsed
+        ID = self._ID(tokens)
+        tokens.expect("OP", "等号", "=")
+        return {"del": False, "ID": ID, "value": self._expr(tokens, "变量的值", colon)}
 
     @staticmethod
-    def _is_ID(token: str):
-        return re.match(r"^[a-zA-Z_][a-zA-Z0-9_]*$", token) is not None
+    def _ID(tokens: _Tokens) -> str:
+        token = tokens.peek()
+        if token is not None and (token.kind == "COMPARE" or token.kind == "NAME" and keyword.iskeyword(token.text)):
+            raise _SyntaxError(token.start, f"{token.text} 是关键字, 不能用作变量名")
+        return tokens.expect("NAME", "变量名").text
 
     @property
     def parsedScript(self):
         return self.parsed
-
-
-if __name__ == '__main__':
-    parser = ScriptParser(1)
-    parser.parse("../BASL/test.bas")
-    print(6)
@@ -0,0 +1,182 @@
+"""
+常驻 adb shell 会话
+
+每台设备保持一个交互式 shell, 命令写入其标准输入, 每条命令之后输出一个唯一的结束标记与退出码,
+据此拆分各条命令的输出, 避免每条命令都新建一次 shell.
+会话只用于文本输出的短命令(input, wm size ...), 二进制输出请使用 exec-out.
+"""
+import itertools
+import queue
+import re
+import threading
+import time
+from subprocess import Popen
+from typing import Callable, Optional, Tuple
+
+# 结束标记, 在命令中拆成两段书写, 这样即使终端回显了输入, 回显的内容也不会被误认为标记
+MARK_HEAD = "__BAS"
+MARK_TAIL = "_DONE_"
+_MARK_RE = re.compile(rb"__BAS_DONE_(\d+) (\d+)$")
+
+# 打开会话后的初始化命令: 关闭回显与换行转换, 清空提示符
+INIT_CMD = "stty -echo -onlcr 2>/dev/null; PS1=''; PS2=''"
+# 等待一条命令输出结束标记的最长时间(秒), 超时后关闭会话
+READ_TIMEOUT = 10.0
+# 只读取状态的命令, 读取超时后可以安全地重新执行; 其余命令(input 等)可能已经执行过, 不能重试
+READ_ONLY_COMMANDS = frozenset(("getprop", "dumpsys", "screencap", "echo"))
+# 出现这些字符的命令可能包含多条命令或重定向, 不视为只读
+_COMPOUND_CHARS = frozenset(";&|<>`$\n")
+
+
+def is_read_only(cmd: str) -> bool:
+    """
+    命令是否只读取状态, 重复执行没有副作用
+    """
+    words = cmd.split()
+    if not words or not _COMPOUND_CHARS.isdisjoint(cmd):
+        return False
+    return words[0] in READ_ONLY_COMMANDS or words == ["wm", "size"]
+
+
+class ShellSessionError(Exception):
+    pass
+
+
+class ShellSessionTimeout(ShellSessionError):
+    pass
+
+
+class SocketShellStream:
+    """
+    基于 adb server 连接的 shell 流
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.reader = conn.sock.makefile("rb")
+
+    def write(self, data: bytes):
+        self.conn.sock.sendall(data)
+
+    def readline(self, timeout: Optional[float] = None) -> bytes:
+        self.conn.sock.settimeout(timeout)
+        try:
+            return self.reader.readline()
+        except TimeoutError:
+            raise ShellSessionTimeout("shell 会话读取超时")
+
+    def close(self):
+        self.reader.close()
+        self.conn.close()
+
+
+class ProcessShellStream:
+    """
+    基于 adb shell 子进程的 shell 流
+    """
+
+    def __init__(self, popen: Popen):
+        self.popen = popen
+        # 管道不能设置读取超时(Windows 上也不能 select), 由后台线程逐行读取
+        self._lines: "queue.Queue[bytes]" = queue.Queue()
+        self._reader = threading.Thread(target=self._read, daemon=True, name="adb-shell-reader")
+        self._reader.start()
+
+    def _read(self):
+        try:
+            for line in iter(self.popen.stdout.readline, b""):
+                self._lines.put(line)
+        except (OSError, ValueError):
+            pass
+        self._lines.put(b"")
+
+    def write(self, data: bytes):
+        self.popen.stdin.write(data)
+        self.popen.stdin.flush()
+
+    def readline(self, timeout: Optional[float] = None) -> bytes:
+        try:
+            return self._lines.get(timeout=timeout)
+        except queue.Empty:
+            raise ShellSessionTimeout("shell 会话读取超时")
+
+    def close(self):
+        self.popen.kill()
+        self.popen.wait()
+
+
+class ShellSession:
+    def __init__(self, open_stream: Callable[[], object], timeout: float = READ_TIMEOUT):
+        """
+        :param open_stream: 打开一个新的 shell 流的函数
+        :param timeout: 等待一条命令结束的最长时间(秒), None 表示一直等待
+        """
+        self.open_stream = open_stream
+        self.timeout = timeout
+        self._stream = None
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def alive(self) -> bool:
+        return self._stream is not None
+
+    def _open(self):
+        self._stream = self.open_stream()
+        try:
+            # 同步一次, 丢弃登录提示符等初始输出
+            self._send(INIT_CMD)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._stream is not None:
+            try:
+                self._stream.close()
+            except OSError:
+                pass
+            self._stream = None
+
+    def _send(self, cmd: str) -> Tuple[bytes, int]:
+        seq = next(self._seq)
+        self._stream.write(f'{cmd}\necho "{MARK_HEAD}""{MARK_TAIL}{seq}" $?\n'.encode("utf-8"))
+
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        out = []
+        while True:
+            timeout = None
+            if deadline is not None and (timeout := deadline - time.monotonic()) <= 0:
+                raise ShellSessionTimeout("shell 会话读取超时")
+            line = self._stream.readline(timeout)
+            if not line:
+                raise ShellSessionError("shell 会话已断开")
+            line = line.rstrip(b"\r\n")
+            if (m := _MARK_RE.search(line)) and int(m.group(1)) == seq:
+                # 命令输出末尾没有换行时, 标记会与输出处于同一行
+                if m.start():
+                    out.append(line[:m.start()])
+                return b"\n".join(out) + (b"\n" if out else b""), int(m.group(2))
+            out.append(line)
+
+    def run(self, cmd: str) -> Tuple[bytes, int]:
+        """
+        执行一条命令
+
+        :param cmd: shell 命令
+        :return: (输出, 退出码)
+        """
+        with self._lock:
+            if self._stream is None:
+                self._open()
+            try:
+                return self._send(cmd)
+            except BrokenPipeError:
+                # 会话在写入前已经断开, 命令没有执行, 重连后重试一次
+                self.close()
+                self._open()
+                return self._send(cmd)
+            except (OSError, ShellSessionError):
+                # 命令是否执行未知(包括读取超时), 不重试, 下一条命令时重连
+                self.close()
+                raise
@@ -0,0 +1,47 @@
+"""
+比较 socket 后端与 subprocess 后端的每秒命令数
+
+运行: python -m benchmark.bench_adb_backend [-n 200]
+subprocess 后端需要可用的 adb 可执行文件, 通过 ADB_SERVER_SOCKET 指向假 adb server
+"""
+import argparse
+import os
+import time
+
+from adb.adb_protocol import SocketBackend
+from adb.adb_utils import SubprocessBackend, is_adb_effective
+from benchmark.fake_adb_server import FakeAdbServer, FakeDevice
+
+SERIAL = "emulator-5554"
+
+
+def bench(backend, n: int) -> float:
+    backend.shell(SERIAL, "echo", "warmup")
+    start = time.perf_counter()
+    for i in range(n):
+        assert backend.shell(SERIAL, "echo", i).strip() == str(i).encode()
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=200, help="每个后端执行的命令数")
+    args = parser.parse_args()
+
+    server = FakeAdbServer().start()
+    server.add_device(FakeDevice(SERIAL))
+    host, port = server.address
+    os.environ["ADB_SERVER_SOCKET"] = f"tcp:{host}:{port}"
+
+    try:
+        print(f"socket:     {bench(SocketBackend(server.address), args.n):8.1f} cmd/s")
+        if is_adb_effective():
+            print(f"subprocess: {bench(SubprocessBackend(), args.n):8.1f} cmd/s")
+        else:
+            print("subprocess: 跳过(adb不可用)")
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+异步 adb 接口的设备间隔离测试
+
+一台慢设备排队了大量命令时, 另一台设备上的命令不应等待慢设备释放全局并发名额:
+慢设备上排队 --queued 条耗时 --delay 秒的命令后, 测量快设备上一条命令的延迟
+
+运行: python -m benchmark.bench_async_adb [--queued 20] [--delay 0.05] [--device 1] [--global 4]
+"""
+import argparse
+import asyncio
+import time
+
+from adb.async_adb import AsyncAdb
+from benchmark.fake_adb_server import FakeAdbServer, FakeDevice
+
+SLOW = "emulator-5554"
+FAST = "emulator-5556"
+
+
+async def measure(args, address) -> tuple:
+    adb = AsyncAdb(address, device_concurrency=args.device, global_concurrency=getattr(args, "global"))
+    try:
+        start = time.perf_counter()
+        slow = [asyncio.ensure_future(adb.shell(SLOW, "sleep", args.delay)) for _ in range(args.queued)]
+        # 让慢设备的命令先进入排队
+        await asyncio.sleep(0)
+        assert (await adb.shell(FAST, "echo", "fast")).strip() == b"fast"
+        fast = time.perf_counter() - start
+        await asyncio.gather(*slow)
+        return fast, time.perf_counter() - start
+    finally:
+        adb.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queued", type=int, default=20, help="慢设备上排队的命令数")
+    parser.add_argument("--delay", type=float, default=0.05, help="慢设备每条命令的耗时(秒)")
+    parser.add_argument("--device", type=int, default=1, help="每台设备的并发数")
+    parser.add_argument("--global", type=int, default=4, help="全局并发数")
+    args = parser.parse_args()
+
+    server = FakeAdbServer().start()
+    server.add_device(FakeDevice(SLOW))
+    server.add_device(FakeDevice(FAST))
+    try:
+        fast, slow = asyncio.run(measure(args, server.address))
+    finally:
+        server.stop()
+    print(f"slow device: {args.queued} x {args.delay:g}s queued, drained in {slow * 1000:7.1f} ms")
+    print(f"fast device: 1 command answered in {fast * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+指令分派开销基准
+
+不经过设备 I/O, 直接循环调用执行器的取指与执行, 统计每条指令的解释开销:
+noop 为 sleep 0 (执行器只记录等待时间), clauses 为带 check / stay 子句的 adb 指令(adb 返回固定结果)
+
+    python -m benchmark.bench_dispatch [--lines 1000] [--rounds 20]
+"""
+import argparse
+import contextlib
+import os
+import statistics
+import tempfile
+import time
+import warnings
+
+from adb import ScriptExecutor, Script
+
+SERIAL = "emulator-5554"
+
+SCRIPTS = {
+    "noop": "sleep 0\n",
+    "clauses": 'adb shell true:\n    check soft _RET eq ""\n    stay until _RET eq ""\n',
+}
+
+
+class NullAdb:
+    """
+    不连接设备的 adb, 命令立即返回空字符串
+    """
+
+    def get_command_output(self, cmd):
+        return ""
+
+    def screencap(self):
+        raise RuntimeError("no device")
+
+
+def measure(script_file: str, rounds: int) -> float:
+    """
+    :return: 每条指令的耗时中位数(微秒)
+    """
+    executor = ScriptExecutor(Script(script_file), NullAdb(), SERIAL, start_paused=False)
+    executor._initScript()
+    # 最后一条为 EOF
+    end = executor.script.Length - 1
+    samples = []
+    for _ in range(rounds):
+        executor.IP = 0
+        start = time.perf_counter()
+        while executor.IP < end:
+            executor._fetchInstruction()
+            executor._executeInstruction()
+        samples.append((time.perf_counter() - start) / end * 1e6)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=1000, help="每个脚本的指令数")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bas-bench-")
+    print(f"{args.lines} instructions per script, median of {args.rounds} rounds")
+    print(f"{'script':<10}{'us/instruction':>16}")
+    for name, body in SCRIPTS.items():
+        script_file = os.path.join(workdir, f"{name}.bas")
+        with open(script_file, "w", encoding="utf-8") as f:
+            f.write(body * args.lines)
+        # 执行器与解析器的输出与警告不计入结果
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            us = measure(script_file, args.rounds)
+        print(f"{name:<10}{us:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
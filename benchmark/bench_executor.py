@@ -0,0 +1,176 @@
+"""
+脚本执行器端到端性能测试
+
+在没有设备的情况下, 使用假 adb server(socket 后端)或假 adb 可执行文件(subprocess 后端)无界面运行 ScriptExecutor,
+统计每秒指令数, 各类指令耗时的 p50/p99, 以及每条指令产生的 adb 进程数与 server 请求数
+
+运行:
+python -m benchmark.bench_executor                               # BASL/test.bas
+python -m benchmark.bench_executor --synthetic 2000              # 生成的脚本
+python -m benchmark.bench_executor --backend subprocess --latency 0.03
+python -m benchmark.bench_executor --synthetic 2000 --vision 4       # 图像指令交给进程池
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from benchmark.fake_adb_server import FakeAdbServer, FakeDevice
+from benchmark.fixtures import BUTTONS, write_fixtures
+
+SERIAL = "emulator-5554"
+DEVICE_SIZE = (1080, 2340)
+
+
+def synthetic_script(path: str, lines: int, fixtures: str, seed: int = 0):
+    """
+    生成由 click / adb input / ocr / locate / var / log / sleep 组成的脚本
+    """
+    rnd = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(lines):
+            match rnd.randrange(7):
+                case 0:
+                    f.write(f"click {rnd.randrange(2340)},{rnd.randrange(1080)}\n")
+                case 1:
+                    f.write(f"adb shell input keyevent {rnd.randrange(3, 5)}\n")
+                case 2:
+                    b = rnd.randrange(len(BUTTONS))
+                    x, y, w, h = BUTTONS[b]
+                    template = os.path.join(fixtures, f"button_{b}.png").replace("\\", "/")
+                    f.write(f"ocr {x},{y},{w},{h} \"{template}\":\n")
+                    f.write("    check soft _RET eq True\n")
+                case 3:
+                    f.write(f"var v{i % 8} = {i}\n")
+                case 4:
+                    f.write(f"log \"line {i}\"\n")
+                case 5:
+                    f.write("sleep 0.01\n")
+                case 6:
+                    template = os.path.join(fixtures, f"button_{rnd.randrange(len(BUTTONS))}.png").replace("\\", "/")
+                    f.write(f"locate \"{template}\":\n")
+                    f.write("    check soft _RET eq True\n")
+                    f.write("click _RET\n")
+
+
+def fake_adb_wrapper(directory: str) -> str:
+    """
+    生成调用 benchmark/fake_adb.py 的可执行包装脚本
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    fake = os.path.join(root, "benchmark", "fake_adb.py")
+    if os.name == "nt":
+        path = os.path.join(directory, "adb.bat")
+        with open(path, "w") as f:
+            f.write(f'@set PYTHONPATH={root}\n@"{sys.executable}" "{fake}" %*\n')
+    else:
+        path = os.path.join(directory, "adb")
+        with open(path, "w") as f:
+            f.write(f'#!/bin/sh\nPYTHONPATH="{root}" exec "{sys.executable}" "{fake}" "$@"\n')
+        os.chmod(path, 0o755)
+    return path
+
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=("socket", "subprocess"), default="socket")
+    parser.add_argument("--latency", type=float, default=0.0, help="假 adb 每次请求/调用的人为延迟(秒)")
+    parser.add_argument("--script", default="BASL/test.bas", help="要执行的脚本")
+    parser.add_argument("--synthetic", type=int, default=0, help="改为执行生成的 N 行脚本")
+    parser.add_argument("--max-instructions", type=int, default=2000, help="最多执行的指令数(脚本可能不会结束)")
+    parser.add_argument("--vision", type=int, default=0, help="图像指令交给 N 个工作进程处理(默认在执行线程中处理)")
+    parser.add_argument("--real-sleep", action="store_true", help="执行 sleep 与 stay 的等待(默认跳过, 只测解释器与设备通信)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bas-bench-")
+    fixtures = os.path.join(workdir, "fixtures")
+    screens = write_fixtures(fixtures)
+    log_file = os.path.join(workdir, "fake_adb.log")
+    open(log_file, "w").close()
+
+    # 设备状态跟踪始终通过假 adb server
+    server = FakeAdbServer(latency=args.latency).start()
+    server.add_device(FakeDevice(SERIAL, size=DEVICE_SIZE, screen_file=screens[0]))
+    os.environ["ADB_SERVER_SOCKET"] = "tcp:%s:%d" % server.address
+    os.environ.update({
+        "FAKE_ADB_DEVICES": f"{SERIAL}:{DEVICE_SIZE[0]}x{DEVICE_SIZE[1]}",
+        "FAKE_ADB_SCREEN": screens[0],
+        "FAKE_ADB_LATENCY": str(args.latency),
+        "FAKE_ADB_LOG": log_file,
+    })
+
+    from adb import ScriptExecutor, Script, StopInterruptions
+    from adb import adb_utils
+    from adb.adb_protocol import SocketBackend
+    from ocr import VisionPool
+
+    class BenchExecutor(ScriptExecutor):
+        def __init__(self, *a, **kw):
+            super().__init__(*a, **kw)
+            self.timings = defaultdict(list)
+
+        def _executeInstruction(self):
+            if self.executed >= args.max_instructions:
+                raise StopInterruptions
+            start = time.perf_counter()
+            try:
+                super()._executeInstruction()
+            finally:
+                self.timings[self.IR.type].append(time.perf_counter() - start)
+
+        def Sleep(self, s: float):
+            if args.real_sleep:
+                super().Sleep(s)
+
+    if args.backend == "socket":
+        backend = SocketBackend(server.address)
+    else:
+        adb_utils.adb_path = fake_adb_wrapper(workdir)
+        backend = adb_utils.SubprocessBackend()
+
+    script_file = args.script
+    if args.synthetic:
+        script_file = os.path.join(workdir, "synthetic.bas")
+        synthetic_script(script_file, args.synthetic, fixtures)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        script = Script(script_file)
+        vision = VisionPool(args.vision) if args.vision else None
+        executor = BenchExecutor(script, adb_utils.Adb(SERIAL, backend=backend), SERIAL, start_paused=False,
+                                 vision=vision)
+        requests_before = server.requests
+        start = time.perf_counter()
+        executor.run()
+        elapsed = time.perf_counter() - start
+    server.stop()
+    if vision is not None:
+        vision.close()
+
+    with open(log_file) as f:
+        processes = sum(1 for _ in f)
+    # 除去设备状态跟踪的订阅请求
+    requests = server.requests - requests_before
+    n = executor.executed or 1
+
+    print(f"backend={args.backend} latency={args.latency}s script={script_file}")
+    print(f"instructions: {executor.executed}  elapsed: {elapsed:.3f}s  {executor.executed / elapsed:.1f} instr/s")
+    print(f"{'type':<8}{'count':>8}{'p50(ms)':>10}{'p99(ms)':>10}")
+    for type_, values in sorted(executor.timings.items()):
+        print(f"{type_:<8}{len(values):>8}{statistics.median(values) * 1000:>10.3f}{percentile(values, 0.99) * 1000:>10.3f}")
+    print(f"adb processes/instr: {processes / n:.3f}  server requests/instr: {requests / n:.3f}")
+    print(f"frame cache: {executor.stats['frame_cache_hits']} hits, {executor.stats['frame_cache_misses']} misses")
+
+
+if __name__ == '__main__':
+    main()
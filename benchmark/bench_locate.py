@@ -0,0 +1,56 @@
+"""
+模板搜索基准
+
+在 1080p 截图上全屏搜索各个按钮模板(命中), 随机噪声模板(未命中), 以及限定搜索区域的情况,
+输出 p50/p99 耗时与结果
+
+    python -m benchmark.bench_locate [--rounds 50]
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from ocr import Frame, locate
+from benchmark.fixtures import BUTTONS, SCREEN_SIZE, render_screen
+
+
+def measure(func, rounds: int):
+    result = func()
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return result, statistics.median(samples), samples[min(int(len(samples) * 0.99), len(samples) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    screen = render_screen(0, SCREEN_SIZE).convert("RGBA")
+    frame = Frame(screen.tobytes(), screen.width, screen.height, "RGBA")
+    pixels = np.asarray(screen.convert("RGB"))
+    cases = []
+    for i, (x, y, w, h) in enumerate(BUTTONS):
+        template = np.ascontiguousarray(pixels[y:y + h, x:x + w])
+        cases.append((f"button_{i} full", template, None))
+        wx, wy = max(x - 200, 0), max(y - 100, 0)
+        window = (wx, wy, min(x + w + 200, screen.width) - wx, min(y + h + 100, screen.height) - wy)
+        cases.append((f"button_{i} window", template, window))
+    noise = np.random.default_rng(0).integers(0, 256, (120, 360, 3), dtype=np.uint8)
+    cases.append(("miss full", noise, None))
+
+    print(f"frame {screen.width}x{screen.height}, {args.rounds} rounds")
+    print(f"{'case':<20}{'p50 ms':>9}{'p99 ms':>9}  result")
+    for name, template, window in cases:
+        result, p50, p99 = measure(lambda: locate(frame, template, window), args.rounds)
+        print(f"{name:<20}{p50:9.3f}{p99:9.3f}  {result}")
+
+
+if __name__ == "__main__":
+    main()
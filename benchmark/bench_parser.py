@@ -0,0 +1,57 @@
+"""
+脚本解析器基准
+
+生成不同长度的脚本(语句组成同 bench_executor 的生成脚本), 统计 ScriptParser 解析的耗时与每行耗时,
+每行耗时不随脚本长度增长即为线性
+
+    python -m benchmark.bench_parser [--lines 10000 100000 1000000] [--rounds 3]
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+import warnings
+
+from adb.script_parser import ScriptParser
+from benchmark.bench_executor import synthetic_script
+
+
+def measure(source: str, rounds: int) -> float:
+    """
+    :return: 解析耗时的最小值(秒)
+    """
+    best = float("inf")
+    for _ in range(rounds):
+        gc.collect()
+        start = time.perf_counter()
+        ScriptParser().parse_source(source)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, nargs="+", default=[10000, 100000, 1000000], help="生成脚本的语句数")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bas-bench-")
+    print(f"best of {args.rounds} rounds")
+    print(f"{'statements':>12}{'lines':>12}{'ms':>12}{'us/line':>10}")
+    for statements in args.lines:
+        script_file = os.path.join(workdir, f"synthetic_{statements}.bas")
+        # 模板只出现在路径中, 解析时不读取
+        synthetic_script(script_file, statements, "fixtures")
+        with open(script_file, encoding="utf-8") as f:
+            source = f.read()
+        lines = source.count("\n")
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            seconds = measure(source, args.rounds)
+        print(f"{statements:>12}{lines:>12}{seconds * 1000:>12.1f}{seconds / lines * 1e6:>10.2f}")
+        os.remove(script_file)
+
+
+if __name__ == "__main__":
+    main()
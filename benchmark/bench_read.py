@@ -0,0 +1,57 @@
+"""
+字形识别基准
+
+用 PIL 默认字体生成数字图集, 识别 fixtures 截图中各个文字区域的数字,
+对比一次调用识别全部区域与逐个区域识别的耗时, 并统计准确率
+
+    python -m benchmark.bench_read [--screens 20] [--rounds 20]
+"""
+import argparse
+import time
+
+from ocr import Frame, GlyphAtlas, read_regions, read_text
+from benchmark.fixtures import FONT_SIZE, TEXT_BOXES, render_screen, text_values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--screens", type=int, default=20, help="截图数量")
+    parser.add_argument("--rounds", type=int, default=20, help="每张截图重复识别的次数")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    atlas = GlyphAtlas.from_font(None, "0123456789,", FONT_SIZE)
+    print(f"atlas: {len(atlas)} glyphs, built in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    frames = []
+    for seed in range(args.screens):
+        screen = render_screen(seed).convert("RGBA")
+        frames.append((Frame(screen.tobytes(), screen.width, screen.height, "RGBA"), text_values(seed)))
+
+    correct = total = 0
+    for frame, values in frames:
+        for result, value in zip(read_regions(frame, TEXT_BOXES, atlas), values):
+            correct += result == value
+            total += 1
+    print(f"accuracy: {correct}/{total}")
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for frame, _ in frames:
+            read_regions(frame, TEXT_BOXES, atlas)
+    batch = (time.perf_counter() - start) / (args.rounds * len(frames)) * 1000
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for frame, _ in frames:
+            for box in TEXT_BOXES:
+                read_text(frame, box, atlas)
+    single = (time.perf_counter() - start) / (args.rounds * len(frames)) * 1000
+
+    print(f"{len(TEXT_BOXES)} regions per frame")
+    print(f"batch  {batch:8.3f} ms/frame  {batch / len(TEXT_BOXES):8.3f} ms/region")
+    print(f"single {single:8.3f} ms/frame  {single / len(TEXT_BOXES):8.3f} ms/region")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+降采样比较基准
+
+在加了噪声的 fixtures 截图上比较各个按钮区域, 统计不同缩小比例(scale 1/n)与相似度算法下的
+命中率(按钮所在位置), 误报率(偏移若干像素的位置; 背景中按钮不存在的位置)与每次比较的耗时;
+再以不同大小的区域比较各缩小比例的耗时与相对 1/1 的加速比: 区域与按钮差不多大时每次比较不到 1ms,
+缩小节省的时间可以忽略, 大区域上 tolerance / ncc 的收益明显
+
+    python -m benchmark.bench_reduce [--screens 12] [--rounds 20] [--noise 12]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from ocr import Frame, compare_img, template_cache
+from benchmark.fixtures import BUTTONS, render_screen, write_fixtures
+
+# 各算法的阈值与参数
+METRICS = (("tolerance", 0.9, 24), ("mae", 0.9, None), ("ncc", 0.9, None))
+# 负样本: 相对按钮位置的偏移
+SHIFTS = ((6, 0), (0, 6), (12, 8))
+# 计时用的区域大小 (w, h), 从按钮大小到接近全屏
+REGION_SIZES = ((360, 120), (800, 400), (1600, 900))
+# 计时区域的左上角
+REGION_ORIGIN = (100, 100)
+REDUCES = (1, 2, 3, 4)
+
+
+def noisy(im: Image.Image, rng: np.random.Generator, noise: int) -> Frame:
+    pixels = np.asarray(im.convert("RGB")).astype(np.int16)
+    pixels = np.clip(pixels + rng.integers(-noise, noise + 1, pixels.shape), 0, 255).astype(np.uint8)
+    return Frame.from_image(Image.fromarray(pixels))
+
+
+def median_ms(func, rounds: int) -> float:
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def region_sizes(frame: Frame, screen: Image.Image, workdir: str, rounds: int):
+    """
+    不同大小的区域在各缩小比例下的每次比较耗时(ms)与相对 1/1 的加速比
+    """
+    x, y = REGION_ORIGIN
+    print(f"{'region':<10}{'metric':<10}" + "".join(f"{'1/' + str(r) + '(ms)':>10}" for r in REDUCES)
+          + f"{'best speedup':>14}")
+    for w, h in REGION_SIZES:
+        template = os.path.join(workdir, f"region_{w}x{h}.png")
+        screen.crop((x, y, x + w, y + h)).save(template)
+        for metric, confidence, param in METRICS:
+            times = []
+            for reduce in REDUCES:
+                template_cache.preload([template], reduce)
+                times.append(median_ms(lambda: compare_img(x, y, w, h, frame, template, confidence, metric=metric,
+                                                           param=param, reduce=reduce), rounds))
+            best = min(range(len(REDUCES)), key=times.__getitem__)
+            print(f"{f'{w}x{h}':<10}{metric:<10}" + "".join(f"{t:>10.3f}" for t in times)
+                  + f"{times[0] / times[best]:>8.2f}x 1/{REDUCES[best]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--screens", type=int, default=12, help="截图数量")
+    parser.add_argument("--rounds", type=int, default=20, help="计时时每个样本重复的次数")
+    parser.add_argument("--noise", type=int, default=12, help="截图噪声幅度(单通道)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bas-bench-")
+    fixtures = os.path.join(workdir, "fixtures")
+    write_fixtures(fixtures)
+    templates = [os.path.join(fixtures, f"button_{i}.png") for i in range(len(BUTTONS))]
+
+    rng = np.random.default_rng(0)
+    frames = [noisy(render_screen(seed), rng, args.noise) for seed in range(args.screens)]
+    positives = [(frame, box, template) for frame in frames for box, template in zip(BUTTONS, templates)]
+    # 偏移若干像素的位置, 与按钮大部分重叠
+    near = [(frame, (x + dx, y + dy, w, h), template)
+            for frame in frames for (x, y, w, h), template in zip(BUTTONS, templates)
+            for dx, dy in SHIFTS if x + dx + w <= frame.width and y + dy + h <= frame.height]
+    # 背景中与按钮大小相同的随机位置, 即按钮不存在
+    absent = []
+    for frame in frames:
+        for (_, _, w, h), template in zip(BUTTONS, templates):
+            for _ in range(4):
+                x, y = int(rng.integers(0, 800)), int(rng.integers(300, 800))
+                absent.append((frame, (x, y, w, h), template))
+
+    print(f"{len(positives)} positives, {len(near)} shifted by {SHIFTS}, {len(absent)} absent, noise ±{args.noise}")
+    print(f"{'metric':<10}{'scale':>6}{'hit':>8}{'shifted':>9}{'absent':>8}{'p50(ms)':>9}{'mean score(+/shift/-)':>24}")
+    for metric, confidence, param in METRICS:
+        for reduce in REDUCES:
+            # 缩小后的模板第一次使用时生成并写入磁盘, 不计入耗时
+            template_cache.preload(templates, reduce)
+
+            def score(sample):
+                frame, (x, y, w, h), template = sample
+                return compare_img(x, y, w, h, frame, template, confidence, metric=metric, param=param, reduce=reduce)
+
+            pos = [score(s) for s in positives]
+            shifted = [score(s) for s in near]
+            neg = [score(s) for s in absent]
+            samples = []
+            for sample in positives[:8]:
+                start = time.perf_counter()
+                for _ in range(args.rounds):
+                    score(sample)
+                samples.append((time.perf_counter() - start) / args.rounds * 1000)
+            rates = [sum(map(bool, results)) / len(results) for results in (pos, shifted, neg)]
+            scores = "/".join(f"{np.mean([r.score for r in results]):.3f}" for results in (pos, shifted, neg))
+            print(f"{metric:<10}{'1/' + str(reduce):>6}{rates[0]:>8.1%}{rates[1]:>9.1%}{rates[2]:>8.1%}"
+                  f"{statistics.median(samples):>9.3f}{scores:>24}")
+
+    print()
+    screen = render_screen(0)
+    region_sizes(noisy(screen, rng, args.noise), screen, workdir, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
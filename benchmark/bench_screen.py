@@ -0,0 +1,74 @@
+"""
+画面识别基准
+
+用 fixtures 截图生成画面索引, 对加了噪声与不同文字的截图进行识别, 统计准确率与每次识别的耗时,
+并与逐个画面做一次 ocr 区域比较的方式对比
+
+    python -m benchmark.bench_screen [--screens 16] [--rounds 50]
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from ocr import Frame, ScreenIndex, compare_img
+from benchmark.fixtures import render_screen
+
+# 对照组比较的区域, 位于各画面不同的背景上
+REGION = (600, 640, 360, 200)
+
+
+def frame_of(im: Image.Image) -> Frame:
+    im = im.convert("RGBA")
+    return Frame(im.tobytes(), im.width, im.height, "RGBA")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--screens", type=int, default=16, help="画面数量")
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    references = [render_screen(seed) for seed in range(args.screens)]
+    with tempfile.TemporaryDirectory() as directory:
+        for seed, im in enumerate(references):
+            im.save(f"{directory}/screen{seed}_0.png")
+        start = time.perf_counter()
+        index = ScreenIndex.build(directory)
+        print(f"index: {len(index)} screens, built in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    queries = []
+    for seed in range(args.screens):
+        pixels = np.asarray(render_screen(seed, text="12345")).astype(np.int16)
+        noisy = np.clip(pixels + rng.integers(-16, 17, pixels.shape), 0, 255).astype(np.uint8)
+        queries.append((f"screen{seed}", frame_of(Image.fromarray(noisy))))
+
+    correct = sum(index.lookup(frame) == label for label, frame in queries)
+    print(f"accuracy: {correct}/{len(queries)}")
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for _, frame in queries:
+            index.lookup(frame)
+    lookup = (time.perf_counter() - start) / (args.rounds * len(queries)) * 1000
+
+    # 对照: 按顺序对每个画面检查一个背景区域, 直到找到匹配的画面(平均检查一半的画面)
+    x, y, w, h = REGION
+    templates = [np.ascontiguousarray(np.asarray(im)[y:y + h, x:x + w]) for im in references]
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for _, frame in queries:
+            for template in templates:
+                if compare_img(x, y, w, h, frame, template, 0.9, metric="tolerance"):
+                    break
+    sequential = (time.perf_counter() - start) / (args.rounds * len(queries)) * 1000
+
+    print(f"index lookup      {lookup:8.3f} ms/frame")
+    print(f"sequential ocr    {sequential:8.3f} ms/frame (without the capture each check would need in a script)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+比较原始帧截图与 PNG 截图(含解码)的耗时
+
+运行: python -m benchmark.bench_screencap [-n 20]
+"""
+import argparse
+import time
+
+from adb.adb_protocol import SocketBackend
+from adb.adb_utils import Adb
+from benchmark.fake_adb_server import FakeAdbServer, FakeDevice
+
+SERIAL = "emulator-5554"
+
+
+def bench(adb: Adb, raw: bool, n: int) -> float:
+    adb.screencap(raw).image.convert("RGB")
+    start = time.perf_counter()
+    for _ in range(n):
+        # 与 ocr 指令一致, 取得可供 compare_img 使用的图像
+        adb.screencap(raw).image.convert("RGB")
+    return (time.perf_counter() - start) / n * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=20, help="截图次数")
+    parser.add_argument("--size", default="2340x1080", help="屏幕分辨率")
+    args = parser.parse_args()
+
+    server = FakeAdbServer().start()
+    w, h = map(int, args.size.split("x"))
+    server.add_device(FakeDevice(SERIAL, size=(w, h)))
+    adb = Adb(SERIAL, backend=SocketBackend(server.address))
+    try:
+        print(f"raw: {bench(adb, True, args.n):8.2f} ms/帧")
+        print(f"png: {bench(adb, False, args.n):8.2f} ms/帧")
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+ocr 相似度计算基准
+
+在 1080p 截图上对比原先 ImageChops + getcolors 的实现与各个 NumPy 算法的耗时
+
+    python -m benchmark.bench_similarity [--rounds 200]
+"""
+import argparse
+import time
+
+from PIL import Image, ImageChops
+
+from ocr import Frame, METRICS, compare_img
+from benchmark.fixtures import BUTTONS, SCREEN_SIZE, render_screen
+
+
+def legacy_compare(x, y, width, height, im: Image.Image, im_s: Image.Image) -> float:
+    """
+    原先的实现: 整张截图转换为 RGB 后裁剪, 统计差值图中全黑像素的比例
+    """
+    im = im.convert("RGB").crop((x, y, x + width, y + height))
+    colors = ImageChops.difference(im, im_s).getcolors(maxcolors=16384) or []
+    return sum(count for count, color in colors if color == (0, 0, 0)) / (width * height)
+
+
+def measure(func, rounds: int) -> float:
+    func()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    screen = render_screen(0, SCREEN_SIZE).convert("RGBA")
+    frame = Frame(screen.tobytes(), screen.width, screen.height, "RGBA")
+    x, y, w, h = BUTTONS[0]
+    template = screen.convert("RGB").crop((x, y, x + w, y + h))
+    template.load()
+
+    print(f"frame {screen.width}x{screen.height}, region {w}x{h}, {args.rounds} rounds")
+    base = measure(lambda: legacy_compare(x, y, w, h, screen, template), args.rounds)
+    print(f"{'legacy':<12}{base:8.3f} ms")
+    for metric in METRICS:
+        cost = measure(lambda: compare_img(x, y, w, h, frame, template, 0.9, metric=metric), args.rounds)
+        score = compare_img(x, y, w, h, frame, template, 0.9, metric=metric).score
+        print(f"{metric:<12}{cost:8.3f} ms  {base / cost:6.1f}x  score={score:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+脚本加载基准
+
+生成 N 行脚本, 统计 Script() 在不使用解析缓存, 首次加载(解析并写入缓存)与命中缓存时的耗时,
+以及其中解析(或读取缓存)部分 load_parsed 的耗时;
+并比较一次加载(命中缓存)与流式加载(lazy)取得第一条指令的耗时与内存峰值
+
+    python -m benchmark.bench_startup [--lines 10000] [--rounds 10]
+"""
+import argparse
+import contextlib
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+from adb import Script
+from adb.script_cache import cache_path, load_parsed
+from benchmark.bench_executor import synthetic_script
+from benchmark.fixtures import write_fixtures
+
+
+def measure(func, rounds: int, setup=None) -> float:
+    """
+    :return: 耗时中位数(毫秒)
+    """
+    samples = []
+    for _ in range(rounds):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def peak_memory(func) -> float:
+    """
+    :return: 执行期间分配内存的峰值(MiB)
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=10000, help="生成的脚本行数")
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bas-bench-")
+    fixtures = os.path.join(workdir, "fixtures")
+    write_fixtures(fixtures)
+    script_file = os.path.join(workdir, "startup.bas")
+    synthetic_script(script_file, args.lines, fixtures)
+    with open(script_file, encoding="utf-8") as f:
+        lines = sum(1 for _ in f)
+
+    def clear():
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(cache_path(script_file))
+
+    cases = (
+        ("no cache", lambda: load_parsed(script_file, cache=False), lambda: Script(script_file, cache=False), None),
+        ("cold", lambda: load_parsed(script_file), lambda: Script(script_file), clear),
+        ("warm", lambda: load_parsed(script_file), lambda: Script(script_file), None),
+    )
+    print(f"{lines} lines, median of {args.rounds} rounds")
+    print(f"{'case':<10}{'parse(ms)':>11}{'Script()(ms)':>14}")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        # 模板在第一次加载后留在内存中, 各项只比较解析部分的差异
+        Script(script_file, cache=False)
+        for name, parse, script, setup in cases:
+            print(f"{name:<10}{measure(parse, args.rounds, setup):>11.1f}"
+                  f"{measure(script, args.rounds, setup):>14.1f}")
+    print(f"cache file: {os.path.getsize(cache_path(script_file)) / 1024:.0f} KiB")
+
+    modes = (
+        ("eager", lambda: Script(script_file)[0]),
+        ("lazy", lambda: Script(script_file, lazy=True)[0]),
+    )
+    print(f"{'mode':<10}{'first instruction(ms)':>23}{'peak(MiB)':>11}")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for name, first in modes:
+            print(f"{name:<10}{measure(first, args.rounds):>23.1f}{peak_memory(first):>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+stay watch 性能测试
+
+假设备先显示加载画面, 一段时间后切换到目标画面, 脚本用 stay 等待目标按钮出现,
+对比固定间隔的 stay 与 stay watch: 画面切换到脚本继续执行的延迟, 指令(完整比较)执行次数与截图次数
+
+运行:
+python -m benchmark.bench_stay [--delay 1.3] [--interval 1] [--latency 0.01]
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+
+from PIL import Image, ImageDraw
+
+from benchmark.fake_adb_server import FakeAdbServer, FakeDevice
+from benchmark.fixtures import write_fixtures
+
+SERIAL = "emulator-5554"
+DEVICE_SIZE = (1080, 2340)
+
+
+def run(mode: str, args, loading: str, screen: str, template: str, workdir: str) -> dict:
+    script_file = os.path.join(workdir, f"stay_{mode}.bas")
+    stay = "stay watch" if mode == "watch" else "stay"
+    with open(script_file, "w", encoding="utf-8") as f:
+        # 全屏搜索, 每次执行的比较开销较大
+        f.write(f'locate "{template}":\n    {stay} {args.interval:g} until _RET\nexit\n')
+
+    server = FakeAdbServer(latency=args.latency).start()
+    device = FakeDevice(SERIAL, size=DEVICE_SIZE, screen_file=loading)
+    server.add_device(device)
+    os.environ["ADB_SERVER_SOCKET"] = "tcp:%s:%d" % server.address
+
+    from adb import ScriptExecutor, Script
+    from adb import adb_utils
+    from adb.adb_protocol import SocketBackend
+
+    target = Image.open(screen)
+    switched = []
+
+    def switch():
+        device.screen = target
+        switched.append(time.perf_counter())
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        executor = ScriptExecutor(Script(script_file), adb_utils.Adb(SERIAL, backend=SocketBackend(server.address)),
+                                  SERIAL, start_paused=False)
+        timer = threading.Timer(args.delay, switch)
+        start = time.perf_counter()
+        timer.start()
+        executor.run()
+        finished = time.perf_counter()
+    timer.join()
+    server.stop()
+
+    stats = executor.stats
+    return {
+        "elapsed": finished - start,
+        "latency": finished - switched[0],
+        "executed": stats["instructions"],
+        "captures": stats["frame_cache_misses"],
+        "polls": stats["stay_polls"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--delay", type=float, default=1.3, help="加载画面持续的时间(秒)")
+    parser.add_argument("--interval", type=float, default=1.0, help="stay 的等待时间(秒), watch 模式下为最长轮询间隔")
+    parser.add_argument("--latency", type=float, default=0.0, help="假 adb server 每次请求的人为延迟(秒)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bas-bench-")
+    fixtures = os.path.join(workdir, "fixtures")
+    screens = write_fixtures(fixtures)
+    template = os.path.join(fixtures, "button_0.png").replace("\\", "/")
+    # 加载画面: 纯色背景与文字, 没有按钮
+    loading = os.path.join(workdir, "loading.png")
+    im = Image.new("RGB", Image.open(screens[0]).size, (24, 26, 32))
+    ImageDraw.Draw(im).text((im.width // 2, im.height // 2), "NOW LOADING", fill=(255, 255, 255))
+    im.save(loading)
+
+    print(f"loading screen for {args.delay}s, stay interval {args.interval}s, adb latency {args.latency}s")
+    print(f"{'mode':<8}{'latency(ms)':>12}{'executed':>10}{'captures':>10}{'polls':>8}")
+    for mode in ("fixed", "watch"):
+        r = run(mode, args, loading, screens[0], template, workdir)
+        print(f"{mode:<8}{r['latency'] * 1000:>12.1f}{r['executed']:>10}{r['captures']:>10}{r['polls']:>8}")
+
+
+if __name__ == '__main__':
+    main()
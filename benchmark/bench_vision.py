@@ -0,0 +1,136 @@
+"""
+图像处理进程池基准
+
+模拟多台设备的执行线程, 每台设备反复对自己的截图执行全屏模板搜索, 多区域比较与文字识别,
+对比在执行线程中直接处理(workers=0)与交给不同大小的进程池处理时的总吞吐量,
+同时主线程以 5ms 为周期计时, 模拟界面线程, 统计其被延迟的程度;
+之后多次换用新的执行线程重新运行, 检查进程池的共享内存块数不随之增加
+
+    python -m benchmark.bench_vision [--devices 8] [--seconds 3] [--workers 0,1,2,4,8]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from ocr import Frame, GlyphAtlas, VisionPool, compare_regions, locate, read_regions
+from benchmark.fixtures import BUTTONS, FONT_SIZE, TEXT_BOXES, render_screen, write_fixtures
+
+# 模拟界面线程的计时周期(秒)
+TICK = 0.005
+# 检查共享内存块数时, 换用新执行线程重新运行的次数
+RERUNS = 3
+
+
+def device_loop(frames, template: str, entries, atlas: str, pool: VisionPool, stop: threading.Event, counts, i: int):
+    run = pool.run if pool is not None else (lambda func, frame, *a, **kw: func(frame, *a, **kw))
+    n = 0
+    while not stop.is_set():
+        # 每轮换一帧, 模拟新的截图
+        frame = frames[n % len(frames)]
+        run(locate, frame, template)
+        run(compare_regions, frame, entries)
+        run(read_regions, frame, TEXT_BOXES, atlas)
+        n += 1
+    counts[i] = n
+
+
+def rerun_slots(args, pool: VisionPool, frames, template) -> list:
+    """
+    每次用一组新的执行线程(模拟重新启动的脚本执行器)同时提交任务, 返回每次之后的共享内存块数
+    """
+    slots = []
+    for _ in range(RERUNS):
+        barrier = threading.Barrier(args.devices)
+
+        def device(i: int):
+            barrier.wait()
+            pool.run(locate, frames[i % len(frames)], template)
+
+        threads = [threading.Thread(target=device, args=(i,)) for i in range(args.devices)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        slots.append(pool.slots)
+    return slots
+
+
+def measure(args, workers: int, frames, template, entries, atlas) -> dict:
+    pool = VisionPool(workers) if workers else None
+    if pool is not None:
+        pool.warmup()
+        # 工作进程加载模板与图集
+        for frame in frames[:1]:
+            for _ in range(workers):
+                pool.run(locate, frame, template)
+                pool.run(read_regions, frame, TEXT_BOXES, atlas)
+    stop = threading.Event()
+    counts = [0] * args.devices
+    threads = [threading.Thread(target=device_loop,
+                                args=(frames[i % len(frames):] + frames[:i % len(frames)], template, entries, atlas,
+                                      pool, stop, counts, i))
+               for i in range(args.devices)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+
+    lags = []
+    while time.perf_counter() - start < args.seconds:
+        tick = time.perf_counter()
+        time.sleep(TICK)
+        lags.append((time.perf_counter() - tick - TICK) * 1000)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    slots = None
+    if pool is not None:
+        slots = rerun_slots(args, pool, frames, template)
+        assert len(set(slots)) == 1 and slots[0] <= args.devices, f"shared memory blocks grew: {slots}"
+        pool.close()
+
+    lags.sort()
+    return {
+        "rate": sum(counts) / elapsed,
+        "lag50": statistics.median(lags),
+        "lag99": lags[min(int(len(lags) * 0.99), len(lags) - 1)],
+        "slots": slots,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=8, help="模拟的设备数")
+    parser.add_argument("--seconds", type=float, default=3.0, help="每种配置运行的时间")
+    parser.add_argument("--workers", default=None, help="逗号分隔的进程数, 0 表示在执行线程中处理")
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    workers = sorted({int(w) for w in args.workers.split(",")} if args.workers else {0, 1, 2, 4, cpus})
+
+    workdir = tempfile.mkdtemp(prefix="bas-bench-")
+    fixtures = os.path.join(workdir, "fixtures")
+    write_fixtures(fixtures)
+    template = os.path.join(fixtures, "button_0.png")
+    entries = tuple((box, os.path.join(fixtures, f"button_{i}.png"), 0.9) for i, box in enumerate(BUTTONS))
+    atlas = os.path.join(workdir, "digits.npz")
+    GlyphAtlas.from_font(None, "0123456789,", FONT_SIZE).save(atlas)
+
+    frames = []
+    for seed in range(4):
+        screen = render_screen(seed).convert("RGBA")
+        frames.append(Frame(screen.tobytes(), screen.width, screen.height, "RGBA"))
+
+    print(f"{args.devices} devices, {cpus} cpus, locate + 3-region ocr + 4-region read per round")
+    print(f"{'workers':>8}{'rounds/s':>10}{'gui lag p50(ms)':>17}{'p99(ms)':>9}  shm blocks after reruns")
+    for n in workers:
+        r = measure(args, n, frames, template, entries, atlas)
+        slots = "-" if r["slots"] is None else ",".join(map(str, r["slots"]))
+        print(f"{n if n else 'inline':>8}{r['rate']:>10.1f}{r['lag50']:>17.2f}{r['lag99']:>9.2f}  {slots}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+假 adb 可执行文件, 用于在没有设备的情况下测试 subprocess 后端
+
+由性能测试生成包装脚本调用, 通过环境变量配置:
+FAKE_ADB_DEVICES  设备列表, 形如 "emulator-5554:1080x2340,emulator-5556:720x1280"
+FAKE_ADB_SCREEN   截图返回的图片文件
+FAKE_ADB_LATENCY  每次调用的人为延迟(秒)
+FAKE_ADB_LOG      每次调用向该文件追加一行, 用于统计进程数
+"""
+import os
+import sys
+import time
+
+from benchmark.fake_adb_server import FakeDevice
+
+
+def load_devices() -> dict:
+    devices = {}
+    for spec in filter(None, os.getenv("FAKE_ADB_DEVICES", "emulator-5554:1080x2340").split(",")):
+        serial, _, size = spec.partition(":")
+        w, h = map(int, size.split("x")) if size else (1080, 2340)
+        devices[serial] = FakeDevice(serial, size=(w, h), screen_file=os.getenv("FAKE_ADB_SCREEN"))
+    return devices
+
+
+def main(argv) -> int:
+    if log := os.getenv("FAKE_ADB_LOG"):
+        with open(log, "a") as f:
+            f.write(" ".join(argv) + "\n")
+    time.sleep(float(os.getenv("FAKE_ADB_LATENCY", 0)))
+
+    devices = load_devices()
+    serial = None
+    if argv[:1] == ["-s"]:
+        serial, argv = argv[1], argv[2:]
+    device = devices.get(serial) if serial else next(iter(devices.values()), None)
+    out = sys.stdout.buffer
+
+    match argv:
+        case ["version"]:
+            out.write(b"Android Debug Bridge version 1.0.41\n")
+        case ["devices", *_]:
+            out.write(b"List of devices attached\n")
+            out.write("".join(d.devices_line() for d in devices.values()).encode("utf-8"))
+        case ["start-server"] | ["kill-server"]:
+            pass
+        case ["connect", address]:
+            out.write(f"connected to {address}\n".encode("utf-8"))
+        case [_, *_] if device is None:
+            sys.stderr.write(f"adb: device '{serial}' not found\n")
+            return 1
+        case ["get-state"]:
+            out.write(device.state.encode("utf-8") + b"\n")
+        case ["get-serialno"]:
+            out.write(device.serial.encode("utf-8") + b"\n")
+        case ["shell"]:
+            # 交互式 shell
+            for line in sys.stdin:
+                out.write(device.interactive(line))
+                out.flush()
+        case ["shell" | "exec-out", *args]:
+            out.write(device.run(" ".join(args)))
+        case _:
+            sys.stderr.write(f"adb: unknown command {' '.join(argv)}\n")
+            return 1
+    out.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,229 @@
+"""
+用于测试与性能测试的本地假 adb server
+
+实现了 adb server 主机协议中本项目用到的部分服务, 设备命令的返回值由 FakeDevice 给出
+"""
+import re
+import socketserver
+import struct
+import threading
+import time
+from io import BytesIO
+from typing import Dict, Tuple
+
+
+class FakeDevice:
+    """
+    模拟设备, 根据shell命令返回预设的输出
+    """
+
+    def __init__(self, serial: str, model: str = "Fake_Phone", size: Tuple[int, int] = (1080, 2340),
+                 screen_file: str = None):
+        """
+        :param size: wm size 返回的(竖屏)分辨率
+        :param screen_file: 截图返回的图片文件, 默认为渐变图
+        """
+        self.serial = serial
+        self.model = model
+        self.size = size
+        self.screen_file = screen_file
+        self.state = "device"
+        self.commands = []
+        self._screen = None
+        self._raw = None
+        self._png = None
+
+    @property
+    def screen(self):
+        """
+        当前屏幕内容(PIL图像)
+        """
+        from PIL import Image
+
+        if self._screen is None:
+            if self.screen_file:
+                return Image.open(self.screen_file)
+            return Image.linear_gradient("L").resize(self.size).convert("RGBA")
+        return self._screen
+
+    @screen.setter
+    def screen(self, im):
+        self._screen = im.convert("RGBA")
+        w, h = self._screen.size
+        self._raw = struct.pack("<IIII", w, h, 1, 0) + self._screen.tobytes()
+        buf = BytesIO()
+        self._screen.save(buf, "PNG")
+        self._png = buf.getvalue()
+
+    def run(self, cmd: str) -> bytes:
+        self.commands.append(cmd)
+        if cmd.startswith("sleep "):
+            time.sleep(float(cmd[6:]))
+            return b""
+        if cmd.startswith("echo "):
+            return cmd[5:].replace('"', "").encode("utf-8") + b"\n"
+        if cmd in ("screencap", "screencap -p"):
+            if self._screen is None:
+                self.screen = self.screen
+            return self._raw if cmd == "screencap" else self._png
+        if cmd == "wm size":
+            return f"Physical size: {self.size[0]}x{self.size[1]}\n".encode("utf-8")
+        if cmd == "getprop ro.product.model":
+            return self.model.encode("utf-8") + b"\n"
+        return b""
+
+    def interactive(self, line: str) -> bytes:
+        """
+        交互式 shell 中执行一行, 用 ; 或 && 分隔的多条命令依次执行(假设备的命令总是成功)
+        """
+        return b"".join(self.run(cmd.strip()).replace(b"$?", b"0")
+                        for cmd in re.split(r";|&&", line.strip()) if cmd.strip())
+
+    def devices_line(self) -> str:
+        return f"{self.serial}\t{self.state} product:{self.model} model:{self.model} device:{self.model} transport_id:1\n"
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    server: "FakeAdbServer"
+
+    def handle(self):
+        try:
+            self._handle()
+        except (ConnectionResetError, BrokenPipeError):
+            # 客户端关闭了池中的空闲连接
+            pass
+
+    def _read_request(self) -> str:
+        header = self._read_exact(4)
+        if not header:
+            return ""
+        return self._read_exact(int(header, 16)).decode("utf-8")
+
+    def _read_exact(self, n: int) -> bytes:
+        buf = b""
+        while len(buf) < n:
+            chunk = self.request.recv(n - len(buf))
+            if not chunk:
+                return b""
+            buf += chunk
+        return buf
+
+    def _okay(self, data: bytes = None):
+        if data is None:
+            self.request.sendall(b"OKAY")
+        else:
+            self.request.sendall(b"OKAY" + b"%04x" % len(data) + data)
+
+    def _fail(self, msg: str):
+        data = msg.encode("utf-8")
+        self.request.sendall(b"FAIL" + b"%04x" % len(data) + data)
+
+    def _handle(self):
+        device = None
+        while service := self._read_request():
+            self.server.requests += 1
+            if self.server.latency:
+                time.sleep(self.server.latency)
+
+            if service == "host:version":
+                return self._okay(b"%04x" % 41)
+            if service in ("host:devices", "host:devices-l"):
+                return self.request.sendall(b"OKAY" + self.server.devices_block())
+            if service == "host:track-devices":
+                self._okay()
+                with self.server.lock:
+                    self.server.trackers.append(self.request)
+                    self.server.push_devices(self.request)
+                # 保持连接直到客户端断开
+                self.request.recv(1)
+                with self.server.lock:
+                    self.server.trackers.remove(self.request)
+                return
+            if service == "host:kill":
+                return self._okay()
+            if service.startswith("host-serial:"):
+                serial, _, cmd = service[12:].rpartition(":")
+                if (d := self.server.devices.get(serial)) is None:
+                    return self._fail(f"device '{serial}' not found")
+                if cmd == "get-state":
+                    return self._okay(d.state.encode("utf-8"))
+                if cmd == "get-serialno":
+                    return self._okay(d.serial.encode("utf-8"))
+                return self._fail(f"unknown host service: {cmd}")
+            if service.startswith("host:transport:"):
+                device = self.server.devices.get(service[15:])
+                if device is None:
+                    return self._fail(f"device '{service[15:]}' not found")
+                self._okay()
+                continue
+            if device is not None and service == "shell:":
+                # 交互式 shell, 按行执行, 用 ; 或 && 分隔的多条命令依次执行
+                self._okay()
+                reader = self.request.makefile("rb")
+                while line := reader.readline():
+                    self.request.sendall(device.interactive(line.decode("utf-8")))
+                return
+            if device is not None and service.startswith(("shell:", "exec:")):
+                self._okay()
+                self.request.sendall(device.run(service.split(":", 1)[1]))
+                return
+            return self._fail(f"unknown service: {service}")
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.devices: Dict[str, FakeDevice] = {}
+        # 每个请求的人为延迟(秒)
+        self.latency = latency
+        self.requests = 0
+        self.trackers = []
+        self.lock = threading.Lock()
+        self._thread = None
+
+    def devices_block(self) -> bytes:
+        data = "".join(d.devices_line() for d in self.devices.values()).encode("utf-8")
+        return b"%04x" % len(data) + data
+
+    def push_devices(self, sock=None):
+        """
+        向 track-devices 订阅者推送当前设备列表
+        """
+        for s in [sock] if sock else list(self.trackers):
+            try:
+                s.sendall(self.devices_block())
+            except OSError:
+                pass
+
+    def add_device(self, device: FakeDevice) -> FakeDevice:
+        with self.lock:
+            self.devices[device.serial] = device
+            self.push_devices()
+        return device
+
+    def set_state(self, serial: str, state: str = None):
+        """
+        修改设备状态, state 为 None 时移除设备
+        """
+        with self.lock:
+            if state is None:
+                self.devices.pop(serial, None)
+            else:
+                self.devices[serial].state = state
+            self.push_devices()
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.server_address[:2]
+
+    def start(self) -> "FakeAdbServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,100 @@
+"""
+生成性能测试用的截图
+
+仓库不附带游戏截图, 这里按固定随机种子绘制类似游戏界面的画面(背景, 按钮, 文字, 数字),
+保证每次生成的结果相同
+"""
+import os
+import random
+from typing import List, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+SCREEN_SIZE = (2340, 1080)
+
+# 按钮位置 (x, y, w, h), 以 SCREEN_SIZE 为准
+BUTTONS: List[Tuple[int, int, int, int]] = [
+    (1880, 900, 360, 120),
+    (120, 60, 240, 80),
+    (1000, 480, 340, 120),
+]
+
+# 文字区域 (x, y, w, h), 深色底上的白色数字, 模拟结算界面上的青辉石数量等, 以 SCREEN_SIZE 为准
+TEXT_BOXES: List[Tuple[int, int, int, int]] = [
+    (1500, 120, 420, 72),
+    (1500, 210, 420, 72),
+    (1500, 300, 420, 72),
+    (1500, 390, 420, 72),
+]
+# 文字区域的字号, 以 SCREEN_SIZE 为准
+FONT_SIZE = 48
+
+
+def text_values(seed: int) -> List[str]:
+    """
+    第 seed 帧画面中各个文字区域的内容
+    """
+    rnd = random.Random(seed * 7919 + 1)
+    return [f"{rnd.randrange(10 ** rnd.randrange(1, 8)):,}" for _ in TEXT_BOXES]
+
+
+def render_screen(seed: int = 0, size: Tuple[int, int] = SCREEN_SIZE, text: str = None) -> Image.Image:
+    """
+    绘制一帧画面
+
+    :param seed: 随机种子, 不同的种子得到不同的画面
+    :param size: 分辨率
+    :param text: 画面中央的数字文字, 默认由种子生成
+    """
+    rnd = random.Random(seed)
+    w, h = size
+    im = Image.linear_gradient("L").resize(size).convert("RGB")
+    tint = Image.new("RGB", size, (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+    im = Image.blend(im, tint, 0.5)
+    draw = ImageDraw.Draw(im)
+    font = ImageFont.load_default()
+
+    # 背景中的杂物
+    for _ in range(40):
+        x, y = rnd.randrange(w), rnd.randrange(h)
+        r = rnd.randrange(10, 80)
+        draw.ellipse((x, y, x + r, y + r), fill=(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+
+    sx, sy = w / SCREEN_SIZE[0], h / SCREEN_SIZE[1]
+    for i, (bx, by, bw, bh) in enumerate(BUTTONS):
+        box = (bx * sx, by * sy, (bx + bw) * sx, (by + bh) * sy)
+        draw.rounded_rectangle(box, radius=12, fill=(40 + 60 * i, 120, 220 - 50 * i), outline=(255, 255, 255), width=3)
+        draw.text((box[0] + 20, box[1] + 20), f"BUTTON {i}", fill=(255, 255, 255), font=font)
+
+    text_font = ImageFont.load_default(FONT_SIZE * sy)
+    for (bx, by, bw, bh), value in zip(TEXT_BOXES, text_values(seed)):
+        box = (bx * sx, by * sy, (bx + bw) * sx, (by + bh) * sy)
+        draw.rectangle(box, fill=(30, 34, 48))
+        draw.text((box[0] + 12 * sx, (box[1] + box[3]) / 2), value, fill=(255, 255, 255), font=text_font, anchor="lm")
+
+    if text is None:
+        text = str(rnd.randrange(100000))
+    draw.text((w // 2, h // 4), text, fill=(255, 255, 255), font=font)
+    return im
+
+
+def write_fixtures(directory: str, count: int = 4) -> List[str]:
+    """
+    生成 count 张 SCREEN_SIZE 大小的截图, 以及第一张截图中每个按钮的模板图 button_<i>.png
+
+    :return: 截图文件路径
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for seed in range(count):
+        path = os.path.join(directory, f"screen_{seed}.png")
+        if not os.path.exists(path):
+            render_screen(seed).save(path)
+        paths.append(path)
+
+    screen = Image.open(paths[0])
+    for i, (x, y, w, h) in enumerate(BUTTONS):
+        path = os.path.join(directory, f"button_{i}.png")
+        if not os.path.exists(path):
+            screen.crop((x, y, x + w, y + h)).save(path)
+    return paths
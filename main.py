@@ -1,5 +1,5 @@
-import time
 from typing import Optional, List
+import multiprocessing
 import sys, os
 from qfluentwidgets import PushButton
 
@@ -43,12 +43,13 @@ class ConnectListener(QThread):
         self.serial = serial
 
     def __del__(self):
+        self.requestInterruption()
         self.wait()
 
     def run(self):
-        while True:
-            time.sleep(3)
-            if not Adb.if_device_online(self.serial):
+        tracker = Adb.tracker()
+        while not self.isInterruptionRequested():
+            if tracker.wait_for(self.serial, lambda state: state != "device", timeout=1):
                 self.disconnect.emit(True)
                 self.logger.error("设备断开连接")
                 break
@@ -349,6 +350,8 @@ class App(QMainWindow, Ui_MainWindow):
 
 
 if __name__ == '__main__':
+    # 打包后图像处理进程池的工作进程需要
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     window = App()
     window.show()
@@ -1 +1,8 @@
 from ._ocr import *
+from ._frame import Frame, FrameFormatException
+from ._template_cache import TemplateCache, template_cache
+from ._similarity import DEFAULT_METRIC, METRICS, MatchResult, similarity
+from ._locate import LocateResult, locate
+from ._glyph import GlyphAtlas, TextResult, load_atlas, read_regions, read_text
+from ._screen import ScreenIndex, ScreenLabel, identify_screen, load_index, screen_hash
+from ._pool import VisionPool
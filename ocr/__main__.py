@@ -0,0 +1,62 @@
+"""
+ocr 包的离线工具
+
+生成字形图集:
+python -m ocr atlas --chars 0123456789, --size 48 -o digits.npz              # PIL 默认字体
+python -m ocr atlas --font game.ttf --chars 0123456789 -o digits.npz
+python -m ocr atlas --samples samples/ -o names.npz                         # 截取的样本图, 文件名即文字
+
+生成画面索引:
+python -m ocr index screens/ -o screens.npz        # screens/lobby/*.png 或 screens/lobby_1.png, 目录名/文件名即画面名称
+"""
+import argparse
+from collections import Counter
+
+from ._glyph import GlyphAtlas
+from ._screen import ScreenIndex
+
+
+def build_atlas(args):
+    atlas = None
+    if args.samples:
+        atlas = GlyphAtlas.from_samples(args.samples)
+    if args.font or not args.samples:
+        rendered = GlyphAtlas.from_font(args.font, args.chars, args.size)
+        atlas = rendered if atlas is None else atlas + rendered
+    atlas.save(args.output)
+    print(f"{args.output}: {len(atlas)} 个字形, 字符 {''.join(sorted(set(atlas.chars)))}")
+
+
+def build_index(args):
+    index = ScreenIndex.build(args.directory)
+    index.save(args.output)
+    counts = Counter(index.labels)
+    print(f"{args.output}: {len(index)} 张参考图, {len(counts)} 个画面")
+    for label, count in sorted(counts.items()):
+        print(f"  {label}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m ocr", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    atlas = commands.add_parser("atlas", help="生成字形图集")
+    atlas.add_argument("--font", help="字体文件, 省略且未指定 --samples 时使用 PIL 默认字体")
+    atlas.add_argument("--chars", default="0123456789", help="用字体渲染的字符")
+    atlas.add_argument("--size", type=int, default=48, help="渲染字号, 接近截图中的文字大小即可")
+    atlas.add_argument("--samples", help="样本图目录")
+    atlas.add_argument("-o", "--output", required=True, help="输出的 .npz 文件")
+    atlas.set_defaults(func=build_atlas)
+
+    index = commands.add_parser("index", help="生成画面索引")
+    index.add_argument("directory", help="参考截图目录")
+    index.add_argument("-o", "--output", required=True, help="输出的 .npz 文件")
+    index.set_defaults(func=build_index)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
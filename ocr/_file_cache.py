@@ -0,0 +1,34 @@
+"""
+文件加载缓存
+
+按 路径+修改时间 缓存由文件加载出的对象(字形图集, 画面索引...), 文件被修改后重新加载
+"""
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Generic, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class FileCache(Generic[T]):
+    def __init__(self, loader: Callable[[str], T]):
+        """
+        :param loader: 以文件路径为参数的加载函数
+        """
+        self.loader = loader
+        self._items: Dict[Tuple[str, int], T] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str | Path) -> T:
+        path = os.path.abspath(path)
+        key = (path, os.stat(path).st_mtime_ns)
+        with self._lock:
+            if (item := self._items.get(key)) is not None:
+                return item
+        item = self.loader(path)
+        with self._lock:
+            for old in [k for k in self._items if k[0] == path]:
+                del self._items[old]
+            self._items[key] = item
+        return item
@@ -0,0 +1,165 @@
+"""
+屏幕截图帧
+"""
+import struct
+import zlib
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+# screencap 原始格式 -> (PIL模式, 每像素字节数)
+# 见 android PixelFormat: RGBA_8888=1, RGBX_8888=2, RGB_888=3, RGB_565=4, BGRA_8888=5
+PIXEL_FORMATS = {
+    1: ("RGBA", 4),
+    2: ("RGBX", 4),
+    3: ("RGB", 3),
+    5: ("BGRA", 4),
+}
+
+# 计算指纹时的取样步长(像素)
+FINGERPRINT_STEP = 8
+
+
+class FrameFormatException(Exception):
+    pass
+
+
+def box_reduce(rgb: np.ndarray, factor: int) -> np.ndarray:
+    """
+    对 (高, 宽, 3) 的 RGB 数组做 factor 倍的均值降采样(盒式滤波), 不足一个块的边缘舍弃
+    """
+    h, w = rgb.shape[:2]
+    im = Image.fromarray(np.ascontiguousarray(rgb)).reduce(factor, (0, 0, w // factor * factor, h // factor * factor))
+    return np.asarray(im)
+
+
+class Frame:
+    """
+    一帧截图, 像素数据只保存一份, 通过 data(memoryview) / array(ndarray) / image(PIL) 共享访问,
+    区域通过 roi / rgb 以视图的形式取出, 不复制像素
+    """
+
+    def __init__(self, data, width: int, height: int, mode: str = "RGBA"):
+        self.data = memoryview(data)
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self._array = None
+
+    @classmethod
+    def from_raw(cls, raw: bytes) -> "Frame":
+        """
+        解析 exec-out screencap 输出的原始帧
+
+        头部为 宽, 高, 格式(各 4 字节小端), Android 8 起额外附带 4 字节色彩空间
+
+        :param raw: screencap 原始输出
+        :return:
+        """
+        if len(raw) < 12:
+            raise FrameFormatException("截图数据过短")
+        width, height, fmt = struct.unpack_from("<III", raw)
+        if fmt not in PIXEL_FORMATS:
+            raise FrameFormatException(f"不支持的像素格式: {fmt}")
+        mode, bpp = PIXEL_FORMATS[fmt]
+        size = width * height * bpp
+        header = len(raw) - size
+        if header not in (12, 16):
+            raise FrameFormatException(f"截图数据长度不正确: {len(raw)}")
+        return cls(memoryview(raw)[header:], width, height, mode)
+
+    @classmethod
+    def from_png(cls, png: bytes) -> "Frame":
+        """
+        解码 screencap -p 输出的 PNG
+        """
+        im = Image.open(BytesIO(png))
+        if im.mode not in ("RGBA", "RGB"):
+            im = im.convert("RGBA")
+        return cls(im.tobytes(), im.width, im.height, im.mode)
+
+    @classmethod
+    def from_image(cls, im: Image.Image) -> "Frame":
+        """
+        从 PIL 图像构造
+        """
+        if im.mode not in ("RGBA", "RGB"):
+            im = im.convert("RGBA")
+        return cls(im.tobytes(), im.width, im.height, im.mode)
+
+    @property
+    def channels(self) -> int:
+        return len(self.mode)
+
+    @property
+    def array(self) -> np.ndarray:
+        """
+        形状为 (高, 宽, 通道) 的只读数组, 与 data 共享内存
+        """
+        if self._array is None:
+            self._array = np.frombuffer(self.data, dtype=np.uint8).reshape(self.height, self.width, self.channels)
+        return self._array
+
+    @property
+    def image(self) -> Image.Image:
+        """
+        与 data 共享内存的 PIL 图像
+        """
+        size = (self.width, self.height)
+        if self.mode == "BGRA":
+            # 需要重排通道, 无法共享内存
+            return Image.frombuffer("RGBA", size, self.data, "raw", "BGRA", 0, 1)
+        mode = "RGBA" if self.mode == "RGBX" else self.mode
+        return Image.frombuffer(mode, size, self.data, "raw", mode, 0, 1)
+
+    def roi(self, x: int, y: int, width: int, height: int) -> np.ndarray:
+        """
+        区域视图, 通道顺序与 mode 一致
+
+        :return: 形状为 (height, width, 通道) 的只读数组, 与 data 共享内存
+        """
+        if x < 0 or y < 0 or x + width > self.width or y + height > self.height:
+            raise ValueError(f"区域 {(x, y, width, height)} 超出截图范围 {self.width}x{self.height}")
+        return self.array[y:y + height, x:x + width]
+
+    def rgb(self, x: int = 0, y: int = 0, width: int = None, height: int = None, contiguous: bool = False) -> np.ndarray:
+        """
+        区域的 RGB 数组, 转换只作用于该区域
+
+        :param contiguous: False 时通过调整步长完成通道的选取与重排, 返回不复制像素的只读视图;
+                           True 时将区域逐通道复制为紧凑的 RGB 数组, 后续的逐像素计算更快
+        :return: 形状为 (height, width, 3) 的数组
+        """
+        width = self.width - x if width is None else width
+        height = self.height - y if height is None else height
+        region = self.roi(x, y, width, height)
+        region = region[..., 2::-1] if self.mode == "BGRA" else region[..., :3]
+        if not contiguous or region.strides[1:] == (3, 1):
+            return region
+        # 逐通道复制比 np.ascontiguousarray 对跨步视图的整体复制快
+        out = np.empty((height, width, 3), dtype=np.uint8)
+        for c in range(3):
+            out[..., c] = region[..., c]
+        return out
+
+    def reduced(self, x: int, y: int, width: int, height: int, factor: int) -> np.ndarray:
+        """
+        区域按 factor 倍均值降采样后的 RGB 数组, 不足一个块的边缘舍弃
+
+        :return: 形状为 (height // factor, width // factor, 3) 的数组
+        """
+        # PIL 对 RGBA 图像降采样前会先转换整张图像, 因此只复制区域, 在 RGB 上降采样
+        width, height = width // factor * factor, height // factor * factor
+        return box_reduce(self.rgb(x, y, width, height, contiguous=True), factor)
+
+    def fingerprint(self, x: int = 0, y: int = 0, width: int = None, height: int = None,
+                    step: int = FINGERPRINT_STEP) -> int:
+        """
+        区域的指纹: 每隔 step 个像素取样后计算 crc32, 用于廉价地判断画面是否变化
+
+        :return: 取样像素相同时指纹相同
+        """
+        width = self.width - x if width is None else width
+        height = self.height - y if height is None else height
+        return zlib.crc32(np.ascontiguousarray(self.roi(x, y, width, height)[::step, ::step]))
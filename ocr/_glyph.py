@@ -0,0 +1,335 @@
+"""
+字形识别
+
+基于预先生成的字形图集识别区域内的单行文字或数字. 区域二值化后按连通块切分出单个字形,
+每个字形缩放到固定大小的格子中作为特征向量, 与图集中所有字形的相似度通过一次矩阵乘法求出, 取最相似者
+"""
+import os
+import warnings
+from pathlib import Path
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from ._file_cache import FileCache
+from ._frame import Frame
+
+# 字形格子大小 (高, 宽)
+CELL = (24, 16)
+# 像素数少于该值的字形视为噪点
+MIN_GLYPH_PIXELS = 4
+# 相邻字形的间距减去两侧字形的留白后, 超过 行高*SPACE_RATIO 时视为空格
+SPACE_RATIO = 0.2
+# 图集文件格式版本
+ATLAS_VERSION = 1
+
+
+class TextResult(str):
+    """
+    识别结果, 即识别出的文字, score 为各个字形相似度中的最小值, 没有字形时为 0
+    """
+    score: float
+
+    def __new__(cls, text: str, score: float):
+        self = super().__new__(cls, text)
+        self.score = score
+        return self
+
+    def __reduce__(self):
+        # 进程池的工作进程返回结果时需要序列化
+        return self.__class__, (str(self), self.score)
+
+    def __repr__(self):
+        return f"TextResult({str(self)!r}, score={self.score:.4f})"
+
+
+def _binarize(gray: np.ndarray) -> np.ndarray:
+    """
+    大津法二值化, 像素较少的一类视为文字
+
+    :return: 文字像素为 True 的布尔数组
+    """
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    total = gray.size
+    levels = np.arange(256)
+    weight = np.cumsum(hist)
+    mean = np.cumsum(hist * levels)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (mean[-1] * weight / total - mean) ** 2 / (weight * (total - weight))
+    if not np.isfinite(between[:-1]).any():
+        # 纯色区域, 没有文字
+        return np.zeros(gray.shape, dtype=bool)
+    threshold = int(np.nanargmax(between[:-1]))
+    bright = gray > threshold
+    return bright if np.count_nonzero(bright) * 2 <= total else ~bright
+
+
+def _normalize(glyph: np.ndarray) -> np.ndarray:
+    """
+    将字形的外接矩形按比例缩放后放到格子中央, 展开为特征向量
+    """
+    h, w = glyph.shape
+    ch, cw = CELL
+    ratio = min(ch / h, cw / w)
+    size = (max(round(w * ratio), 1), max(round(h * ratio), 1))
+    scaled = np.asarray(Image.fromarray(glyph.astype(np.uint8) * 255).resize(size, Image.BILINEAR), dtype=np.float32)
+    cell = np.zeros(CELL, dtype=np.float32)
+    top, left = (ch - size[1]) // 2, (cw - size[0]) // 2
+    cell[top:top + size[1], left:left + size[0]] = scaled / 255
+    return cell.ravel()
+
+
+def _components(mask: np.ndarray) -> List[Tuple[int, int, np.ndarray]]:
+    """
+    按 8 连通切分字形. 逐行提取像素段, 相邻行重叠的段属于同一连通块;
+    横向重叠超过一半的连通块(如 i 的点, 冒号, 等号)合并为一个字形
+
+    :return: [(左边界, 右边界, 字形掩码)], 按左边界排序
+    """
+    h, w = mask.shape
+    stride = w + 2
+    padded = np.zeros((h, stride), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    diff = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(diff == 1)
+    _, ends = np.nonzero(diff == -1)
+    n = len(rows)
+    if n == 0:
+        return []
+
+    # 段按 行, 列 排序, 与下一行某段重叠的本行段是连续的一段, 用二分查找一次求出所有相邻关系.
+    # 段为左闭右开区间, 8 连通时对角相邻也算重叠
+    start_keys = rows * stride + starts
+    end_keys = rows * stride + ends
+    below = np.flatnonzero(rows > 0)
+    lo = np.searchsorted(end_keys, (rows[below] - 1) * stride + starts[below], "left")
+    hi = np.searchsorted(start_keys, (rows[below] - 1) * stride + ends[below], "right")
+    counts = np.maximum(hi - lo, 0)
+    a = np.repeat(below, counts)
+    b = np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    # 标签传播求连通块, 每轮之后做一次指针跳跃加速收敛
+    labels = np.arange(n)
+    while True:
+        low = np.minimum(labels[a], labels[b])
+        updated = labels.copy()
+        np.minimum.at(updated, a, low)
+        np.minimum.at(updated, b, low)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+
+    # 段标签写回像素, 得到整个区域的标签图(0 为背景)
+    marks = np.zeros((h, stride), dtype=np.int64)
+    np.add.at(marks, (rows, starts), labels + 1)
+    np.add.at(marks, (rows, ends), -(labels + 1))
+    label_map = np.cumsum(marks, axis=1)[:, :w]
+
+    order = np.argsort(labels, kind="stable")
+    roots, first = np.unique(labels[order], return_index=True)
+    blobs = []
+    for root, runs in zip(roots, np.split(order, first[1:])):
+        if int((ends[runs] - starts[runs]).sum()) >= MIN_GLYPH_PIXELS:
+            blobs.append([int(starts[runs].min()), int(ends[runs].max()), [root + 1]])
+    blobs.sort(key=lambda blob: blob[0])
+
+    merged = []
+    for blob in blobs:
+        if merged:
+            last = merged[-1]
+            overlap = min(last[1], blob[1]) - max(last[0], blob[0])
+            if overlap * 2 >= min(last[1] - last[0], blob[1] - blob[0]):
+                merged[-1] = [min(last[0], blob[0]), max(last[1], blob[1]), last[2] + blob[2]]
+                continue
+        merged.append(blob)
+
+    return [(left, right, label_map[:, left:right] == ids[0] if len(ids) == 1 else np.isin(label_map[:, left:right], ids))
+            for left, right, ids in merged]
+
+
+def segment(gray: np.ndarray) -> Tuple[List[np.ndarray], List[int], List[int], int]:
+    """
+    将单行文字切分为字形
+
+    :param gray: 区域的灰度数组
+    :return: (各字形的特征向量, 各字形与前一个字形的间距, 各字形的高度, 行高)
+    """
+    mask = _binarize(gray)
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return [], [], [], 0
+    mask = mask[rows[0]:rows[-1] + 1]
+
+    features, gaps, heights = [], [], []
+    last_right = None
+    for left, right, glyph in _components(mask):
+        glyph_rows = np.flatnonzero(glyph.any(axis=1))
+        features.append(_normalize(glyph[glyph_rows[0]:glyph_rows[-1] + 1]))
+        gaps.append(0 if last_right is None else left - last_right)
+        heights.append(int(glyph_rows[-1] - glyph_rows[0] + 1))
+        last_right = right
+    return features, gaps, heights, mask.shape[0]
+
+
+class GlyphAtlas:
+    """
+    字形图集, 同一个字符可以有多个字形
+    """
+
+    def __init__(self, chars: Sequence[str], glyphs: np.ndarray, bearings: np.ndarray = None):
+        """
+        :param chars: 每个字形对应的字符
+        :param glyphs: 形状为 (字形数, CELL高*CELL宽) 的特征向量
+        :param bearings: 形状为 (字形数, 2) 的左右留白(相对于字形高度), 用于区分字间距与空格, 默认为 0
+        """
+        if len(chars) != len(glyphs):
+            raise ValueError("字符数与字形数不一致")
+        self.chars = list(chars)
+        self.glyphs = np.asarray(glyphs, dtype=np.float32).reshape(-1, CELL[0] * CELL[1])
+        self.bearings = np.zeros((len(self.chars), 2), dtype=np.float32) if bearings is None \
+            else np.asarray(bearings, dtype=np.float32)
+        norms = np.linalg.norm(self.glyphs, axis=1, keepdims=True)
+        # 预先归一化, 识别时一次矩阵乘法即得到余弦相似度
+        self._unit = self.glyphs / np.maximum(norms, 1e-6)
+
+    def __len__(self):
+        return len(self.chars)
+
+    def classify(self, features: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param features: 形状为 (n, CELL高*CELL宽) 的特征向量
+        :return: (各字形最相似的图集字形下标, 相似度)
+        """
+        if len(features) == 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.float32)
+        unit = features / np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-6)
+        similarity = unit @ self._unit.T
+        best = similarity.argmax(axis=1)
+        return best, similarity[np.arange(len(best)), best]
+
+    @classmethod
+    def from_font(cls, font: str | Path | ImageFont.ImageFont = None, chars: str = "0123456789", size: int = 48) -> "GlyphAtlas":
+        """
+        用字体渲染字符生成图集
+
+        :param font: 字体文件路径或字体对象, None 表示 PIL 默认字体
+        :param chars: 需要识别的字符
+        :param size: 渲染字号
+        """
+        if font is None:
+            font = ImageFont.load_default(size)
+        elif isinstance(font, (str, Path)):
+            font = ImageFont.truetype(str(font), size)
+        features, labels, bearings = [], [], []
+        for char in chars:
+            if char.isspace():
+                continue
+            origin = size // 2
+            im = Image.new("L", (size * 3, size * 2))
+            ImageDraw.Draw(im).text((origin, origin), char, fill=255, font=font)
+            pixels = np.asarray(im)
+            glyphs, _, heights, _ = segment(pixels)
+            if len(glyphs) != 1:
+                warnings.warn(f"字符 {char!r} 渲染后得到 {len(glyphs)} 个字形, 已跳过")
+                continue
+            # 留白按实际渲染出的笔画计算, 部分字体的 getbbox 返回的是步进宽度而不是笔画范围
+            columns = np.flatnonzero(_binarize(pixels).any(axis=0))
+            left = columns[0] - origin
+            right = origin + font.getlength(char) - (columns[-1] + 1)
+            features.append(glyphs[0])
+            labels.append(char)
+            bearings.append((left / heights[0], right / heights[0]))
+        return cls(labels, np.array(features), np.array(bearings))
+
+    @classmethod
+    def from_samples(cls, directory: str | Path) -> "GlyphAtlas":
+        """
+        从截取的样本图生成图集, 文件名(不含扩展名, 可带 _序号 后缀)即图中的文字, 如 1,058,756_2.png
+        """
+        features, labels = [], []
+        for name in sorted(os.listdir(directory)):
+            label, ext = os.path.splitext(name)
+            if ext.lower() not in (".png", ".jpg", ".bmp"):
+                continue
+            label = label.rsplit("_", 1)[0] if "_" in label else label
+            with Image.open(os.path.join(directory, name)) as im:
+                glyphs, _, _, _ = segment(np.asarray(im.convert("L")))
+            text = label.replace(" ", "")
+            if len(glyphs) != len(text):
+                warnings.warn(f"样本 {name} 切分出 {len(glyphs)} 个字形, 与文件名中的 {len(text)} 个字符不一致, 已跳过")
+                continue
+            features.extend(glyphs)
+            labels.extend(text)
+        return cls(labels, np.array(features))
+
+    def __add__(self, other: "GlyphAtlas") -> "GlyphAtlas":
+        return GlyphAtlas(self.chars + other.chars, np.concatenate((self.glyphs, other.glyphs)),
+                          np.concatenate((self.bearings, other.bearings)))
+
+    def save(self, path: str | Path):
+        np.savez_compressed(path, version=ATLAS_VERSION, cell=np.array(CELL), chars=np.array(self.chars),
+                            glyphs=self.glyphs.astype(np.float16), bearings=self.bearings)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "GlyphAtlas":
+        with np.load(path) as data:
+            if int(data["version"]) != ATLAS_VERSION or tuple(data["cell"]) != CELL:
+                raise ValueError(f"图集 {path} 的格式与当前版本不兼容, 请重新生成")
+            return cls([str(c) for c in data["chars"]], data["glyphs"].astype(np.float32), data["bearings"])
+
+
+_atlases = FileCache(GlyphAtlas.load)
+
+
+def load_atlas(path: str | Path) -> GlyphAtlas:
+    """
+    加载图集, 同一文件只加载一次
+    """
+    return _atlases.get(path)
+
+
+def read_regions(frame: Frame, boxes: Sequence[Tuple[int, int, int, int]],
+                 atlas: str | Path | GlyphAtlas) -> List[TextResult]:
+    """
+    识别同一帧截图中多个区域的文字, 所有区域的字形一起分类
+
+    :param frame: 截图
+    :param boxes: 区域 (x, y, 宽, 高) 列表, 每个区域为单行文字
+    :param atlas: 图集或图集文件路径
+    :return: 各区域的识别结果
+    """
+    if not isinstance(atlas, GlyphAtlas):
+        atlas = load_atlas(atlas)
+    image = frame.image
+    features, layout = [], []
+    for x, y, w, h in boxes:
+        x, y, w, h = int(x), int(y), int(w), int(h)
+        if x < 0 or y < 0 or x + w > frame.width or y + h > frame.height:
+            raise ValueError(f"区域 {(x, y, w, h)} 超出截图范围 {frame.width}x{frame.height}")
+        glyphs, gaps, heights, line_height = segment(np.asarray(image.crop((x, y, x + w, y + h)).convert("L")))
+        features.extend(glyphs)
+        layout.append((np.array(gaps), np.array(heights), line_height))
+
+    best, scores = atlas.classify(np.array(features).reshape(-1, CELL[0] * CELL[1]))
+    results = []
+    i = 0
+    for gaps, heights, line_height in layout:
+        n = len(gaps)
+        glyphs = best[i:i + n]
+        # 间距减去前一个字形的右留白与当前字形的左留白, 剩余部分足够宽时才是空格
+        bearings = atlas.bearings[glyphs] * heights[:, None]
+        spaces = gaps[1:] - bearings[:-1, 1] - bearings[1:, 0] > line_height * SPACE_RATIO
+        text = "".join(atlas.chars[g] if k == 0 or not spaces[k - 1] else " " + atlas.chars[g]
+                       for k, g in enumerate(glyphs))
+        results.append(TextResult(text, float(scores[i:i + n].min()) if n else 0.0))
+        i += n
+    return results
+
+
+def read_text(frame: Frame, box: Tuple[int, int, int, int], atlas: str | Path | GlyphAtlas) -> TextResult:
+    """
+    识别截图中一个区域的文字
+    """
+    return read_regions(frame, [box], atlas)[0]
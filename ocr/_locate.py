@@ -0,0 +1,263 @@
+"""
+模板搜索
+
+在搜索区域内寻找与模板最相似的位置. 先在降采样后的灰度金字塔顶层用 FFT 计算全部位置的归一化互相关,
+只保留少数候选, 再逐层放大, 在候选附近的小邻域内精确计算, 候选得分过低时提前结束
+"""
+import threading
+import weakref
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from ._frame import Frame
+from ._similarity import MatchResult
+from ._template_cache import template_cache
+
+# 金字塔顶层模板的最短边不小于该值, 过小时模板的细节丢失, 真正的位置在顶层得分过低而被放弃
+MIN_TEMPLATE_SIDE = 12
+# 金字塔最多层数(含原图)
+MAX_LEVELS = 4
+# 顶层保留的候选数
+CANDIDATES = 8
+# 降采样会降低相似度, 低层得分低于 confidence - COARSE_MARGIN 的候选直接放弃
+COARSE_MARGIN = 0.25
+# 最好的候选领先其余候选超过该值时, 其余候选不再细化
+LEAD_MARGIN = 0.1
+# 区域的灰度标准差低于该值时视为纯色, 得分为 0, 避免积分图的舍入误差被放大
+MIN_STDDEV = 1.0
+
+class LocateResult(MatchResult):
+    """
+    模板搜索结果, box 为最相似位置的 (x, y, 宽, 高), pos 为其中心点, 可直接用于 click
+    """
+    __slots__ = ("box",)
+
+    def __init__(self, matched: bool, score: float, box: Tuple[int, int, int, int]):
+        super().__init__(matched, score, "ncc")
+        self.box = box
+
+    @property
+    def pos(self) -> Tuple[int, int]:
+        x, y, w, h = self.box
+        return x + w // 2, y + h // 2
+
+    def __repr__(self):
+        return f"LocateResult({self.matched}, score={self.score:.4f}, box={self.box})"
+
+
+def _reduce(gray: Image.Image, factor: int, box: Tuple[int, int, int, int] = None) -> np.ndarray:
+    """
+    对灰度图(的指定区域)做 factor 倍的均值降采样, 不足一个块的边缘舍弃
+
+    :param box: 原图坐标下的区域, 各边需为 factor 的整数倍
+    """
+    box = box or (0, 0, gray.width // factor * factor, gray.height // factor * factor)
+    if factor > 1:
+        gray = gray.reduce(factor, box)
+    elif box != (0, 0, gray.width, gray.height):
+        gray = gray.crop(box)
+    return np.asarray(gray, dtype=np.float32)
+
+
+def _levels(template_shape: Tuple[int, ...], window_shape: Tuple[int, ...]) -> int:
+    levels = 1
+    side = min(template_shape[:2])
+    while levels < MAX_LEVELS and side // 2 >= MIN_TEMPLATE_SIDE and min(window_shape[:2]) >> levels >= side // 2:
+        side //= 2
+        levels += 1
+    return levels
+
+
+class _Template:
+    """
+    模板各层零均值化后的灰度数据及其二范数
+    """
+
+    def __init__(self, gray: Image.Image, levels: int):
+        self.levels = []
+        for level in range(levels):
+            t = _reduce(gray, 1 << level)
+            t -= t.mean()
+            self.levels.append((t, float(np.sqrt(np.dot(t.ravel(), t.ravel())))))
+
+
+# 模板数组 id -> {(层数, 缩放) -> _Template}, 模板数组被回收时一并清除
+_templates: Dict[int, Dict[tuple, _Template]] = {}
+_templates_lock = threading.Lock()
+
+
+def _prepare(template: np.ndarray, levels: int, scale: Tuple[float, float]) -> _Template:
+    key = (levels, scale)
+    with _templates_lock:
+        cached = _templates.get(id(template))
+        if cached is not None and key in cached:
+            return cached[key]
+    im = Image.fromarray(np.ascontiguousarray(template))
+    if scale != (1, 1):
+        im = im.resize((max(round(template.shape[1] * scale[0]), 1), max(round(template.shape[0] * scale[1]), 1)))
+    prepared = _Template(im.convert("L"), levels)
+    with _templates_lock:
+        if id(template) not in _templates:
+            _templates[id(template)] = {}
+            weakref.finalize(template, _templates.pop, id(template), None)
+        _templates[id(template)][key] = prepared
+    return prepared
+
+
+def _fft_len(n: int) -> int:
+    """
+    不小于 n 且只含 2, 3, 5 因子的长度, FFT 在这类长度上最快
+    """
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+
+def _ncc_map(window: np.ndarray, template: np.ndarray, norm: float) -> np.ndarray:
+    """
+    用 FFT 计算模板在窗口内所有位置的归一化互相关
+
+    :param window: 灰度窗口
+    :param template: 零均值化的灰度模板
+    :param norm: 模板的二范数
+    :return: 形状为 (H-h+1, W-w+1) 的得分图
+    """
+    H, W = window.shape
+    h, w = template.shape
+    shape = (_fft_len(H), _fft_len(W))
+    # 零均值模板与窗口的互相关等于与窗口减去局部均值后的互相关
+    spectrum = np.fft.rfft2(window, shape) * np.conj(np.fft.rfft2(template, shape))
+    numerator = np.fft.irfft2(spectrum, shape)[:H - h + 1, :W - w + 1]
+
+    # 积分图求每个位置的局部和与平方和
+    integral = np.zeros((H + 1, W + 1), dtype=np.float64)
+    integral[1:, 1:] = window.cumsum(0).cumsum(1)
+    squared = np.zeros((H + 1, W + 1), dtype=np.float64)
+    squared[1:, 1:] = (window.astype(np.float64) ** 2).cumsum(0).cumsum(1)
+
+    def box(table):
+        return table[h:, w:] - table[:-h, w:] - table[h:, :-w] + table[:-h, :-w]
+
+    n = h * w
+    s = box(integral)
+    variance = np.maximum(box(squared) - s * s / n, 0)
+    denominator = np.sqrt(variance) * norm
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = np.where(variance > n * MIN_STDDEV ** 2, numerator / denominator, 0)
+    return np.clip(scores, -1, 1, out=scores)
+
+
+def _top_candidates(scores: np.ndarray, count: int, radius: Tuple[int, int]) -> List[Tuple[int, int]]:
+    """
+    取得分最高的若干位置, 每取一个就抑制其邻域, 避免候选挤在同一个峰(如一块纯色区域)附近
+
+    :param radius: 抑制的邻域半径 (纵向, 横向)
+    """
+    scores = scores.copy()
+    ry, rx = radius
+    candidates = []
+    for _ in range(count):
+        y, x = np.unravel_index(np.argmax(scores), scores.shape)
+        if scores[y, x] == -np.inf:
+            break
+        candidates.append((int(y), int(x)))
+        scores[max(y - ry, 0):y + ry + 1, max(x - rx, 0):x + rx + 1] = -np.inf
+    return candidates
+
+
+def _refine(gray: Image.Image, level: int, template: np.ndarray, norm: float,
+            y: int, x: int, radius: int) -> Tuple[float, int, int]:
+    """
+    在第 level 层的 (y, x) 附近 radius 范围内逐个位置计算归一化互相关, 只对该邻域做降采样
+
+    :return: (最高得分, y, x)
+    """
+    factor = 1 << level
+    h, w = template.shape
+    y0, x0 = max(y - radius, 0), max(x - radius, 0)
+    y1 = min(y + radius, gray.height // factor - h)
+    x1 = min(x + radius, gray.width // factor - w)
+    if y1 < y0 or x1 < x0:
+        return -1.0, y, x
+    sub = _reduce(gray, factor, (x0 * factor, y0 * factor, (x1 + w) * factor, (y1 + h) * factor))
+    patches = np.lib.stride_tricks.sliding_window_view(sub, (h, w))
+    numerator = np.einsum("ijkl,kl->ij", patches, template)
+    means = patches.mean(axis=(2, 3))
+    variance = np.maximum(np.einsum("ijkl,ijkl->ij", patches, patches) - means * means * (h * w), 0)
+    denominator = np.sqrt(variance) * norm
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = np.where(variance > h * w * MIN_STDDEV ** 2, numerator / denominator, 0)
+    i, j = np.unravel_index(np.argmax(scores), scores.shape)
+    return float(scores[i, j]), y0 + int(i), x0 + int(j)
+
+
+def locate(
+        frame: Frame,
+        template: str | Path | np.ndarray,
+        window: Tuple[int, int, int, int] = None,
+        confidence: float = 0.9,
+        scale: Tuple[float, float] = (1, 1),
+) -> LocateResult:
+    """
+    在截图的搜索区域内寻找模板
+
+    :param frame: 截图
+    :param template: 模板图路径或 (高, 宽, 3) RGB 数组, 同一个模板多次搜索时复用其金字塔
+    :param window: 搜索区域 (x, y, 宽, 高), None 表示全屏
+    :param confidence: 相似度(归一化互相关)阈值
+    :param scale: 模板的缩放比例 (横向, 纵向), 用于按分辨率换算后的脚本
+    :return: 搜索结果, 得分不低于阈值时为真
+    """
+    if confidence > 1 or confidence < 0:
+        raise ValueError("置信度范围为 [0, 1]")
+    if isinstance(template, (str, Path)):
+        template = template_cache.get(template)
+    wx, wy, ww, wh = window or (0, 0, frame.width, frame.height)
+    wx, wy, ww, wh = int(wx), int(wy), int(ww), int(wh)
+    if wx < 0 or wy < 0 or wx + ww > frame.width or wy + wh > frame.height:
+        raise ValueError(f"搜索区域 {(wx, wy, ww, wh)} 超出截图范围 {frame.width}x{frame.height}")
+    th = max(round(template.shape[0] * scale[1]), 1)
+    tw = max(round(template.shape[1] * scale[0]), 1)
+    if tw > ww or th > wh:
+        raise ValueError(f"模板 {tw}x{th} 大于搜索区域 {ww}x{wh}")
+
+    levels = _levels((th, tw), (wh, ww))
+    prepared = _prepare(template, levels, scale)
+    im = frame.image
+    if (wx, wy, ww, wh) != (0, 0, frame.width, frame.height):
+        im = im.crop((wx, wy, wx + ww, wy + wh))
+    # 灰度转换是唯一作用于整个搜索区域的操作, 各层只在需要的范围内降采样
+    gray = im.convert("L")
+
+    top = levels - 1
+    t, norm = prepared.levels[top]
+    scores = _ncc_map(_reduce(gray, 1 << top), t, norm)
+    # 候选之间至少相隔半个模板
+    radius = (max(t.shape[0] // 2, 1), max(t.shape[1] // 2, 1))
+    candidates = [(float(scores[y, x]), y, x) for y, x in _top_candidates(scores, CANDIDATES, radius)]
+    # 粗匹配已经合格的候选只需在低层细化
+    threshold = confidence - COARSE_MARGIN
+    for level in range(top - 1, -1, -1):
+        candidates = [c for c in candidates if c[0] >= threshold]
+        if not candidates:
+            break
+        t, norm = prepared.levels[level]
+        candidates = [_refine(gray, level, t, norm, y * 2, x * 2, 2) for _, y, x in candidates]
+        candidates.sort(reverse=True)
+        # 最好的候选已经达到阈值且明显领先时, 其余候选不再细化
+        if candidates[0][0] >= confidence and (len(candidates) == 1 or candidates[0][0] - candidates[1][0] > LEAD_MARGIN):
+            candidates = candidates[:1]
+
+    if not candidates:
+        return LocateResult(False, max(float(scores.max()), 0.0), (wx, wy, tw, th))
+    score, y, x = max(candidates)
+    score = max(score, 0.0)
+    return LocateResult(score >= confidence, score, (wx + x, wy + y, tw, th))
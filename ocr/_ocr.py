@@ -3,8 +3,14 @@
 """
 from io import BytesIO
 from pathlib import Path
+from typing import Sequence, Tuple
 
-from PIL import Image, ImageChops
+import numpy as np
+from PIL import Image
+
+from ._frame import Frame, box_reduce
+from ._similarity import DEFAULT_METRIC, MatchResult, similarity
+from ._template_cache import template_cache
 
 CONFIDENCE = 0.9  # 图像相似度阈值
 
@@ -14,12 +20,16 @@ def compare_img(
         y: float,
         width: float,
         height: float,
-        origin_img: str | Path | BytesIO,
-        similar_img: str | Path | BytesIO,
+        origin_img: str | Path | BytesIO | Frame | Image.Image,
+        similar_img: str | Path | BytesIO | Frame | Image.Image | np.ndarray,
         confidence: float = CONFIDENCE,
         *args,
+        resize: bool = False,
+        metric: str = DEFAULT_METRIC,
+        param: float = None,
+        reduce: int = 1,
         **kwargs,
-) -> bool:
+) -> MatchResult:
     """
     比较两张图片是否相似
 
@@ -29,39 +39,91 @@ def compare_img(
     :param width: 原始图片的宽度
     :param height: 原始图片的高度
     :param origin_img: 原始图片
-    :param similar_img: 需要对比的图片
+    :param similar_img: 需要对比的图片, 数组形式时为 (高, 宽, 3) 的 RGB 数组
     :param confidence: 相似度阈值
-    :return: 如果相似度大于阈值，则返回True，否则返回False
+    :param resize: 区域大小与对比图片不一致时, 将区域缩放到对比图片的大小(用于按分辨率缩放后的坐标)
+    :param metric: 相似度算法, exact | tolerance | mae | ncc
+    :param param: 算法参数, 如 tolerance 的单通道容差
+    :param reduce: 降采样倍数, 大于 1 时区域与对比图片先按 reduce x reduce 的块取平均缩小再比较,
+                   相似度为缩小后图像的相似度, 阈值含义不变
+    :return: 比较结果, 相似度不低于阈值时为真, 相似度为其 score 属性
     """
+    im = origin_img if isinstance(origin_img, Frame) else _open_image(origin_img)
+    return _compare(im, (x, y, width, height), similar_img, confidence, resize, metric, param, reduce)
+
+
+def compare_regions(
+        origin_img: str | Path | BytesIO | Frame | Image.Image,
+        entries: Sequence[Tuple[Tuple[float, float, float, float], str | Path | np.ndarray, float]],
+        *,
+        resize: bool = False,
+        metric: str = DEFAULT_METRIC,
+        param: float = None,
+        reduce: int = 1,
+) -> Tuple[MatchResult, ...]:
+    """
+    在同一张图片上比较多个区域, 原始图片只打开一次
+
+    :param origin_img: 原始图片
+    :param entries: ((x, y, 宽, 高), 对比图片, 相似度阈值) 的序列
+    :param resize: 同 compare_img
+    :param metric: 相似度算法, 作用于所有区域
+    :param param: 算法参数
+    :param reduce: 同 compare_img
+    :return: 与 entries 一一对应的比较结果
+    """
+    im = origin_img if isinstance(origin_img, Frame) else _open_image(origin_img)
+    return tuple(_compare(im, box, template, confidence, resize, metric, param, reduce)
+                 for box, template, confidence in entries)
+
+
+def _compare(im: Frame | Image.Image, box, similar_img, confidence: float, resize: bool, metric: str,
+             param: float, reduce: int = 1) -> MatchResult:
     if confidence > 1 or confidence < 0:
         raise ValueError("置信度范围为 [0, 1]")
 
-    im: Image.Image = Image.open(origin_img)
+    x, y, width, height = (int(v) for v in box)
     if x + width > im.width or y + height > im.height:
         raise ImageSizeException("需定位的图像位置超出范围")
-    im_s: Image.Image = Image.open(similar_img)
-    if im_s.width != width or im_s.height != height:
+    template = _open_array(similar_img, reduce)
+    if not resize and template.shape[:2] != (height // reduce, width // reduce):
         raise ImageSizeException("图片大小与需求不一致")
-    im = im.convert("RGB")
-    im_s = im_s.convert("RGB")
-    im = im.crop((x, y, x + width, y + height))
-    compare = ImageChops.difference(im, im_s)
-    # 判断对比合成图有多少RGB(0, 0, 0)像素点
-    # 如果有超过阈值的像素点，则认为两张图不相似
-    colors = compare.getcolors(maxcolors=16384)
-    all_count = len(im.getdata())
-
-    white_count = 0
-    for color in colors:
-        if color[1] == (0, 0, 0):
-            white_count += color[0]
-            break
-    now_confidence = white_count / all_count
-
-    if now_confidence > CONFIDENCE:
-        return True
+    # 只取需要比较的区域, 通道转换与降采样也只作用于该区域
+    if not isinstance(im, Frame):
+        im = Frame.from_image(im.crop((x, y, x + width, y + height)))
+        x = y = 0
+    if reduce > 1:
+        region = im.reduced(x, y, width, height, reduce)
+    else:
+        region = im.rgb(x, y, width, height, contiguous=True)
+    if region.shape != template.shape:
+        region = np.asarray(Image.fromarray(region).resize((template.shape[1], template.shape[0])))
+
+    score = similarity(region, template, metric, param)
+    return MatchResult(score >= confidence, score, metric)
+
+
+def _open_image(img: str | Path | BytesIO | Image.Image) -> Image.Image:
+    if isinstance(img, Image.Image):
+        return img
+    return Image.open(img)
+
+
+def _open_array(img: str | Path | BytesIO | Frame | Image.Image | np.ndarray, reduce: int = 1) -> np.ndarray:
+    """
+    以 (高, 宽, 3) RGB 数组形式打开对比图片, reduce 大于 1 时按该倍数降采样
+    """
+    if isinstance(img, (str, Path)):
+        # 文件路径一般是模板图, 从缓存中取
+        return template_cache.get(img, reduce)
+    if isinstance(img, np.ndarray):
+        array = img
+    elif isinstance(img, Frame):
+        array = img.rgb()
     else:
-        return False
+        im = _open_image(img)
+        array = np.asarray(im if im.mode == "RGB" else im.convert("RGB"))
+    return box_reduce(array, reduce) if reduce > 1 else array
 
 
 class ImageSizeException(BaseException):
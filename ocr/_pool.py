@@ -0,0 +1,156 @@
+"""
+图像处理进程池
+
+多台设备同时执行脚本时, 图像比较/搜索/识别在各自的执行线程中运行会互相争抢 GIL, 也会拖慢界面线程.
+进程池中的工作进程通过共享内存(multiprocessing.shared_memory)读取截图, 像素数据不经过序列化,
+任务参数(区域, 模板路径等)与返回结果都很小.
+
+共享内存块在调用之间复用, 块数不超过同时进行的调用数(执行线程结束或更换后不会增加),
+同一帧连续提交多个任务时优先取回已复制了该帧的块, 只复制一次;
+工作进程各自缓存模板, 字形图集与画面索引.
+"""
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+from ._frame import Frame
+
+# 工作进程中同时保持映射的共享内存块数, 超过时关闭最久未使用的
+ATTACH_LIMIT = 32
+
+T = TypeVar("T")
+
+# 工作进程中已映射的共享内存块, 块名 -> SharedMemory
+_attached: "OrderedDict[str, SharedMemory]" = OrderedDict()
+
+
+def _attach(name: str) -> SharedMemory:
+    if (block := _attached.get(name)) is not None:
+        _attached.move_to_end(name)
+        return block
+    block = _attached[name] = SharedMemory(name)
+    while len(_attached) > ATTACH_LIMIT:
+        _, old = _attached.popitem(last=False)
+        try:
+            old.close()
+        except BufferError:
+            # 仍有视图引用该内存块, 由垃圾回收释放
+            pass
+    return block
+
+
+def _work(func: Callable[..., T], ref: Tuple[str, int, int, int, str], args: tuple, kwargs: dict) -> T:
+    """
+    在工作进程中执行任务, ref 为 (共享内存块名, 字节数, 宽, 高, 像素格式)
+    """
+    name, nbytes, width, height, mode = ref
+    return func(Frame(_attach(name).buf[:nbytes], width, height, mode), *args, **kwargs)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+class _Slot:
+    """
+    一块共享内存, 以及最近复制进去的截图, 每次调用期间由该调用独占
+    """
+    __slots__ = ("block", "frame")
+
+    def __init__(self):
+        self.block: Optional[SharedMemory] = None
+        self.frame: Optional[Frame] = None
+
+
+class VisionPool:
+    def __init__(self, workers: int = None):
+        """
+        :param workers: 工作进程数, 默认为 CPU 核数
+        """
+        self.workers = workers or os.cpu_count() or 1
+        # 使用 spawn 启动, 不复制调用进程中的线程(Qt, adb 连接等)状态, 各平台行为一致
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        # 空闲的共享内存块, 最近归还的在末尾
+        self._idle: List[_Slot] = []
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @property
+    def slots(self) -> int:
+        """
+        已创建的共享内存块数
+        """
+        return self._created
+
+    def _checkout(self, frame: Frame) -> _Slot:
+        """
+        取出一块空闲的共享内存, 优先取已复制了该帧的块, 没有空闲块时新建
+        """
+        with self._lock:
+            for i in range(len(self._idle) - 1, -1, -1):
+                if self._idle[i].frame is frame:
+                    return self._idle.pop(i)
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+        return _Slot()
+
+    @staticmethod
+    def _share(slot: _Slot, frame: Frame) -> Tuple[str, int, int, int, str]:
+        """
+        将截图复制到共享内存块中, 同一帧只复制一次
+        """
+        nbytes = frame.data.nbytes
+        if slot.frame is not frame:
+            if slot.block is None or slot.block.size < nbytes:
+                if slot.block is not None:
+                    slot.block.close()
+                    slot.block.unlink()
+                slot.block = SharedMemory(create=True, size=nbytes)
+            slot.block.buf[:nbytes] = frame.data.cast("B")
+            slot.frame = frame
+        return slot.block.name, nbytes, frame.width, frame.height, frame.mode
+
+    def run(self, func: Callable[..., T], frame: Frame, *args, **kwargs) -> T:
+        """
+        在工作进程中执行 func(frame, *args, **kwargs) 并等待结果, 等待期间不占用 GIL
+
+        :param func: 模块级函数, 第一个参数为截图, 如 compare_regions, locate, read_regions, identify_screen
+        :param frame: 截图
+        """
+        slot = self._checkout(frame)
+        try:
+            return self._executor.submit(_work, func, self._share(slot, frame), args, kwargs).result()
+        finally:
+            with self._lock:
+                self._idle.append(slot)
+
+    def warmup(self):
+        """
+        启动所有工作进程并导入本模块, 避免第一批任务等待进程启动
+        """
+        for future in [self._executor.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+
+    def close(self):
+        """
+        关闭工作进程并释放共享内存
+        """
+        self._executor.shutdown()
+        with self._lock:
+            for slot in self._idle:
+                if slot.block is not None:
+                    slot.block.close()
+                    slot.block.unlink()
+            self._idle.clear()
+            self._created = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
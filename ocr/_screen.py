@@ -0,0 +1,174 @@
+"""
+画面识别
+
+为已标注的参考截图计算感知哈希(dHash + pHash, 共 128 位)并保存为索引,
+运行时对当前截图计算一次哈希, 在索引中查找汉明距离最近的参考图, 得到当前所处的画面
+"""
+import os
+import warnings
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+from PIL import Image
+
+from ._file_cache import FileCache
+from ._frame import Frame
+
+# 计算哈希前先对截图隔点取样, 取样后的宽度不小于 SAMPLE_WIDTH, 再缩放到哈希所需的大小
+SAMPLE_WIDTH = 256
+# pHash 的 DCT 输入大小
+HASH_SIZE = 32
+# 距离超过该值(128 位中不同的位数)时视为未知画面
+MAX_DISTANCE = 24
+# 索引文件格式版本
+INDEX_VERSION = 1
+
+# 32 点 DCT-II 变换矩阵, 只保留 pHash 用到的低频 8 行
+_DCT = np.cos(np.pi / HASH_SIZE * (np.arange(HASH_SIZE)[None, :] + 0.5) * np.arange(8)[:, None])
+_BITS = 1 << np.arange(64, dtype=np.uint64)
+
+
+class ScreenLabel(str):
+    """
+    画面识别结果, 即画面名称, distance 为与最近参考图的汉明距离
+    """
+    distance: int
+
+    def __new__(cls, label: str, distance: int):
+        self = super().__new__(cls, label)
+        self.distance = distance
+        return self
+
+    def __reduce__(self):
+        # 进程池的工作进程返回结果时需要序列化
+        return self.__class__, (str(self), self.distance)
+
+    def __repr__(self):
+        return f"ScreenLabel({str(self)!r}, distance={self.distance})"
+
+
+def _gray(image: Frame | Image.Image) -> Image.Image:
+    """
+    隔点取样缩小后转换为灰度图, 避免对整张截图做转换. 参考图与截图按同样的方式取样, 保证哈希一致
+    """
+    if not isinstance(image, Frame):
+        image = Frame.from_image(image)
+    step = max(image.width // SAMPLE_WIDTH, 1)
+    return Image.fromarray(np.ascontiguousarray(image.rgb()[::step, ::step])).convert("L")
+
+
+def _pack(bits: np.ndarray) -> np.uint64:
+    return np.bitwise_or.reduce(_BITS[bits.ravel()[:64]])
+
+
+def screen_hash(image: Frame | Image.Image) -> np.ndarray:
+    """
+    计算截图的感知哈希
+
+    :return: [dHash, pHash] 两个 uint64
+    """
+    gray = _gray(image)
+    # dHash: 9x8 灰度图中每个像素是否比右侧的像素亮
+    d = np.asarray(gray.resize((9, 8), Image.BOX), dtype=np.int16)
+    dhash = _pack(d[:, :-1] > d[:, 1:])
+    # pHash: 32x32 灰度图 DCT 后左上 8x8 低频系数(去掉直流分量)是否大于中位数
+    p = np.asarray(gray.resize((HASH_SIZE, HASH_SIZE), Image.BOX), dtype=np.float64)
+    low = (_DCT @ p @ _DCT.T).ravel()
+    phash = _pack(low > np.median(low[1:]))
+    return np.array([dhash, phash], dtype=np.uint64)
+
+
+class ScreenIndex:
+    """
+    画面索引, 同一个画面可以有多张参考图
+    """
+
+    def __init__(self, labels: Sequence[str] = (), hashes: np.ndarray = None):
+        """
+        :param labels: 每张参考图的画面名称
+        :param hashes: 形状为 (参考图数, 2) 的 uint64 哈希
+        """
+        self.labels: List[str] = list(labels)
+        self.hashes = np.zeros((0, 2), dtype=np.uint64) if hashes is None else np.asarray(hashes, dtype=np.uint64)
+        if len(self.labels) != len(self.hashes):
+            raise ValueError("画面名称数与哈希数不一致")
+
+    def __len__(self):
+        return len(self.labels)
+
+    def add(self, label: str, image: Frame | Image.Image):
+        self.labels.append(label)
+        self.hashes = np.vstack((self.hashes, screen_hash(image)[None, :]))
+
+    def lookup(self, image: Frame | Image.Image, max_distance: int = MAX_DISTANCE) -> Optional[ScreenLabel]:
+        """
+        查找截图所处的画面
+
+        :param image: 截图
+        :param max_distance: 允许的最大汉明距离
+        :return: 最近的画面名称, 没有足够接近的参考图时为 None
+        """
+        if not self.labels:
+            return None
+        # np.bitwise_count 需要 NumPy 2.0, 按字节展开成位后计数
+        distances = np.unpackbits((self.hashes ^ screen_hash(image)).view(np.uint8), axis=1).sum(axis=1, dtype=np.int64)
+        best = int(distances.argmin())
+        if distances[best] > max_distance:
+            return None
+        return ScreenLabel(self.labels[best], int(distances[best]))
+
+    @classmethod
+    def build(cls, directory: str | Path) -> "ScreenIndex":
+        """
+        从参考截图目录生成索引. 子目录名即画面名称(lobby/1.png), 或文件名去掉 _序号 后缀即画面名称(lobby_1.png)
+        """
+        index = cls()
+        for root, _, files in os.walk(directory):
+            for name in sorted(files):
+                stem, ext = os.path.splitext(name)
+                if ext.lower() not in (".png", ".jpg", ".bmp"):
+                    continue
+                if os.path.samefile(root, directory):
+                    label = stem.rsplit("_", 1)[0] if "_" in stem else stem
+                else:
+                    label = os.path.relpath(root, directory).replace(os.sep, "/")
+                try:
+                    with Image.open(os.path.join(root, name)) as im:
+                        index.add(label, im)
+                except OSError as e:
+                    warnings.warn(f"参考截图 {name} 读取失败, 已跳过: {e}")
+        return index
+
+    def save(self, path: str | Path):
+        np.savez_compressed(path, version=INDEX_VERSION, labels=np.array(self.labels), hashes=self.hashes)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "ScreenIndex":
+        with np.load(path) as data:
+            if int(data["version"]) != INDEX_VERSION:
+                raise ValueError(f"画面索引 {path} 的格式与当前版本不兼容, 请重新生成")
+            return cls([str(label) for label in data["labels"]], data["hashes"])
+
+
+_indexes = FileCache(ScreenIndex.load)
+
+
+def load_index(path: str | Path) -> ScreenIndex:
+    """
+    加载画面索引, 同一文件只加载一次
+    """
+    return _indexes.get(path)
+
+
+def identify_screen(frame: Frame, index: str | Path | ScreenIndex, max_distance: int = None) -> Optional[ScreenLabel]:
+    """
+    识别截图所处的画面
+
+    :param frame: 截图
+    :param index: 画面索引或索引文件路径
+    :param max_distance: 允许的最大汉明距离, None 表示默认值 MAX_DISTANCE
+    """
+    if not isinstance(index, ScreenIndex):
+        index = load_index(index)
+    return index.lookup(frame, MAX_DISTANCE if max_distance is None else max_distance)
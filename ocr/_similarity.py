@@ -0,0 +1,113 @@
+"""
+图像相似度计算
+
+所有算法的输入均为形状相同的 (高, 宽, 3) uint8 数组, 输出 [0, 1] 之间的相似度
+"""
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+# 默认算法, 与原先的逐像素完全一致比较相同
+DEFAULT_METRIC = "exact"
+# tolerance 算法默认的单通道容差
+DEFAULT_TOLERANCE = 16
+
+
+def _exact(a: np.ndarray, b: np.ndarray, param: Optional[float]) -> float:
+    """
+    三个通道完全相同的像素所占比例
+    """
+    # 按通道取与比沿通道轴做 all 归约快得多
+    equal = a == b
+    return float(np.count_nonzero(equal[..., 0] & equal[..., 1] & equal[..., 2])) / (a.shape[0] * a.shape[1])
+
+
+def _tolerance(a: np.ndarray, b: np.ndarray, param: Optional[float]) -> float:
+    """
+    每个通道的差值都不超过容差的像素所占比例
+    """
+    tolerance = DEFAULT_TOLERANCE if param is None else param
+    # uint8 相减会回绕, 用 max-min 得到差的绝对值
+    diff = np.maximum(a, b)
+    diff -= np.minimum(a, b)
+    within = diff[..., 0] <= tolerance
+    within &= diff[..., 1] <= tolerance
+    within &= diff[..., 2] <= tolerance
+    return float(np.count_nonzero(within)) / (a.shape[0] * a.shape[1])
+
+
+def _mae(a: np.ndarray, b: np.ndarray, param: Optional[float]) -> float:
+    """
+    1 - 平均绝对误差 / 255
+    """
+    diff = np.maximum(a, b) - np.minimum(a, b)
+    return 1.0 - float(diff.mean()) / 255
+
+
+def _ncc(a: np.ndarray, b: np.ndarray, param: Optional[float]) -> float:
+    """
+    归一化互相关, 对整体亮度和对比度的变化不敏感, 负相关视为 0
+    """
+    x = a.astype(np.float32).ravel()
+    y = b.astype(np.float32).ravel()
+    x -= x.mean()
+    y -= y.mean()
+    norm = float(np.sqrt(np.dot(x, x) * np.dot(y, y)))
+    if norm == 0:
+        # 至少一方是纯色图, 无法计算相关性; 减去均值后任意两张纯色图都相同, 改为比较原图的平均绝对误差
+        return _mae(a, b, param)
+    return max(float(np.dot(x, y)) / norm, 0.0)
+
+
+METRICS: Dict[str, Callable[[np.ndarray, np.ndarray, Optional[float]], float]] = {
+    "exact": _exact,
+    "tolerance": _tolerance,
+    "mae": _mae,
+    "ncc": _ncc,
+}
+
+
+def similarity(a: np.ndarray, b: np.ndarray, metric: str = DEFAULT_METRIC, param: float = None) -> float:
+    """
+    计算两张图的相似度
+
+    :param a: (高, 宽, 3) uint8 数组
+    :param b: 与 a 形状相同的数组
+    :param metric: 算法名, 见 METRICS
+    :param param: 算法参数(tolerance 的容差), None 表示默认值
+    :return: [0, 1] 之间的相似度
+    """
+    if a.shape != b.shape:
+        raise ValueError(f"图像形状不一致: {a.shape} != {b.shape}")
+    try:
+        func = METRICS[metric]
+    except KeyError:
+        raise ValueError(f"未知的相似度算法: {metric}")
+    return func(a, b, param)
+
+
+class MatchResult:
+    """
+    图像比较结果
+    可直接作为布尔值使用(与 True / False 比较相等), 相似度通过 score 获取
+    """
+    __slots__ = ("matched", "score", "metric")
+
+    def __init__(self, matched: bool, score: float, metric: str = DEFAULT_METRIC):
+        self.matched = matched
+        self.score = score
+        self.metric = metric
+
+    def __bool__(self):
+        return self.matched
+
+    def __eq__(self, other):
+        if isinstance(other, MatchResult):
+            return self.matched == other.matched
+        return self.matched == other
+
+    def __hash__(self):
+        return hash(self.matched)
+
+    def __repr__(self):
+        return f"MatchResult({self.matched}, score={self.score:.4f}, metric={self.metric!r})"
@@ -0,0 +1,110 @@
+"""
+模板图缓存
+
+模板图解码为 RGB 数组后按 路径+修改时间 缓存, 超出内存预算时淘汰最久未使用的模板.
+降采样后的模板另外以 <模板文件名>.r<倍数>.npy 保存在模板旁边, 之后直接读取
+"""
+import os
+import threading
+import warnings
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, Tuple
+
+import numpy as np
+from PIL import Image
+
+from ._frame import box_reduce
+
+# 默认内存预算(字节)
+MEMORY_BUDGET = 64 * 1024 * 1024
+
+
+class TemplateCache:
+    def __init__(self, budget: int = MEMORY_BUDGET):
+        """
+        :param budget: 缓存的模板图像素数据总大小上限(字节)
+        """
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._images: OrderedDict[Tuple[str, int, int], np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(path: str | Path, reduce: int) -> Tuple[str, int, int]:
+        path = os.path.abspath(path)
+        return path, os.stat(path).st_mtime_ns, reduce
+
+    def get(self, path: str | Path, reduce: int = 1) -> np.ndarray:
+        """
+        获取解码后的模板图, 返回形状为 (高, 宽, 3) 的只读数组, 为共享对象
+
+        :param path: 模板图路径
+        :param reduce: 降采样倍数, 大于 1 时返回按 box_reduce 降采样后的模板
+        """
+        key = self._key(path, reduce)
+        with self._lock:
+            if (im := self._images.get(key)) is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return im
+            self.misses += 1
+
+        im = self._load(key[0], reduce)
+        im.setflags(write=False)
+
+        with self._lock:
+            # 文件被修改后旧的缓存不再使用
+            for old in [k for k in self._images if k[0] == key[0] and k[1] != key[1]]:
+                self.size -= self._images.pop(old).nbytes
+            if key not in self._images:
+                self._images[key] = im
+                self.size += im.nbytes
+            while self.size > self.budget and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self.size -= evicted.nbytes
+        return im
+
+    def _load(self, path: str, reduce: int) -> np.ndarray:
+        if reduce == 1:
+            with Image.open(path) as f:
+                return np.asarray(f.convert("RGB"))
+        # 降采样结果比模板图新时直接读取
+        reduced_path = f"{path}.r{reduce}.npy"
+        try:
+            if os.stat(reduced_path).st_mtime_ns >= os.stat(path).st_mtime_ns:
+                return np.load(reduced_path)
+        except (OSError, ValueError, EOFError):
+            # 不存在或不完整的文件, 重新降采样
+            pass
+        im = box_reduce(self.get(path), reduce)
+        # 先写入临时文件再替换, 同时加载同一模板的执行器不会读到不完整的文件
+        tmp = f"{reduced_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                np.save(f, im)
+            os.replace(tmp, reduced_path)
+        except OSError:
+            # 模板目录不可写时只缓存在内存中
+            pass
+        return im
+
+    def preload(self, paths: Iterable[str | Path], reduce: int = 1):
+        """
+        预先加载模板图, 不存在的文件只给出警告
+        """
+        for path in paths:
+            try:
+                self.get(path, reduce)
+            except OSError as e:
+                warnings.warn(f"模板图加载失败: {path}: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self.size = 0
+
+
+template_cache = TemplateCache()